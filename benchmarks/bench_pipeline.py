@@ -0,0 +1,318 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#    A copy of the GNU General Public License is available at
+#    http://www.gnu.org/licenses/gpl-3.0.html
+
+"""Benchmark the debruijn pipeline on synthetic genomes and reads."""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '../debruijn')))
+import debruijn
+
+NUCLEOTIDES = np.frombuffer(b"ACGT", dtype=np.uint8)
+# Qualités façon ART : élevées sur les bases justes, basses sur les erreurs
+QUALITE_JUSTE = 40
+QUALITE_ERREUR = 10
+
+
+def parse_size(texte):
+    """
+    La fonction parse_size prend en entrée
+    texte : une taille (str) éventuellement suffixée par k, M ou G
+    renvoit la taille (integer)
+    """
+    multiplicateurs = {"k": 10 ** 3, "m": 10 ** 6, "g": 10 ** 9}
+    texte = texte.strip().lower().rstrip("b")
+    if texte[-1:] in multiplicateurs:
+        return int(float(texte[:-1]) * multiplicateurs[texte[-1]])
+    return int(texte)
+
+
+def get_arguments():
+    """Retrieves the arguments of the program.
+      Returns: An object that contains the arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__, usage=
+                                     "{0} -h"
+                                     .format(sys.argv[0]))
+    parser.add_argument('--sizes', dest='sizes', type=str,
+                        default="10k,100k,1M", help="Comma separated genome "
+                        "sizes, e.g. 10k,1M,100M (default 10k,100k,1M)")
+    parser.add_argument('-k', dest='kmer_size', type=int,
+                        default=21, help="K-mer size (default 21)")
+    parser.add_argument('--coverage', dest='coverage', type=float,
+                        default=20, help="Read coverage (default 20)")
+    parser.add_argument('--read-length', dest='read_length', type=int,
+                        default=100, help="Read length (default 100)")
+    parser.add_argument('--error-rate', dest='error_rate', type=float,
+                        default=0.001, help="Substitution rate per base "
+                        "(default 0.001)")
+    parser.add_argument('--repeat-fraction', dest='repeat_fraction',
+                        type=float, default=0.05, help="Fraction of the "
+                        "genome made of repeat copies (default 0.05)")
+    parser.add_argument('--repeat-length', dest='repeat_length', type=int,
+                        default=500, help="Length of a repeat (default 500)")
+    parser.add_argument('--seed', dest='seed', type=int,
+                        default=9001, help="Random seed (default 9001)")
+    parser.add_argument('--canonical', dest='canonical', action='store_true',
+                        help="Sample both strands and count canonical "
+                        "k-mers")
+    parser.add_argument('--full-graph', dest='full_graph',
+                        action='store_true', help="Build the uncompacted "
+                        "k-mer graph instead of the unitig graph")
+    parser.add_argument('--memory', dest='memory', action='store_true',
+                        help="Trace peak Python allocations per stage "
+                        "(tracemalloc, slower)")
+    parser.add_argument('--workdir', dest='workdir', type=str,
+                        help="Directory for the generated files "
+                        "(default: a temporary directory)")
+    parser.add_argument('-o', dest='output_file', type=str,
+                        help="Write results as JSON to this file "
+                        "(default stdout)")
+    parser.add_argument('--compare', dest='compare_file', type=str,
+                        help="Previous JSON results to compare with")
+    return parser.parse_args()
+
+
+def generate_genome(taille, fraction_repetee=0.05, longueur_repetition=500,
+                    graine=9001):
+    """
+    La fonction generate_genome prend en entrée
+    taille : la taille du génome (integer)
+    fraction_repetee : la part du génome couverte par des copies d'une
+    même répétition (float)
+    longueur_repetition : la longueur de la répétition (integer)
+    graine : la graine du générateur (integer)
+    renvoit un génome aléatoire (bytes), identique pour une même graine
+    """
+    generateur = np.random.default_rng(graine)
+    genome = NUCLEOTIDES[generateur.integers(0, 4, taille)]
+    longueur_repetition = min(longueur_repetition, taille // 4)
+    nb_copies = int(taille * fraction_repetee) // max(1, longueur_repetition)
+    if nb_copies > 1 and longueur_repetition:
+        repetition = genome[:longueur_repetition].copy()
+        debuts = generateur.choice(taille // longueur_repetition, nb_copies,
+                                   replace=False) * longueur_repetition
+        for debut in debuts:
+            genome[debut:debut + longueur_repetition] = repetition
+    return genome.tobytes()
+
+
+def simulate_reads(genome, fichier, longueur=100, couverture=20,
+                   taux_erreur=0.001, deux_brins=False, graine=9001):
+    """
+    La fonction simulate_reads prend en entrée
+    genome : le génome (bytes)
+    fichier : le fichier fastq à écrire (str)
+    longueur : la longueur des lectures (integer)
+    couverture : la couverture moyenne (float)
+    taux_erreur : le taux de substitution par base (float)
+    deux_brins : tirer aussi des lectures sur le brin complémentaire
+    graine : la graine du générateur (integer)
+    renvoit le nombre de lectures écrites (integer)
+    """
+    generateur = np.random.default_rng(graine)
+    sequence = np.frombuffer(genome, dtype=np.uint8)
+    longueur = min(longueur, len(sequence))
+    nb_lectures = int(len(sequence) * couverture / longueur)
+    complement = np.zeros(256, dtype=np.uint8)
+    complement[NUCLEOTIDES] = NUCLEOTIDES[::-1]
+    colonnes = np.arange(longueur)
+    with open(fichier, "wb") as filout:
+        for debut_lot in range(0, nb_lectures, debruijn.READS_PAR_LOT):
+            taille_lot = min(debruijn.READS_PAR_LOT,
+                             nb_lectures - debut_lot)
+            debuts = generateur.integers(0, len(sequence) - longueur + 1,
+                                         taille_lot)
+            lectures = sequence[debuts[:, None] + colonnes[None, :]]
+            if deux_brins:
+                inverses = generateur.random(taille_lot) < 0.5
+                lectures[inverses] = complement[lectures[inverses, ::-1]]
+            erreurs = generateur.random(lectures.shape) < taux_erreur
+            # une substitution change toujours la base
+            decalages = generateur.integers(1, 4, int(erreurs.sum()))
+            codes = np.searchsorted(NUCLEOTIDES, lectures[erreurs])
+            lectures[erreurs] = NUCLEOTIDES[(codes + decalages) % 4]
+            qualites = np.where(erreurs, QUALITE_ERREUR,
+                                QUALITE_JUSTE).astype(np.uint8) + 33
+            for numero in range(taille_lot):
+                filout.write(b"@read_%d\n%s\n+\n%s\n" % (
+                    debut_lot + numero, lectures[numero].tobytes(),
+                    qualites[numero].tobytes()))
+    return nb_lectures
+
+
+def measure(etape, fonction, resultats, memoire=False):
+    """
+    La fonction measure prend en entrée
+    etape : le nom de l'étape (str)
+    fonction : la fonction sans argument à exécuter
+    resultats : la liste où ajouter la mesure (dict)
+    memoire : tracer le pic d'allocation Python (tracemalloc)
+    renvoit le résultat de fonction
+    """
+    if memoire:
+        tracemalloc.start()
+    cpu = time.process_time()
+    debut = time.perf_counter()
+    valeur = fonction()
+    mesure = {"stage": etape,
+              "seconds": time.perf_counter() - debut,
+              "cpu_seconds": time.process_time() - cpu,
+              "max_rss_kb": resource.getrusage(
+                  resource.RUSAGE_SELF).ru_maxrss}
+    if memoire:
+        mesure["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    resultats.append(mesure)
+    return valeur
+
+
+def run_scale(taille, args, dossier):
+    """
+    La fonction run_scale prend en entrée
+    taille : la taille du génome (integer)
+    args : les arguments du programme
+    dossier : le dossier des fichiers générés (str)
+    renvoit les mesures de chaque étape du pipeline (liste de dict)
+    """
+    resultats = []
+    fastq = os.path.join(dossier, "reads_{0}.fq".format(taille))
+    genome = measure("generate_genome", lambda: generate_genome(
+        taille, args.repeat_fraction, args.repeat_length, args.seed),
+                     resultats)
+    nb_lectures = measure("simulate_reads", lambda: simulate_reads(
+        genome, fastq, args.read_length, args.coverage, args.error_rate,
+        args.canonical, args.seed), resultats)
+    resultats[-1]["items"] = nb_lectures
+    reference = os.path.join(dossier, "genome_{0}.fna".format(taille))
+    debruijn.save_contigs([(genome, len(genome))], reference)
+    del genome
+    kmers = measure("build_kmer_dict", lambda: debruijn.build_kmer_dict(
+        fastq, args.kmer_size, args.canonical), resultats, args.memory)
+    resultats[-1]["items"] = len(kmers)
+    if args.full_graph:
+        graphe = measure("build_graph", lambda: debruijn.build_graph(kmers),
+                         resultats, args.memory)
+    else:
+        graphe = measure("build_compacted_graph",
+                         lambda: debruijn.build_compacted_graph(kmers),
+                         resultats, args.memory)
+    resultats[-1]["items"] = graphe.number_of_nodes()
+    del kmers
+    rapport = {}
+    graphe = measure("simplify_bubbles", lambda: debruijn.simplify_bubbles(
+        graphe, rapport, 2 * args.kmer_size + debruijn.MARGE_BULLE),
+                     resultats, args.memory)
+    graphe = measure("solve_entry_tips", lambda: debruijn.solve_entry_tips(
+        graphe, debruijn.get_starting_nodes(graphe), rapport), resultats,
+                     args.memory)
+    graphe = measure("solve_out_tips", lambda: debruijn.solve_out_tips(
+        graphe, debruijn.get_sink_nodes(graphe), rapport), resultats,
+                     args.memory)
+    for mesure in resultats[-3:]:
+        passe = mesure["stage"].replace("solve_", "").replace("simplify_",
+                                                              "")
+        mesure["items"] = rapport.get(passe, {}).get("removed", 0)
+    if not args.full_graph:
+        graphe = measure("compact_graph",
+                         lambda: debruijn.compact_graph(graphe), resultats,
+                         args.memory)
+        resultats[-1]["items"] = graphe.number_of_nodes()
+    contigs = os.path.join(dossier, "contigs_{0}.fasta".format(taille))
+    resume = measure("save_contigs", lambda: debruijn.save_contigs(
+        debruijn.iter_unitigs(graphe), contigs),
+                     resultats, args.memory)
+    resultats[-1]["items"] = resume["contigs"]
+    resultats[-1]["n50"] = resume["n50"]
+    evaluation = measure("evaluate_contigs", lambda: debruijn.evaluate_contigs(
+        contigs, reference), resultats, args.memory)
+    resultats[-1]["items"] = evaluation["contigs"]
+    resultats[-1]["quality"] = evaluation
+    os.remove(fastq)
+    os.remove(contigs)
+    os.remove(reference)
+    for mesure in resultats:
+        mesure["genome_size"] = taille
+    return resultats
+
+
+def git_revision():
+    """
+    renvoit le commit courant du dépôt (str), ou None hors d'un dépôt git
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(
+                os.path.abspath(__file__)), capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(anciens, nouveaux):
+    """
+    Affiche sur la sortie d'erreur le rapport des durées de chaque étape
+    entre deux résultats (dict)
+    """
+    references = {(mesure["genome_size"], mesure["stage"]): mesure
+                  for mesure in anciens["results"]}
+    for mesure in nouveaux["results"]:
+        reference = references.get((mesure["genome_size"], mesure["stage"]))
+        if reference is None or not reference["seconds"]:
+            continue
+        print("{0:>12} {1:<22} {2:8.3f} s -> {3:8.3f} s  x{4:.2f}".format(
+            mesure["genome_size"], mesure["stage"], reference["seconds"],
+            mesure["seconds"], mesure["seconds"] / reference["seconds"]),
+              file=sys.stderr)
+
+
+def main():
+    """
+    Main program function
+    """
+    args = get_arguments()
+    tailles = [parse_size(taille) for taille in args.sizes.split(",")]
+    resultats = {"revision": git_revision(),
+                 "python": platform.python_version(),
+                 "numpy": np.__version__,
+                 "parameters": {cle: valeur for cle, valeur in
+                                vars(args).items()
+                                if cle not in ("output_file", "workdir",
+                                               "compare_file")},
+                 "results": []}
+    with tempfile.TemporaryDirectory(dir=args.workdir) as dossier:
+        for taille in tailles:
+            resultats["results"].extend(run_scale(taille, args, dossier))
+    if args.output_file:
+        with open(args.output_file, "w") as filout:
+            json.dump(resultats, filout, indent=2)
+    else:
+        json.dump(resultats, sys.stdout, indent=2)
+        print()
+    if args.compare_file:
+        with open(args.compare_file) as filin:
+            compare(json.load(filin), resultats)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,13 +14,32 @@
 """Perform assembly based on debruijn graph."""
 
 import argparse
+import contextlib
+import cProfile
+import json
+import math
+from collections import Counter, deque
+import gzip
+import hashlib
+import io
+import mmap
+import multiprocessing
 import os
+import pstats
+import resource
+import shutil
 import sys
+import tempfile
+import time
+import tracemalloc
 import statistics
+import struct
 import random
+from collections.abc import ItemsView, Mapping
+import numpy as np
 import networkx as nx
-import matplotlib.pyplot as plt
-random.seed(9001)
+GRAINE = 9001
+random.seed(GRAINE)
 
 
 
@@ -47,6 +66,50 @@ def isfile(path):
     return path
 
 
+def kmer_size(texte):
+    """Check the -k value: a k-mer size, 'auto' or comma separated
+    increasing sizes (returned as a tuple).
+      :Parameters:
+          texte: -k argument
+    """
+    if texte == "auto":
+        return texte
+    try:
+        tailles = tuple(sorted({int(taille) for taille in texte.split(",")}))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "{0} is not a k-mer size".format(texte))
+    if not all(0 < taille <= KMER_MAX for taille in tailles):
+        raise argparse.ArgumentTypeError(
+            "k-mer size must be between 1 and {0}".format(KMER_MAX))
+    if len(tailles) == 1:
+        return tailles[0]
+    return tailles
+
+
+def memory_size(texte):
+    """Check a memory size such as 512M or 2G (returned in bytes).
+      :Parameters:
+          texte: --max-memory argument
+    """
+    valeur = texte.strip().upper()
+    if valeur.endswith("B"):
+        valeur = valeur[:-1]
+    facteur = 1
+    if valeur[-1:] in UNITES_MEMOIRE:
+        facteur = UNITES_MEMOIRE[valeur[-1]]
+        valeur = valeur[:-1]
+    try:
+        taille = int(float(valeur) * facteur)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "{0} is not a memory size".format(texte))
+    if taille < MEMOIRE_MIN:
+        raise argparse.ArgumentTypeError(
+            "memory budget must be at least {0}M".format(MEMOIRE_MIN >> 20))
+    return taille
+
+
 def get_arguments():
     """Retrieves the arguments of the program.
       Returns: An object that contains the arguments
@@ -56,19 +119,829 @@ def get_arguments():
                                      "{0} -h"
                                      .format(sys.argv[0]))
     parser.add_argument('-i', dest='fastq_file', type=isfile,
-                        required=True, help="Fastq file")
-    parser.add_argument('-k', dest='kmer_size', type=int,
-                        default=21, help="K-mer size (default 21)")
+                        help="Fastq file (required unless --resume-from)")
+    parser.add_argument('-k', dest='kmer_size', type=kmer_size,
+                        default=21, help="K-mer size, 'auto' to choose it "
+                        "from a sample of the reads, or increasing sizes "
+                        "such as 21,27,31 for an iterative assembly "
+                        "(default 21)")
+    parser.add_argument('--auto-k-reads', dest='auto_k_reads', type=int,
+                        default=LECTURES_ECHANTILLON, help="Number of "
+                        "reads sampled by -k auto (default {0})"
+                        .format(LECTURES_ECHANTILLON))
     parser.add_argument('-o', dest='output_file', type=str,
                         default=os.curdir + os.sep + "contigs.fasta",
                         help="Output contigs in fasta file")
-    return parser.parse_args()
+    parser.add_argument('--canonical', dest='canonical', action='store_true',
+                        help="Count each k-mer with its reverse complement "
+                        "(unstranded reads)")
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        default=1, help="Number of k-mer counting "
+                        "processes (default 1)")
+    parser.add_argument('--trim', dest='trim', action='store_true',
+                        help="Trim low quality 3' ends, split reads at N "
+                        "and drop short fragments before counting")
+    parser.add_argument('--min-quality', dest='min_quality', type=int,
+                        default=20, help="Phred quality threshold of "
+                        "--trim (default 20)")
+    parser.add_argument('--min-length', dest='min_length', type=int,
+                        help="Shortest fragment kept by --trim "
+                        "(default: the k-mer size)")
+    parser.add_argument('--min-abundance', dest='min_abundance', type=int,
+                        default=1, help="Discard k-mers seen fewer times "
+                        "(default 1)")
+    parser.add_argument('--bloom-size', dest='bloom_size', type=int,
+                        help="Expected number of distinct k-mers used to "
+                        "size the Bloom filter (default: estimated from "
+                        "the input size)")
+    parser.add_argument('--bloom-fpr', dest='bloom_fpr', type=float,
+                        default=TAUX_FAUX_POSITIFS, help="Bloom filter "
+                        "false positive rate (default {0})"
+                        .format(TAUX_FAUX_POSITIFS))
+    parser.add_argument('--max-memory', dest='max_memory', type=memory_size,
+                        help="Count k-mers on disk within this memory "
+                        "budget (e.g. 512M, 2G): reads are split into "
+                        "super-k-mers partitioned by minimizer, each "
+                        "partition being counted on its own (ignores "
+                        "--threads and the Bloom filter)")
+    parser.add_argument('--index', dest='index_file', type=str,
+                        help="K-mer count index to reuse, or to create if "
+                        "missing or stale")
+    parser.add_argument('--cache', dest='cache', action='store_true',
+                        help="Reuse the k-mer count index cached for the "
+                        "same input file and counting options, or create "
+                        "it (hashes the whole input on each run)")
+    parser.add_argument('--cache-dir', dest='cache_dir', type=str,
+                        help="Directory of the --cache k-mer indexes "
+                        "(default $XDG_CACHE_HOME/debruijn)")
+    parser.add_argument('--compact', dest='compact', action='store_true',
+                        help="Build a compacted graph whose nodes are "
+                        "unitigs")
+    parser.add_argument('--unitigs', dest='unitigs', action='store_true',
+                        default=True, help="Output maximal non-branching "
+                        "paths, in linear time (default)")
+    parser.add_argument('--paths', dest='unitigs', action='store_false',
+                        help="Output the shortest path of every connected "
+                        "entry and sink pair instead of unitigs (one "
+                        "traversal per entry node)")
+    parser.add_argument('--components', dest='components',
+                        action='store_true', help="Simplify the graph and "
+                        "extract contigs per weakly connected component, "
+                        "with --threads processes")
+    parser.add_argument('--no-simplify', dest='simplify', action='store_false',
+                        help="Skip bubble and tip removal")
+    parser.add_argument('--max-bubble-length', dest='max_bubble_length',
+                        type=int, help="Maximum length (bp) of a bubble "
+                        "path, larger bubbles are left untouched "
+                        "(default 2k+{0})".format(MARGE_BULLE))
+    parser.add_argument('--max-bubble-paths', dest='max_bubble_paths',
+                        type=int, default=CHEMINS_BULLE,
+                        help="Maximum number of alternative paths in a "
+                        "bubble, larger bubbles are left untouched "
+                        "(default {0})".format(CHEMINS_BULLE))
+    parser.add_argument('--plot', dest='plot_file', type=str,
+                        help="Draw the graph in this image file")
+    parser.add_argument('--max-plot-nodes', dest='max_plot_nodes', type=int,
+                        default=500, help="Maximum number of nodes drawn, "
+                        "larger graphs are compacted then sampled "
+                        "(default 500)")
+    parser.add_argument('--graphml', dest='graphml_file', type=str,
+                        help="Save the graph in GraphML format")
+    parser.add_argument('--stats', dest='stats', type=str,
+                        choices=["text", "json"], help="Report wall time, "
+                        "CPU time, RSS and item counts per stage; the RSS "
+                        "is the process peak so far (ru_maxrss) and its "
+                        "increase during the stage")
+    parser.add_argument('--stats-file', dest='stats_file', type=str,
+                        help="Write the --stats report to this file "
+                        "(default stderr)")
+    parser.add_argument('--profile', dest='profile', action='store_true',
+                        help="Profile each stage with cProfile and "
+                        "tracemalloc (implies --stats text)")
+    parser.add_argument('--gfa', dest='gfa_file', type=str,
+                        help="Save the graph in GFA1 format")
+    parser.add_argument('--checkpoint-dir', dest='checkpoint_dir', type=str,
+                        help="Save a binary graph checkpoint in this "
+                        "directory after construction and after each "
+                        "simplification stage")
+    parser.add_argument('--resume-from', dest='resume_from', type=str,
+                        help="Restart from a graph checkpoint, or from the "
+                        "most advanced checkpoint of a directory, instead "
+                        "of counting the reads of -i")
+    parser.add_argument('--update', dest='update', type=str,
+                        help="Incremental assembly state directory: add "
+                        "the reads of -i to the saved k-mer counts and "
+                        "graph, then simplify again only the components "
+                        "they touch (created by a full assembly when "
+                        "missing). -k (unless auto), --canonical and "
+                        "--min-abundance must match the saved assembly")
+    parser.add_argument('--manifest', dest='manifest', type=isfile,
+                        help="Assemble every sample of this tab separated "
+                        "file (reads file, contigs file, optional sample "
+                        "name; relative paths from the manifest directory) "
+                        "on a pool of --threads processes kept for the "
+                        "whole batch, instead of -i and -o. Per-sample "
+                        "stats are written to <contigs>.stats.json and "
+                        "the batch report to --stats-file")
+    parser.add_argument('--reference', dest='reference', type=isfile,
+                        help="Evaluate the contigs against this reference "
+                        "genome: k-mer containment, genome fraction, "
+                        "misassembly breakpoints, N50/NG50 and duplication "
+                        "ratio (added to --stats)")
+    parser.add_argument('--evaluate', dest='evaluate', type=isfile,
+                        help="Only evaluate this contigs file against "
+                        "--reference, without assembling")
+    parser.add_argument('--eval-file', dest='eval_file', type=str,
+                        help="Write the evaluation to this file (json if "
+                        "it ends with .json, default stderr)")
+    args = parser.parse_args()
+    if args.evaluate:
+        if not args.reference:
+            parser.error("--evaluate needs --reference")
+        return args
+    if args.manifest:
+        uniques = [option for option, valeur in (
+            ("-i", args.fastq_file), ("--update", args.update),
+            ("--resume-from", args.resume_from), ("--index", args.index_file),
+            ("--checkpoint-dir", args.checkpoint_dir),
+            ("--plot", args.plot_file), ("--graphml", args.graphml_file),
+            ("--gfa", args.gfa_file)) if valeur]
+        if uniques:
+            parser.error("--manifest cannot be used with {0}".format(
+                ", ".join(uniques)))
+        return args
+    if args.fastq_file is None and args.resume_from is None:
+        parser.error("the following arguments are required: -i")
+    if args.update and (args.fastq_file is None or args.compact or
+                        isinstance(args.kmer_size, tuple)):
+        parser.error("--update needs -i and a single k-mer size, without "
+                     "--compact")
+    if args.max_memory is not None and (args.update or
+                                        isinstance(args.kmer_size, tuple)):
+        parser.error("--max-memory cannot be used with --update or "
+                     "several k-mer sizes")
+    if isinstance(args.kmer_size, tuple):
+        # les k-mers de chaque k sont comptés sur les reads codés en
+        # mémoire, par un seul processus et sans index
+        ignorees = [option for option, valeur in (
+            ("-t (without --components)",
+             args.threads > 1 and not args.components),
+            ("--cache", args.cache), ("--index", args.index_file)) if valeur]
+        if ignorees:
+            parser.error("several k-mer sizes cannot be used with {0}"
+                         .format(", ".join(ignorees)))
+    return args
 
 
 ##########################################################
 ########### 1. Création du graphe de de Bruijn ###########
 ##########################################################
 
+# Codage 2 bits des nucléotides : A=0, C=1, G=2, T=3, 4 pour toute autre base
+NUCLEOTIDES = "ACGT"
+CODE_INVALIDE = 4
+TABLE_CODAGE = np.full(256, CODE_INVALIDE, dtype=np.uint8)
+for _code, _base in enumerate(NUCLEOTIDES):
+    TABLE_CODAGE[ord(_base)] = _code
+    TABLE_CODAGE[ord(_base.lower())] = _code
+TABLE_DECODAGE = np.frombuffer(NUCLEOTIDES.encode(), dtype=np.uint8)
+COMPLEMENT = str.maketrans("ACGTacgt", "TGCAtgca")
+KMER_MAX = 32
+READS_PAR_LOT = 10000
+PROFONDEUR_BULLE = 100
+MARGE_BULLE = 10
+CHEMINS_BULLE = 16
+LOTS_PAR_PROCESSUS = 8
+MORCEAUX_PAR_PROCESSUS = 4
+TAUX_FAUX_POSITIFS = 0.01
+# Index de k-mers : en-tête (magique, version du format, k, canonical,
+# min_abundance, nombre de k-mers, empreinte sha256 du fichier lu,
+# version du programme, reads lus, k-mers comptés et bilan du
+# prétraitement : bases lues, fragments et bases gardés) suivi des clés
+# uint64 triées puis des occurences uint32
+MAGIC_INDEX = b"DBGKIDX\0"
+FORMAT_INDEX = 3
+ENTETE_INDEX = struct.Struct("<8sHBBIQ32s16sQQQQQ")
+TAMPON_ECRITURE = 1 << 20
+# -k auto : reads échantillonnés, tailles candidates et écart relatif au
+# meilleur nombre de k-mers génomiques toléré pour préférer un k plus grand
+LECTURES_ECHANTILLON = 100000
+K_CANDIDATS = range(15, KMER_MAX + 1, 2)
+TOLERANCE_K = 0.01
+LARGEUR_FASTA = 80
+BLOC_GZIP = 1 << 22
+MAGIC_GZIP = b"\x1f\x8b"
+# Comptage externe (--max-memory) : longueur des minimiseurs, mémoire
+# de travail par base de fastq (k-mers uint64 d'une partition et tri),
+# nombre maximal de partitions (fichiers ouverts simultanément), nombre
+# de descripteurs laissés au reste du programme et enregistrements
+# (k-mer, occurence) des tranches triées
+LONGUEUR_MINIMISEUR = 11
+OCTETS_PAR_BASE = 48
+PARTITIONS_MAX = 512
+FICHIERS_RESERVES = 64
+ENREGISTREMENT_KMER = np.dtype([("cle", "<u8"), ("occurence", "<u4")])
+UNITES_MEMOIRE = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+MEMOIRE_MIN = 1 << 20
+# Point de reprise du graphe : en-tête (magique, version du format, k,
+# étape atteinte, nombres de noeuds, d'arcs et de bases, taille de la
+# description json, version du programme) ; étapes dans leur ordre
+MAGIC_GRAPHE = b"DBGGRPH\0"
+FORMAT_GRAPHE = 1
+ENTETE_GRAPHE = struct.Struct("<8sHB16sQQQI16s")
+ETAPES_GRAPHE = ("build_graph", "components", "simplify_bubbles",
+                 "solve_tips", "compact_graph")
+# Evaluation des contigs : taille des k-mers comparés à la référence et
+# décalage (pb) entre deux ancres d'un contig compté comme une cassure
+K_EVALUATION = 31
+ECART_MAUVAIS_ASSEMBLAGE = 100
+# Etat d'un assemblage incrémental (--update)
+FICHIERS_MISE_A_JOUR = {"state": "state.json", "index": "kmers.kidx",
+                        "graph": "build_graph.dbg",
+                        "simplified": "components.dbg",
+                        "contigs": "contigs.fasta"}
+
+
+def encode_sequence(seq):
+    """
+    La fonction encode_sequence prend en entrée
+    seq : une séquence (str ou bytes)
+    renvoit un tableau numpy uint8 des codes 2 bits de chaque base
+    (CODE_INVALIDE pour les bases autres que ACGT)
+    """
+    if isinstance(seq, str):
+        seq = seq.encode("ascii")
+    return TABLE_CODAGE[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def encode_kmer(kmer):
+    """
+    La fonction encode_kmer prend en entrée
+    kmer : un k-mer (str) d'au plus 32 bases ACGT
+    renvoit l'entier correspondant au k-mer codé sur 2 bits par base
+    """
+    valeur = 0
+    for base in kmer:
+        valeur = (valeur << 2) | NUCLEOTIDES.index(base.upper())
+    return valeur
+
+
+def reverse_complement(seq):
+    """
+    La fonction reverse_complement prend en entrée
+    seq : une séquence (str)
+    renvoit le reverse complément de la séquence (str)
+    """
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def canonical_kmer(kmer):
+    """
+    La fonction canonical_kmer prend en entrée
+    kmer : un k-mer (str)
+    renvoit la plus petite des deux formes du k-mer (brin direct ou
+    reverse complément)
+    """
+    return min(kmer, reverse_complement(kmer))
+
+
+def decode_kmers(valeurs, k):
+    """
+    La fonction decode_kmers prend en entrée
+    valeurs : un tableau numpy uint64 de k-mers codés
+    k : la taille du k-mer (integer)
+    renvoit la liste des k-mers (str) correspondants
+    """
+    valeurs = np.asarray(valeurs, dtype=np.uint64)
+    decalages = np.arange(2 * (k - 1), -1, -2, dtype=np.uint64)
+    codes = (valeurs[:, None] >> decalages[None, :]) & np.uint64(3)
+    texte = TABLE_DECODAGE[codes].tobytes().decode("ascii")
+    return [texte[i:i+k] for i in range(0, len(texte), k)]
+
+
+def reverse_complement_kmers(valeurs, k):
+    """
+    La fonction reverse_complement_kmers prend en entrée
+    valeurs : un tableau numpy uint64 de k-mers codés
+    k : la taille du k-mer (integer)
+    renvoit le tableau des reverse compléments codés
+    """
+    valeurs = ~np.asarray(valeurs, dtype=np.uint64)
+    # inversion de l'ordre des groupes de 2 bits
+    paires = np.uint64(0x3333333333333333)
+    quartets = np.uint64(0x0F0F0F0F0F0F0F0F)
+    valeurs = ((valeurs >> np.uint64(2)) & paires) | \
+        ((valeurs & paires) << np.uint64(2))
+    valeurs = ((valeurs >> np.uint64(4)) & quartets) | \
+        ((valeurs & quartets) << np.uint64(4))
+    return valeurs.byteswap() >> np.uint64(64 - 2 * k)
+
+
+def pack_kmers(codes, k, canonical=False):
+    """
+    La fonction pack_kmers prend en entrée
+    codes : un tableau numpy uint8 issu de encode_sequence
+    k : la taille du k-mer (integer, au plus 32)
+    canonical : garder le minimum du k-mer et de son reverse complément
+    renvoit un tableau numpy uint64 des k-mers codés de toutes les
+    fenêtres ne contenant que des bases ACGT
+
+    Chaque base entre dans toutes les fenêtres à la fois par décalage
+    de 2 bits : on évite ainsi de découper une chaîne par position.
+    Le reverse complément se construit de la même façon, en faisant
+    entrer le complément de chaque base par la gauche.
+    """
+    kmers, valides = window_kmers(codes, k, canonical)
+    return kmers[valides]
+
+
+def window_kmers(codes, k, canonical=False):
+    """
+    La fonction window_kmers prend en entrée les paramètres de
+    pack_kmers
+    renvoit les k-mers codés (uint64) de toutes les fenêtres, y compris
+    celles qui contiennent une base invalide, et le masque des fenêtres
+    valides
+    """
+    nb_fenetres = len(codes) - k + 1
+    if nb_fenetres <= 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=bool)
+    invalides = np.concatenate(([0], np.cumsum(codes == CODE_INVALIDE)))
+    valides = invalides[k:] == invalides[:-k]
+    bases = (codes & 3).astype(np.uint64)
+    kmers = np.zeros(nb_fenetres, dtype=np.uint64)
+    for j in range(k):
+        kmers <<= np.uint64(2)
+        kmers |= bases[j:j+nb_fenetres]
+    if canonical:
+        complements = np.uint64(3) - bases
+        decalage = np.uint64(2 * (k - 1))
+        inverses = np.zeros(nb_fenetres, dtype=np.uint64)
+        for j in range(k):
+            inverses >>= np.uint64(2)
+            inverses |= complements[j:j+nb_fenetres] << decalage
+        kmers = np.minimum(kmers, inverses)
+    return kmers, valides
+
+
+def hash_kmers(valeurs):
+    """
+    La fonction hash_kmers prend en entrée
+    valeurs : un tableau numpy uint64 de k-mers codés
+    renvoit un tableau uint64 de hachés (finaliseur splitmix64)
+    """
+    valeurs = np.asarray(valeurs, dtype=np.uint64).copy()
+    valeurs ^= valeurs >> np.uint64(30)
+    valeurs *= np.uint64(0xbf58476d1ce4e5b9)
+    valeurs ^= valeurs >> np.uint64(27)
+    valeurs *= np.uint64(0x94d049bb133111eb)
+    valeurs ^= valeurs >> np.uint64(31)
+    return valeurs
+
+
+class BloomFilter:
+    """
+    Filtre de Bloom sur des k-mers codés : nb_bits bits stockés dans un
+    tableau numpy uint8, nb_hachages positions par k-mer obtenues par
+    double hachage
+    """
+    def __init__(self, nb_bits, nb_hachages):
+        self.nb_bits = max(8, int(nb_bits))
+        self.nb_hachages = max(1, int(nb_hachages))
+        self._bits = np.zeros((self.nb_bits + 7) // 8, dtype=np.uint8)
+
+    @classmethod
+    def for_capacity(cls, nb_elements, taux_faux_positifs=TAUX_FAUX_POSITIFS):
+        """
+        Dimensionne le filtre pour nb_elements k-mers distincts et le
+        taux de faux positifs voulu
+        """
+        nb_elements = max(1, nb_elements)
+        nb_bits = math.ceil(-nb_elements * math.log(taux_faux_positifs) /
+                            math.log(2) ** 2)
+        return cls(nb_bits, round(nb_bits / nb_elements * math.log(2)))
+
+    @property
+    def nbytes(self):
+        """Mémoire occupée par le filtre (octets)"""
+        return self._bits.nbytes
+
+    def _positions(self, cles):
+        """Positions (bits) de chaque k-mer, une colonne par hachage"""
+        premier = hash_kmers(cles)
+        second = hash_kmers(cles ^ np.uint64(0x9E3779B97F4A7C15)) | \
+            np.uint64(1)
+        rangs = np.arange(self.nb_hachages, dtype=np.uint64)
+        return (premier[:, None] + rangs[None, :] * second[:, None]) % \
+            np.uint64(self.nb_bits)
+
+    def add(self, cles):
+        """
+        Ajoute les k-mers codés cles et renvoit pour chacun s'il était
+        déjà (probablement) présent
+        """
+        positions = self._positions(np.asarray(cles, dtype=np.uint64))
+        octets = (positions >> np.uint64(3)).astype(np.int64)
+        masques = np.left_shift(1, (positions & np.uint64(7))
+                                .astype(np.uint8)).astype(np.uint8)
+        presents = np.all(self._bits[octets] & masques, axis=1)
+        np.bitwise_or.at(self._bits, octets.ravel(), masques.ravel())
+        return presents
+
+
+class _KmerItemsView(ItemsView):
+    """
+    Vue (k-mer, occurence) qui décode les k-mers par lots
+    """
+    def __iter__(self):
+        valeurs, occurences = self._mapping.packed()
+        return zip(decode_kmers(valeurs, self._mapping.k),
+                   occurences.tolist())
+
+
+class KmerCounter(Mapping):
+    """
+    Table de comptage des k-mers codés sur 2 bits (k <= 32) :
+    adressage ouvert à sondage linéaire stocké dans deux tableaux numpy
+    (clés uint64, occurences uint32), une case étant libre si son
+    occurence vaut 0.
+    S'utilise comme un dictionnaire k-mer (str) -> occurence (int).
+    En mode canonical, seule la forme canonique de chaque k-mer est
+    stockée et la recherche d'un k-mer trouve aussi son reverse
+    complément.
+
+    Avec un filtre de Bloom (bloom), la première occurence d'un k-mer
+    n'est notée que dans le filtre : seuls les k-mers vus au moins deux
+    fois occupent une case, avec leur occurence exacte (aux faux
+    positifs du filtre près).
+    """
+    CHARGE_MAX = 0.5
+
+    def __init__(self, k, capacite=1 << 16, canonical=False, bloom=None):
+        if not 0 < k <= KMER_MAX:
+            raise ValueError("k-mer size must be between 1 and {0}"
+                             .format(KMER_MAX))
+        self.k = k
+        self.canonical = canonical
+        self.bloom = bloom
+        self.absorbed = 0
+        self.nb_reads = 0
+        self.nb_kmers = 0
+        capacite = 1 << max(4, int(capacite - 1).bit_length())
+        self._cles = np.zeros(capacite, dtype=np.uint64)
+        self._occurences = np.zeros(capacite, dtype=np.uint32)
+        self._taille = 0
+
+    def __len__(self):
+        return self._taille
+
+    def __iter__(self):
+        return iter(decode_kmers(self._cles[self._occurences > 0], self.k))
+
+    def __getitem__(self, kmer):
+        if len(kmer) != self.k or kmer.strip("ACGTacgt"):
+            raise KeyError(kmer)
+        if self.canonical:
+            kmer = canonical_kmer(kmer.upper())
+        occurence = self.get_counts(np.array([encode_kmer(kmer)],
+                                             dtype=np.uint64))[0]
+        if occurence == 0:
+            raise KeyError(kmer)
+        return int(occurence)
+
+    def items(self):
+        return _KmerItemsView(self)
+
+    @property
+    def nbytes(self):
+        """Mémoire occupée par la table (octets)"""
+        return self._cles.nbytes + self._occurences.nbytes
+
+    def packed(self):
+        """
+        renvoit les k-mers codés (uint64) et leurs occurences (uint32)
+        des cases occupées, triés par k-mer : l'ordre ne dépend pas de
+        l'historique des insertions (comptage séquentiel ou parallèle)
+        """
+        occupees = np.flatnonzero(self._occurences)
+        occupees = occupees[np.argsort(self._cles[occupees], kind="stable")]
+        return self._cles[occupees], self._occurences[occupees]
+
+    def clear(self):
+        """
+        Vide la table sans la réallouer, pour compter un autre fichier
+        avec la capacité déjà atteinte
+        """
+        self._occurences.fill(0)
+        self._taille = 0
+        self.bloom = None
+        self.absorbed = 0
+        self.nb_reads = 0
+        self.nb_kmers = 0
+
+    def add_kmers(self, valeurs):
+        """
+        Ajoute une occurence pour chaque k-mer codé du tableau valeurs
+        """
+        self.nb_kmers += len(valeurs)
+        if len(valeurs):
+            cles, occurences = np.unique(valeurs, return_counts=True)
+            if self.bloom is not None:
+                cles, occurences = self._absorb(cles, occurences)
+            self.add_counts(cles, occurences)
+
+    def _absorb(self, cles, occurences):
+        """
+        Fait absorber par le filtre de Bloom les k-mers nouveaux vus une
+        seule fois ; renvoit les k-mers à compter
+        """
+        absents = self.get_counts(cles) == 0
+        deja_vus = np.zeros(len(cles), dtype=bool)
+        deja_vus[absents] = self.bloom.add(cles[absents])
+        # la première occurence d'un k-mer déjà vu a été absorbée
+        occurences = occurences + deja_vus
+        gardes = ~absents | deja_vus | (occurences > 1)
+        self.absorbed += int(np.count_nonzero(~gardes)) - \
+            int(np.count_nonzero(deja_vus))
+        return cles[gardes], occurences[gardes]
+
+    def filtered(self, min_abundance):
+        """
+        renvoit un nouveau KmerCounter ne gardant que les k-mers vus au
+        moins min_abundance fois
+        """
+        cles, occurences = self.packed()
+        solides = occurences >= min_abundance
+        filtre = KmerCounter(self.k, int(np.count_nonzero(solides) /
+                                         self.CHARGE_MAX) + 1,
+                             self.canonical)
+        filtre.add_counts(cles[solides], occurences[solides])
+        filtre.nb_reads = self.nb_reads
+        filtre.nb_kmers = self.nb_kmers
+        return filtre
+
+    def add_counts(self, cles, occurences):
+        """
+        Ajoute les occurences aux k-mers codés cles (uniques)
+        """
+        cles = np.asarray(cles, dtype=np.uint64)
+        occurences = np.asarray(occurences, dtype=np.uint32)
+        if self._taille + len(cles) > self.CHARGE_MAX * len(self._cles):
+            self._agrandir(self._taille + len(cles))
+        masque = np.uint64(len(self._cles) - 1)
+        cases = hash_kmers(cles) & masque
+        en_attente = np.arange(len(cles))
+        while en_attente.size:
+            sondees = cases[en_attente]
+            occupees = self._occurences[sondees] > 0
+            trouvees = occupees & (self._cles[sondees] == cles[en_attente])
+            self._occurences[sondees[trouvees]] += \
+                occurences[en_attente[trouvees]]
+            # plusieurs clés peuvent viser la même case libre :
+            # la première l'emporte, les autres sondent à nouveau
+            libres = np.flatnonzero(~occupees)
+            _, premieres = np.unique(sondees[libres], return_index=True)
+            gagnantes = libres[premieres]
+            self._cles[sondees[gagnantes]] = cles[en_attente[gagnantes]]
+            self._occurences[sondees[gagnantes]] = \
+                occurences[en_attente[gagnantes]]
+            self._taille += len(gagnantes)
+            collisions = occupees & ~trouvees
+            cases[en_attente[collisions]] = \
+                (sondees[collisions] + np.uint64(1)) & masque
+            restantes = collisions
+            restantes[libres] = True
+            restantes[gagnantes] = False
+            en_attente = en_attente[restantes]
+
+    def get_counts(self, cles):
+        """
+        renvoit le tableau des occurences des k-mers codés cles
+        (0 pour un k-mer absent)
+        """
+        cles = np.asarray(cles, dtype=np.uint64)
+        resultat = np.zeros(len(cles), dtype=np.uint32)
+        masque = np.uint64(len(self._cles) - 1)
+        cases = hash_kmers(cles) & masque
+        en_attente = np.arange(len(cles))
+        while en_attente.size:
+            sondees = cases[en_attente]
+            occupees = self._occurences[sondees] > 0
+            trouvees = occupees & (self._cles[sondees] == cles[en_attente])
+            resultat[en_attente[trouvees]] = self._occurences[sondees[trouvees]]
+            collisions = occupees & ~trouvees
+            cases[en_attente[collisions]] = \
+                (sondees[collisions] + np.uint64(1)) & masque
+            en_attente = en_attente[collisions]
+        return resultat
+
+    def _agrandir(self, taille_visee):
+        """
+        Double la capacité jusqu'à respecter CHARGE_MAX puis réinsère
+        """
+        cles, occurences = self.packed()
+        capacite = len(self._cles)
+        while taille_visee > self.CHARGE_MAX * capacite:
+            capacite <<= 1
+        self._cles = np.zeros(capacite, dtype=np.uint64)
+        self._occurences = np.zeros(capacite, dtype=np.uint32)
+        self._taille = 0
+        self.add_counts(cles, occurences)
+
+
+def is_gzip(nom):
+    """
+    La fonction is_gzip prend en entrée
+    nom : un fichier (str)
+    renvoit True si le fichier est compressé avec gzip (ou bgzip)
+    """
+    with open(nom, "rb") as filin:
+        return filin.read(2) == MAGIC_GZIP
+
+
+def _line_end(tampon, debut, fin):
+    """
+    Renvoit la fin de la ligne [debut, fin) sans le retour chariot
+    d'une fin de ligne Windows
+    """
+    if fin > debut and tampon[fin - 1] == 13:
+        return fin - 1
+    return fin
+
+
+def _fastq_records(tampon, position, limite, complet):
+    """
+    Parcourt les enregistrements fastq de tampon commençant entre
+    position et limite ; renvoit (générateur) les bornes de la séquence
+    et de la qualité, la valeur de retour du générateur étant la
+    position du premier enregistrement non lu.
+    Un enregistrement coupé en fin de tampon n'est lu que si complet.
+    """
+    taille = len(tampon)
+    while position < limite:
+        if tampon[position] in (10, 13):
+            position += 1
+            continue
+        lignes = []
+        curseur = position
+        for _ in range(4):
+            fin_ligne = tampon.find(b"\n", curseur)
+            if fin_ligne < 0:
+                if not complet or curseur >= taille:
+                    return position
+                fin_ligne = taille
+            lignes.append((curseur, _line_end(tampon, curseur, fin_ligne)))
+            curseur = fin_ligne + 1
+        yield lignes[1], lignes[3]
+        position = curseur
+    return position
+
+
+def _fasta_records(tampon, position, limite, complet):
+    """
+    Parcourt les enregistrements fasta (éventuellement sur plusieurs
+    lignes) de tampon commençant entre position et limite ; renvoit
+    (générateur) les bornes de la séquence, la valeur de retour étant
+    la position du premier enregistrement non lu.
+    """
+    taille = len(tampon)
+    while position < limite:
+        if tampon[position] != 62:
+            fin_ligne = tampon.find(b"\n", position)
+            position = taille if fin_ligne < 0 else fin_ligne + 1
+            continue
+        fin_entete = tampon.find(b"\n", position)
+        if fin_entete < 0:
+            # entête sans séquence en fin de tampon
+            return taille if complet else position
+        suivant = tampon.find(b"\n>", fin_entete)
+        if suivant < 0:
+            if not complet:
+                return position
+            suivant = taille
+        else:
+            suivant += 1
+        fin = suivant
+        while fin > fin_entete + 1 and tampon[fin - 1] in (10, 13):
+            fin -= 1
+        yield (min(fin_entete + 1, fin), fin), None
+        position = suivant
+    return position
+
+
+def _parser(tampon, position):
+    """
+    Renvoit la fonction de parcours adaptée au format (fasta ou fastq)
+    du premier enregistrement du tampon
+    """
+    while position < len(tampon) and tampon[position] in (10, 13):
+        position += 1
+    if position < len(tampon) and tampon[position] == 62:
+        return _fasta_records
+    return _fastq_records
+
+
+def _slices(tampon, parcours, copier):
+    """
+    Transforme les bornes renvoyées par parcours en séquences et
+    qualités : vues sans copie du tampon, ou bytes si copier (ou si la
+    séquence fasta s'étend sur plusieurs lignes).
+    Renvoit la position du premier enregistrement non lu.
+    """
+    vue = memoryview(tampon)
+    while True:
+        try:
+            (debut, fin), qualite = next(parcours)
+        except StopIteration as arret:
+            return arret.value
+        if tampon.find(b"\n", debut, fin) >= 0:
+            sequence = bytes(vue[debut:fin]).replace(b"\r", b"") \
+                .replace(b"\n", b"")
+        elif copier:
+            sequence = bytes(vue[debut:fin])
+        else:
+            sequence = vue[debut:fin]
+        if qualite is not None:
+            qualite = bytes(vue[qualite[0]:qualite[1]]) if copier \
+                else vue[qualite[0]:qualite[1]]
+        yield sequence, qualite
+
+
+def _read_mapped(nom, debut, fin):
+    """
+    Lit les enregistrements d'un fichier non compressé projeté en
+    mémoire (mmap) ; les vues renvoyées gardent la projection ouverte
+    tant qu'elles sont référencées.
+    """
+    if os.path.getsize(nom) == 0:
+        return
+    with open(nom, "rb") as filin:
+        tampon = mmap.mmap(filin.fileno(), 0, access=mmap.ACCESS_READ)
+    if fin is None:
+        fin = len(tampon)
+    parcours = _parser(tampon, debut)(tampon, debut, fin, True)
+    yield from _slices(tampon, parcours, False)
+
+
+def _read_gzip(nom):
+    """
+    Lit les enregistrements d'un fichier gzip (ou bgzip) par blocs de
+    BLOC_GZIP octets décompressés
+    """
+    with gzip.open(nom, "rb") as filin:
+        reste = b""
+        parser = None
+        while True:
+            bloc = filin.read(BLOC_GZIP)
+            tampon = reste + bloc
+            if parser is None:
+                parser = _parser(tampon, 0)
+            position = yield from _slices(
+                tampon, parser(tampon, 0, len(tampon), not bloc), True)
+            reste = tampon[position:]
+            if not bloc:
+                return
+
+
+def read_records(nom, debut=0, fin=None):
+    """
+    La fonction read_records prend en entrée
+    nom : un fichier fastq ou fasta, éventuellement compressé (str)
+    debut, fin : l'intervalle d'octets des enregistrements à lire
+    (fichiers non compressés uniquement)
+    renvoit les couples (séquence, qualité) de ce fichier : des vues
+    memoryview sans copie ni décodage pour un fichier non compressé,
+    des bytes pour un fichier gzip ; la qualité vaut None en fasta
+    """
+    if is_gzip(nom):
+        return _read_gzip(nom)
+    return _read_mapped(nom, debut, fin)
+
+
+def read_sequences(nom, debut=0, fin=None):
+    """
+    La fonction read_sequences prend en entrée
+    nom : un fichier fastq ou fasta, éventuellement compressé (str)
+    debut, fin : l'intervalle d'octets à lire (voir read_records)
+    renvoit les séquences (memoryview ou bytes) de ce fichier
+    """
+    for sequence, _ in read_records(nom, debut, fin):
+        yield sequence
+
+
+def filtered_sequences(nom, filtre=None, debut=0, fin=None):
+    """
+    La fonction filtered_sequences prend en entrée
+    nom : un fichier fastq ou fasta, éventuellement compressé (str)
+    filtre : un ReadFilter, ou None pour garder les reads tels quels
+    debut, fin : l'intervalle d'octets à lire (voir read_records)
+    renvoit les séquences à compter (memoryview ou bytes)
+    """
+    if filtre is None:
+        return read_sequences(nom, debut, fin)
+    return filtre(read_records(nom, debut, fin))
+
+
 def read_fastq(nom):
     """
     La fonction read_fastq prend en entrée
@@ -76,11 +949,107 @@ def read_fastq(nom):
     renvoit les reads de ce fichier
     sous forme d'un argument de sequences
     """
-    with open(nom) as filin:
-        for line in enumerate(filin):
-            yield next(filin)[:-1]
-            next(filin)
-            next(filin)
+    for sequence in read_sequences(nom):
+        yield bytes(sequence).decode("ascii")
+
+
+def print_trimming(filtre):
+    """
+    Affiche sur la sortie d'erreur le bilan du prétraitement des reads
+    (rien sans filtre)
+    """
+    if filtre is not None:
+        print("trimming: {reads} reads ({bases} bases) -> {fragments} "
+              "fragments ({kept_bases} bases)".format(**filtre.stats),
+              file=sys.stderr)
+
+
+class ReadFilter:
+    """
+    Prétraitement des reads avant comptage, par lots de READS_PAR_LOT
+    reads concaténés en tableaux numpy : coupe de l'extrémité 3' de
+    mauvaise qualité (méthode de BWA), découpage aux bases autres que
+    ACGT et élimination des fragments de moins de longueur_min bases.
+    S'applique aux couples (séquence, qualité) de read_records et compte
+    les reads et bases lus et gardés (stats).
+    """
+    def __init__(self, qualite_min=20, longueur_min=1, decalage=33):
+        self.qualite_min = qualite_min
+        self.longueur_min = max(1, longueur_min)
+        self.decalage = decalage
+        self.stats = dict.fromkeys(("reads", "bases", "fragments",
+                                    "kept_bases"), 0)
+
+    def signature(self):
+        """Paramètres du filtre sous forme de texte (clé de cache)"""
+        return "q{0}l{1}o{2}".format(self.qualite_min, self.longueur_min,
+                                     self.decalage)
+
+    def __call__(self, records):
+        lot = []
+        for enregistrement in records:
+            lot.append(enregistrement)
+            if len(lot) == READS_PAR_LOT:
+                yield from self.filter_batch(lot)
+                lot = []
+        if lot:
+            yield from self.filter_batch(lot)
+
+    def _trim_points(self, qualites, debuts, fins):
+        """
+        Renvoit pour chaque read la fin de la partie gardée : la
+        position i qui maximise la somme des (qualite_min - qualité)
+        des bases de i à la fin du read (la plus grande en cas
+        d'égalité), ou la fin du read si cette somme reste négative
+        """
+        scores = self.qualite_min - (qualites.astype(np.int64) -
+                                     self.decalage)
+        cumul = np.concatenate(([0], np.cumsum(scores)))
+        minimum = np.minimum(np.minimum.reduceat(cumul[:-1], debuts),
+                             cumul[fins])
+        longueurs = fins - debuts
+        positions = np.where(cumul[:-1] == np.repeat(minimum, longueurs),
+                             np.arange(len(scores)), -1)
+        derniere = np.maximum.reduceat(positions, debuts)
+        return np.where(cumul[fins] == minimum, fins, derniere)
+
+    def filter_batch(self, lot):
+        """
+        Renvoit les fragments (memoryview) gardés d'un lot de couples
+        (séquence, qualité)
+        """
+        lot = [(sequence, qualite) for sequence, qualite in lot
+               if len(sequence)]
+        self.stats["reads"] += len(lot)
+        if not lot:
+            return
+        longueurs = np.array([len(sequence) for sequence, _ in lot],
+                             dtype=np.int64)
+        fins = np.cumsum(longueurs)
+        debuts = fins - longueurs
+        tampon = b"".join(sequence for sequence, _ in lot)
+        bases = np.frombuffer(tampon, dtype=np.uint8)
+        self.stats["bases"] += len(bases)
+        gardees = TABLE_CODAGE[bases] != CODE_INVALIDE
+        if lot[0][1] is not None and self.qualite_min > 0:
+            qualites = np.frombuffer(b"".join(qualite for _, qualite in lot),
+                                     dtype=np.uint8)
+            coupes = self._trim_points(qualites, debuts, fins)
+            gardees &= np.arange(len(bases)) < np.repeat(coupes, longueurs)
+        # fragments : suites de bases gardées à l'intérieur d'un read
+        precedentes = np.concatenate(([False], gardees[:-1]))
+        precedentes[debuts] = False
+        suivantes = np.concatenate((gardees[1:], [False]))
+        suivantes[fins - 1] = False
+        premieres = np.flatnonzero(gardees & ~precedentes)
+        dernieres = np.flatnonzero(gardees & ~suivantes) + 1
+        vue = memoryview(tampon)
+        for debut, fin in zip(premieres.tolist(), dernieres.tolist()):
+            if fin - debut >= self.longueur_min:
+                self.stats["fragments"] += 1
+                self.stats["kept_bases"] += fin - debut
+                yield vue[debut:fin]
+
 
 def cut_kmer(seq, k):
     """
@@ -93,244 +1062,3246 @@ def cut_kmer(seq, k):
         yield seq[i:i+k]
 
 
-def build_kmer_dict(nom,k):
+def encode_batches(sequences, taille=READS_PAR_LOT):
     """
-    La fonction build_kmer_dict prend en entrée
-    nom : un fichier fastq (str)
-    k : la taille du k-mer (integer)
-    renvoit un dictionnaire comportant le k-mer (str) et
-    la valeur du nombre d'occurence de ce k-mer (int)
-    """
-    dict_kmer = {}
-    for i in read_fastq(nom):
-        for j in cut_kmer(i,k):
-            if j not in dict_kmer:
-                dict_kmer[j] = 1
-            else:
-                dict_kmer[j] += 1
-    return dict_kmer
+    La fonction encode_batches prend en entrée
+    sequences : un itérable de reads (str, bytes ou memoryview)
+    taille : le nombre de reads par lot (integer)
+    renvoit les lots de reads concaténés et codés (encode_sequence),
+    séparés par une base invalide pour qu'aucun k-mer ne chevauche
+    deux reads
+    """
+    lot = []
+    for read in sequences:
+        lot.append(read)
+        if len(lot) == taille:
+            yield encode_sequence(_join_reads(lot))
+            lot = []
+    if lot:
+        yield encode_sequence(_join_reads(lot))
 
 
-def build_graph(dico):
+def _join_reads(lot):
     """
-    La fonction build_graph prend en entrée
-    dico : dictionnaire de k-mers (str) et leur nombre d'occurence (int)
-    renvoit un arbre orienté et pondéré
+    Concatène les reads d'un lot en les séparant par N
     """
-    arbre_kmer = nx.DiGraph()
-    for mot in dico:
-        arbre_kmer.add_edge(mot[0:len(mot)-1],
-            mot[1:],weight = dico[mot])
-    print(nx.info(arbre_kmer))
-    options = {'node_color': "red", "node_size":500}
-    nx.draw(arbre_kmer,with_labels=True, font_weight='bold', **options)
-    plt.show()
-    plt.savefig("Figure1: 1er Graphe Orienté de Bruijn.png")
-    return arbre_kmer
+    if isinstance(lot[0], str):
+        return "N".join(lot)
+    return b"N".join(lot)
 
 
-##########################################################
-########### 2. Parcours du graphe de de Bruijn ###########
-##########################################################
+def _tally_reads(sequences, compteur):
+    """
+    Renvoit les reads de sequences en les comptant dans
+    compteur.nb_reads
+    """
+    for read in sequences:
+        compteur.nb_reads += 1
+        yield read
 
 
-def get_starting_nodes(arbre):
+def _record_start(filin, position):
     """
-    La fonction get_starting_nodes prend en entrée
-    arbre: object networkx DiGraph()
-    renvoit une liste de noeuds d'entrée (str ou int)
+    Renvoit la position du premier enregistrement commençant à partir
+    de position : en fastq une ligne @ suivie deux lignes plus loin
+    d'une ligne + (la qualité pouvant elle aussi commencer par @), en
+    fasta une ligne >
     """
-    nodes_in = []
-    for node in arbre.nodes:
-        if len(list(arbre.predecessors(node))) == 0:
-            nodes_in.append(node)
-    return nodes_in
+    if position == 0:
+        return 0
+    filin.seek(0)
+    fasta = filin.read(1) == b">"
+    filin.seek(position - 1)
+    # on se place au début de la première ligne complète
+    filin.readline()
+    lignes = []
+    while len(lignes) < 8 or fasta:
+        debut = filin.tell()
+        ligne = filin.readline()
+        if not ligne or (fasta and ligne.startswith(b">")):
+            return debut
+        lignes.append((debut, ligne))
+    for i in range(len(lignes) - 2):
+        if lignes[i][1].startswith(b"@") and lignes[i+2][1].startswith(b"+"):
+            return lignes[i][0]
+    return lignes[0][0] if lignes else filin.tell()
 
 
-def get_sink_nodes(arbre):
+def fastq_chunks(nom, nb_morceaux):
     """
-    La fonction get_sink_nodes prend en entrée
-    arbre: object networkx DiGraph()
-    renvoit une liste de noeuds de sortie (str ou int)
+    La fonction fastq_chunks prend en entrée
+    nom : un fichier fastq (str)
+    nb_morceaux : le nombre de morceaux voulus (integer)
+    renvoit la liste des intervalles d'octets (début, fin) découpant le
+    fichier aux frontières des enregistrements (un seul intervalle pour
+    un fichier compressé, qui ne peut être lu qu'en entier)
     """
-    nodes_out = []
-    for node in arbre.nodes:
-        if len(list(arbre.successors(node))) == 0:
-            nodes_out.append(node)
-    return nodes_out
+    taille = os.path.getsize(nom)
+    if is_gzip(nom):
+        return [(0, None)]
+    with open(nom, "rb") as filin:
+        bornes = sorted({_record_start(filin, taille * i // nb_morceaux)
+                         for i in range(nb_morceaux)})
+    bornes.append(taille)
+    return [(bornes[i], bornes[i+1]) for i in range(len(bornes) - 1)
+            if bornes[i] < bornes[i+1]]
 
 
-def fill(text, width=80):
+def _count_chunk(parametres):
     """
-    Split text with a line return to respect fasta format
+    Compte les k-mers d'un morceau du fichier et les répartit par
+    fragment (haché du k-mer) dans des fichiers temporaires
     """
-    return os.linesep.join(text[i:i+width] for i in range(0, len(text), width))
+    (nom, debut, fin, k, canonical, nb_fragments, dossier, numero,
+     filtre) = parametres
+    compteur = KmerCounter(k, canonical=canonical)
+    for lot in encode_batches(_tally_reads(
+            filtered_sequences(nom, filtre, debut, fin), compteur)):
+        compteur.add_kmers(pack_kmers(lot, k, canonical))
+    cles, occurences = compteur.packed()
+    fragments = hash_kmers(cles) % np.uint64(nb_fragments)
+    for fragment in range(nb_fragments):
+        selection = fragments == fragment
+        np.savez(os.path.join(dossier, "shard{0}_chunk{1}.npz"
+                              .format(fragment, numero)),
+                 cles=cles[selection], occurences=occurences[selection])
+    if filtre is not None:
+        compteur.nb_reads = filtre.stats["reads"]
+        return compteur.nb_reads, compteur.nb_kmers, filtre.stats
+    return compteur.nb_reads, compteur.nb_kmers, None
 
 
-def get_contigs(arbre, entree, sortie):
+def _merge_shard(parametres):
     """
-    La fonction get_sink_nodes prend en entrée
-    arbre: object networkx DiGraph()
-    entree: une liste de noeurds d'entree (str)
-    sortie: une liste de noeurds de sortie (str)
-    renvoit une liste de tuple avec le contig (str) et sa taille (int)
+    Fusionne les comptages de tous les morceaux pour un fragment et
+    renvoit le nom du fichier fusionné
     """
-    contigs = []
-    for debut in entree:
-        for fin in sortie:
-            if list(nx.all_simple_paths(arbre, debut, sortie)) != []:
-                path = nx.shortest_path(arbre,debut,fin)
-                seq =""
-                for i in range(len(path)-1):
-                    seq += path[i][-1]
-                contigs.append((seq, len(seq)))
-    return contigs
+    dossier, fragment, nb_morceaux, min_abundance = parametres
+    cles, occurences = [], []
+    for numero in range(nb_morceaux):
+        nom = os.path.join(dossier, "shard{0}_chunk{1}.npz"
+                           .format(fragment, numero))
+        with np.load(nom) as morceau:
+            cles.append(morceau["cles"])
+            occurences.append(morceau["occurences"])
+        os.remove(nom)
+    cles = np.concatenate(cles)
+    occurences = np.concatenate(occurences).astype(np.uint64)
+    ordre = np.argsort(cles, kind="stable")
+    cles = cles[ordre]
+    debuts = np.ones(len(cles), dtype=bool)
+    debuts[1:] = cles[1:] != cles[:-1]
+    premiers = np.flatnonzero(debuts)
+    cles = cles[premiers]
+    if len(premiers):
+        occurences = np.add.reduceat(occurences[ordre], premiers)
+    solides = occurences >= min_abundance
+    sortie = os.path.join(dossier, "shard{0}.npz".format(fragment))
+    np.savez(sortie, cles=cles[solides], occurences=occurences[solides])
+    return sortie
+
 
+def count_kmers_parallel(nom, k, canonical=False, threads=2,
+                         min_abundance=1, filtre=None):
+    """
+    La fonction count_kmers_parallel prend en entrée
+    nom : un fichier fastq (str)
+    k : la taille du k-mer (integer)
+    canonical : compter chaque k-mer avec son reverse complément
+    threads : le nombre de processus (integer)
+    min_abundance : occurence minimale des k-mers gardés (integer)
+    filtre : prétraitement des reads (ReadFilter, optionnel)
+    renvoit le même KmerCounter que le comptage séquentiel
+
+    Chaque processus compte un morceau du fichier et écrit un fichier
+    par fragment ; chaque fragment est ensuite fusionné par un
+    processus, seuls des noms de fichiers transitant entre processus.
+    Les occurences étant exactes après fusion, le seuil min_abundance y
+    est appliqué directement, sans filtre de Bloom.
+    """
+    morceaux = fastq_chunks(nom, threads * MORCEAUX_PAR_PROCESSUS)
+    with tempfile.TemporaryDirectory() as dossier, \
+            multiprocessing.Pool(threads) as pool:
+        totaux = pool.map(_count_chunk, [(nom, debut, fin, k, canonical,
+                                          threads, dossier, numero, filtre)
+                                         for numero, (debut, fin)
+                                         in enumerate(morceaux)])
+        fragments = pool.map(_merge_shard, [(dossier, fragment,
+                                             len(morceaux), min_abundance)
+                                            for fragment in range(threads)])
+        dict_kmer = KmerCounter(k, canonical=canonical)
+        for nom_fragment in fragments:
+            with np.load(nom_fragment) as fragment:
+                dict_kmer.add_counts(fragment["cles"],
+                                     fragment["occurences"])
+    dict_kmer.nb_reads = sum(total[0] for total in totaux)
+    dict_kmer.nb_kmers = sum(total[1] for total in totaux)
+    if filtre is not None:
+        # chaque processus a filtré avec sa propre copie du filtre
+        for _, _, stats in totaux:
+            for mesure, valeur in stats.items():
+                filtre.stats[mesure] += valeur
+    return dict_kmer
 
 
-def save_contigs(contig,fichier):
+def sample_reads(nom, nb_reads=LECTURES_ECHANTILLON, graine=9001):
     """
-    La fonction save_contigs prend en entrée
-    contig: une liste de tuple
-    fichier: nom de fichier de sortie
-    renvoit un fichier fasta
+    La fonction sample_reads prend en entrée
+    nom : un fichier fastq ou fasta (str)
+    nb_reads : la taille de l'échantillon (integer)
+    graine : la graine du tirage (integer)
+    renvoit au plus nb_reads reads (bytes) tirés uniformément dans tout
+    le fichier (échantillonnage par réservoir, en une lecture)
     """
-    with open(fichier, "w") as filout:
-        for i,seq in enumerate(contig):
-            filout.write(">contig_{} len={}\n".format(i+1,seq[1]))
-            filout.write(fill(seq[0] + "\n"))
-            filout.write("\n")
-        return filout
+    tirage = random.Random(graine)
+    echantillon = []
+    for numero, read in enumerate(read_sequences(nom)):
+        if numero < nb_reads:
+            echantillon.append(bytes(read))
+        else:
+            place = tirage.randrange(numero + 1)
+            if place < nb_reads:
+                echantillon[place] = bytes(read)
+    return echantillon
 
 
-##########################################################
-###### 3. Simplification du graphe de de Bruijn ##########
-##########################################################
+def kmer_spectra(reads, tailles, canonical=False):
+    """
+    La fonction kmer_spectra prend en entrée
+    reads : une liste de reads (str ou bytes)
+    tailles : les tailles de k-mer candidates (integers, au plus 32)
+    canonical : compter chaque k-mer avec son reverse complément
+    renvoit pour chaque taille l'histogramme des occurences (tableau
+    numpy : histogramme[n] = nombre de k-mers distincts vus n fois)
 
-def std(liste):
+    Comme dans pack_kmers, chaque base entre par décalage dans toutes
+    les fenêtres à la fois : en allongeant les k-mers d'une base par
+    tour, tous les k candidats sont obtenus dans le même parcours.
     """
-    calcule de lecart type de la liste
+    tailles = sorted(tailles)
+    compteurs = {k: KmerCounter(k, canonical=canonical) for k in tailles}
+    for lot in encode_batches(reads):
+        invalides = np.concatenate(([0], np.cumsum(lot == CODE_INVALIDE)))
+        bases = (lot & 3).astype(np.uint64)
+        kmers = np.zeros(len(lot), dtype=np.uint64)
+        for j in range(tailles[-1]):
+            nb_fenetres = len(lot) - j
+            if nb_fenetres <= 0:
+                break
+            # seules les fenêtres assez loin de la fin s'allongent
+            kmers = kmers[:nb_fenetres]
+            kmers <<= np.uint64(2)
+            kmers |= bases[j:j + nb_fenetres]
+            k = j + 1
+            if k in compteurs:
+                valides = invalides[k:] == invalides[:-k]
+                valeurs = kmers[valides]
+                if canonical:
+                    valeurs = np.minimum(valeurs,
+                                         reverse_complement_kmers(valeurs, k))
+                compteurs[k].add_kmers(valeurs)
+    return {k: np.bincount(compteur.packed()[1].astype(np.int64),
+                           minlength=2)
+            for k, compteur in compteurs.items()}
+
+
+def estimate_spectrum(histogramme, k):
     """
-    return statistics.stdev(liste)
+    La fonction estimate_spectrum prend en entrée
+    histogramme : l'histogramme des occurences des k-mers (kmer_spectra)
+    k : la taille des k-mers (integer)
+    renvoit le seuil d'abondance (premier creux de l'histogramme), le
+    nombre de k-mers distincts, le nombre estimé de k-mers génomiques
+    (au moins aussi fréquents que le seuil) et le taux d'erreur par base
+    déduit de la part des occurences sous le seuil (dict)
+    """
+    seuil = 1
+    for abondance in range(1, len(histogramme) - 1):
+        if histogramme[abondance] < histogramme[abondance + 1]:
+            seuil = abondance
+            break
+    abondances = np.arange(len(histogramme))
+    occurences = histogramme * abondances
+    total = int(occurences.sum())
+    erreurs = int(occurences[:seuil].sum())
+    return {"k": k, "threshold": seuil,
+            "distinct_kmers": int(histogramme[1:].sum()),
+            "genomic_kmers": int(histogramme[seuil:].sum()),
+            "error_rate": 1 - (1 - erreurs / total) ** (1 / k)
+                          if total else 0.0}
 
 
-def path_average_weight(arbre,chemin):
+def choose_kmer_size(nom, canonical=False, nb_reads=LECTURES_ECHANTILLON,
+                     candidats=K_CANDIDATS):
     """
-    prend un graphe (arbre): object networkx DiGraph()
-    un chemin: liste de chaine de caractères (str)
-    renvoit le poids moyen du chemin (float)
+    La fonction choose_kmer_size prend en entrée
+    nom : un fichier fastq ou fasta (str)
+    canonical : compter chaque k-mer avec son reverse complément
+    nb_reads : le nombre de reads échantillonnés (integer)
+    candidats : les tailles de k-mer essayées (integers)
+    renvoit la taille de k-mer retenue et l'estimation de chaque
+    candidat (estimate_spectrum)
+
+    Le k retenu maximise le nombre de k-mers génomiques distincts (plus
+    de k-mers génomiques : moins de trous et de répétitions repliées) ;
+    à moins de TOLERANCE_K de ce maximum, le plus grand k est préféré
+    pour mieux traverser les répétitions.
     """
-    liste_weights = []
-    for i,j,poids in arbre.subgraph(chemin).edges(data=True):
-        liste_weights.append(poids["weight"])
-    return statistics.mean(liste_weights)
+    reads = sample_reads(nom, nb_reads)
+    longueur = int(np.median([len(read) for read in reads])) if reads else 0
+    candidats = [k for k in candidats if k <= min(longueur, KMER_MAX)]
+    if not candidats:
+        raise ValueError("reads are too short for automatic k selection")
+    spectres = kmer_spectra(reads, candidats, canonical)
+    estimations = [estimate_spectrum(spectres[k], k) for k in candidats]
+    meilleur = max(estimation["genomic_kmers"] for estimation in estimations)
+    choisi = max(estimation["k"] for estimation in estimations
+                 if estimation["genomic_kmers"] >= (1 - TOLERANCE_K) *
+                 meilleur)
+    return choisi, estimations
+
+
+def encode_reads(nom, filtre=None):
+    """
+    La fonction encode_reads prend en entrée
+    nom : un fichier fastq ou fasta (str)
+    filtre : prétraitement des reads (ReadFilter, optionnel)
+    renvoit la liste des lots de reads codés (encode_batches), gardés en
+    mémoire (un octet par base) pour compter plusieurs k sans relire le
+    fichier, et le nombre de reads
+    """
+    nb_reads = 0
 
+    def lues():
+        nonlocal nb_reads
+        for read in filtered_sequences(nom, filtre):
+            nb_reads += 1
+            yield read
 
+    lots = list(encode_batches(lues()))
+    if filtre is not None:
+        return lots, filtre.stats["reads"]
+    return lots, nb_reads
 
-def remove_paths(arbre,liste_chemin, delete_entry_node, delete_sink_node):
+
+def count_batches(lots, k, canonical=False, min_abundance=1):
     """
-    prend un graphe (arbre): object networkx DiGraph()
-    liste_chemin: liste de chaine de caractères (str)
-    delete_entry_node: variable booléenne (True/False)
-    delete_sink_node: variable booléenne (True/False)
-    retourne l'arbre nettoyé des chemins indésirables
+    La fonction count_batches prend en entrée
+    lots : des lots de reads codés (encode_reads)
+    k : la taille du k-mer (integer)
+    canonical : compter chaque k-mer avec son reverse complément
+    min_abundance : occurence minimale des k-mers gardés (integer)
+    renvoit le KmerCounter des k-mers des lots
     """
-    for i in range(len(liste_chemin)):
-        if delete_entry_node == True:
-            arbre.remove_node(liste_chemin[i][0])
-        if delete_sink_node == True:
-            arbre.remove_node(liste_chemin[i][-1])
-    return arbre
+    dict_kmer = KmerCounter(k, canonical=canonical)
+    for lot in lots:
+        dict_kmer.add_kmers(pack_kmers(lot, k, canonical))
+    if min_abundance > 1:
+        return dict_kmer.filtered(min_abundance)
+    return dict_kmer
 
 
-def select_best_path(arbre, liste_chemin, liste_taille,liste_weights,
-    delete_entry_node = False, delete_sink_node =False):
+def add_pseudo_reads(dico, contigs, poids=1):
     """
-    prend un graphe (arbre): object networkx DiGraph()
-    liste_chemin: liste de chaine de caractères (str)
-    liste_taille: liste de la taille de chaque chemin (int)
-    liste_weights: liste de poids moyen de chaque chemin (float)
-    delete_entry_node: variable booléenne (False)
-    delete_sink_node: variable booléenne (False)
-    retourne l'arbre nettoyé des chemins indésirables
+    La fonction add_pseudo_reads prend en entrée
+    dico : un KmerCounter
+    contigs : un itérable de séquences (str) servant de pseudo-reads
+    poids : l'occurence donnée à leurs k-mers (integer)
+    Seuls les k-mers absents de dico sont ajoutés : les pseudo-reads
+    comblent les trous sans modifier les occurences des reads.
+    renvoit le nombre de k-mers ajoutés (integer)
+    """
+    nb_ajoutes = 0
+    for lot in encode_batches(contigs):
+        cles = np.unique(pack_kmers(lot, dico.k, dico.canonical))
+        cles = cles[dico.get_counts(cles) == 0]
+        dico.add_counts(cles, np.full(len(cles), poids, dtype=np.uint32))
+        nb_ajoutes += len(cles)
+    return nb_ajoutes
 
-    Meilleur chemin: celui qui a le meilleur poids
-    si 2 chemins avec même poids => on prend celui le plus long
-    si même taille => on prend random
+
+def build_kmer_dict(nom,k, canonical=False, threads=1, min_abundance=1,
+                    bloom_size=None, bloom_fpr=TAUX_FAUX_POSITIFS,
+                    filtre=None, max_memory=None, compteur=None):
+    """
+    La fonction build_kmer_dict prend en entrée
+    nom : un fichier fastq (str)
+    k : la taille du k-mer (integer)
+    canonical : compter chaque k-mer avec son reverse complément
+    threads : le nombre de processus de comptage (integer)
+    min_abundance : occurence minimale des k-mers gardés (integer)
+    bloom_size : nombre de k-mers distincts attendus pour dimensionner
+    le filtre de Bloom (par défaut estimé d'après la taille du fichier)
+    bloom_fpr : taux de faux positifs du filtre de Bloom
+    filtre : prétraitement des reads (ReadFilter, optionnel)
+    max_memory : budget mémoire (octets) d'un comptage sur disque
+    (count_kmers_external, optionnel)
+    compteur : un KmerCounter de même k et canonical, vidé puis réutilisé
+    au lieu d'allouer une nouvelle table (optionnel)
+    renvoit un dictionnaire (KmerCounter, ou KmerIndex avec max_memory)
+    comportant le k-mer (str) et la valeur du nombre d'occurence de ce
+    k-mer (int)
+
+    Avec min_abundance > 1, un filtre de Bloom absorbe la première
+    occurence de chaque k-mer ; l'attribut stats du dictionnaire
+    renvoyé décrit alors la mémoire économisée.
     """
-    # initialisation des paramètres
-    path_max_weight = 0
-    path_max_length = 0
-    path_max_indice = -1
-    for i in range(len(liste_chemin)):
-        # on prend la path avec le meilleur poids
-        if liste_weights[i] > path_max_weight[i]:
-            path_max_weight = liste_weights[i]
-            path_max_length = liste_taille[i]
-            path_max_indice = i
-        # si on a même poids, recherche de la plus longue séquence
-        elif liste_weights[i] == path_max_weight[i]:
-            if liste_taille[i] > path_max_length[i]:
-                path_max_weight = liste_weights[i]
-                path_max_length = liste_taille[i]
-                path_max_indice = i
-            # si même taille de sequence, random entre les 2 seqs
-            elif liste_taille[i] == path_max_length[i]:
-                choix_path = random.randrange(0,1)
-                if choix_path:
-                    path_max_weight = liste_weights[i]
-                    path_max_length = liste_taille[i]
-                    path_max_indice = i
+    if max_memory is not None:
+        return count_kmers_external(nom, k, canonical, max_memory,
+                                    min_abundance, filtre)
+    if threads > 1:
+        return count_kmers_parallel(nom, k, canonical, threads,
+                                    min_abundance, filtre)
+    bloom = None
+    if min_abundance > 1:
+        # environ une base pour deux octets de fastq
+        bloom = BloomFilter.for_capacity(bloom_size or
+                                         os.path.getsize(nom) // 2,
+                                         bloom_fpr)
+    if compteur is None:
+        dict_kmer = KmerCounter(k, canonical=canonical, bloom=bloom)
+    else:
+        dict_kmer = compteur
+        dict_kmer.clear()
+        dict_kmer.bloom = bloom
+    for lot in encode_batches(_tally_reads(filtered_sequences(nom, filtre),
+                                           dict_kmer)):
+        dict_kmer.add_kmers(pack_kmers(lot, k, canonical))
+    if filtre is not None:
+        dict_kmer.nb_reads = filtre.stats["reads"]
+    if bloom is None:
+        return dict_kmer
+    solides = dict_kmer.filtered(min_abundance)
+    solides.stats = {
+        "bloom_bytes": bloom.nbytes,
+        "kmers_absorbed": dict_kmer.absorbed,
+        "kmers_counted": len(dict_kmer),
+        "kmers_solid": len(solides),
+        "table_bytes_saved": int(dict_kmer.absorbed * (
+            dict_kmer.nbytes / len(dict_kmer._cles)) /
+                                 KmerCounter.CHARGE_MAX) - bloom.nbytes}
+    return solides
 
-    arbre = remove_paths(arbre, liste_chemin[:path_max_indice]+
-        liste_chemin[path_max_indice+1:], delete_entry_node,
-        delete_sink_node)
-    return arbre
 
+def file_checksum(nom):
+    """
+    La fonction file_checksum prend en entrée
+    nom : un fichier (str)
+    renvoit l'empreinte sha256 (bytes) de son contenu
+    """
+    empreinte = hashlib.sha256()
+    with open(nom, "rb") as filin:
+        for bloc in iter(lambda: filin.read(BLOC_GZIP), b""):
+            empreinte.update(bloc)
+    return empreinte.digest()
 
 
-def solve_bubble(arbre, ancetre, descendant):
+def save_kmer_index(dico, fichier, checksum=b"", min_abundance=1,
+                    trimming=None):
     """
-    prend un graphe (arbre): object networkx DiGraph()
-    ancetre: noeud ancêtre, chaine de caractères (str)
-    descendant: noeud descendant, chaine de caractères (str)
-    renvoit un graphe (arbre) nettoyé de la bulle
+    La fonction save_kmer_index prend en entrée
+    dico : un KmerCounter (ou KmerIndex)
+    fichier : le fichier index à écrire (str)
+    checksum : l'empreinte du fichier dont sont issus les k-mers (bytes)
+    min_abundance : le seuil appliqué au comptage (integer)
+    trimming : le bilan du prétraitement des reads comptés
+    (ReadFilter.stats, par défaut aucun)
+    Les k-mers sont écrits triés pour être relus par KmerIndex ; le
+    fichier est écrit à côté puis renommé pour ne jamais laisser d'index
+    tronqué. Les nombres de reads lus et de k-mers comptés (nb_reads,
+    nb_kmers) et le bilan du prétraitement sont gardés dans l'en-tête.
     """
-    solve_path = []
-    solve_length = []
-    solve_weight = []
-    paths =nx.all_simple_paths(arbre, ancetre, descendant)
-    for path in paths:
-        solve_path.append(path)
-        solve_length.append(len(path))
-        solve_weight.append(path_average_weight(arbre,path))
-    arbre = select_best_path(arbre, solve_path, solve_length,solve_weight)
-    return arbre
+    cles, occurences = dico.packed()
+    ordre = np.argsort(cles, kind="stable")
+    write_kmer_index(cles[ordre], occurences[ordre], fichier, dico.k,
+                     dico.canonical, checksum, min_abundance, dico.nb_reads,
+                     dico.nb_kmers, trimming)
 
 
+def _index_header(k, canonical, min_abundance, taille, checksum, nb_reads,
+                  nb_kmers, trimming):
+    """
+    Renvoit l'en-tête (bytes) d'un index de taille k-mers, le bilan du
+    prétraitement (trimming) étant nul sans filtre
+    """
+    trimming = trimming or {}
+    return ENTETE_INDEX.pack(
+        MAGIC_INDEX, FORMAT_INDEX, k, bool(canonical), min_abundance,
+        taille, checksum, __version__.encode("ascii"), nb_reads, nb_kmers,
+        trimming.get("bases", 0), trimming.get("fragments", 0),
+        trimming.get("kept_bases", 0))
 
-#================================================
-#================ Main program ==================
-#================================================
-def main():
+
+def write_kmer_index(cles, occurences, fichier, k, canonical=False,
+                     checksum=b"", min_abundance=1, nb_reads=0, nb_kmers=0,
+                     trimming=None):
     """
-    Main program function
+    La fonction write_kmer_index prend en entrée
+    cles : les k-mers codés, triés (tableau uint64)
+    occurences : leurs occurences (tableau uint32)
+    fichier : le fichier index à écrire (str)
+    k, canonical : la taille et le type des k-mers
+    checksum, min_abundance : voir save_kmer_index
+    nb_reads, nb_kmers : les reads lus et les k-mers comptés (integer)
+    trimming : voir save_kmer_index
+    écrit l'index (voir save_kmer_index) à côté de fichier puis le
+    renomme
     """
-    # Get arguments
-    args = get_arguments()
+    temporaire = fichier + ".tmp"
+    with open(temporaire, "wb") as filout:
+        filout.write(_index_header(k, canonical, min_abundance, len(cles),
+                                   checksum, nb_reads, nb_kmers, trimming))
+        np.asarray(cles).astype("<u8").tofile(filout)
+        np.asarray(occurences).astype("<u4").tofile(filout)
+    os.replace(temporaire, fichier)
 
-    # lecture du fichier
-    file = sys.argv[2]
 
-    # construction du graphe grace au dictionnaire kmer
-    kmer = build_kmer_dict(file,int(sys.argv[4]))
-    graphe = build_graph(kmer)
+def merge_kmer_counts(ancien, nouveau):
+    """
+    La fonction merge_kmer_counts prend en entrée
+    ancien, nouveau : deux dictionnaires de k-mers (KmerCounter ou
+    KmerIndex) de même k
+    renvoit les k-mers codés des deux dictionnaires (triés) et la somme
+    de leurs occurences
+    """
+    cles = np.union1d(ancien.packed()[0], nouveau.packed()[0])
+    return cles, ancien.get_counts(cles) + nouveau.get_counts(cles)
+
+
+def read_index_header(fichier):
+    """
+    La fonction read_index_header prend en entrée
+    fichier : un index de k-mers (str)
+    renvoit son en-tête (dict), ou None si ce n'est pas un index
+    """
+    with open(fichier, "rb") as filin:
+        octets = filin.read(ENTETE_INDEX.size)
+    if len(octets) < ENTETE_INDEX.size:
+        return None
+    (magique, format_index, k, canonical, min_abundance, taille, checksum,
+     version, nb_reads, nb_kmers, nb_bases, nb_fragments,
+     bases_gardees) = ENTETE_INDEX.unpack(octets)
+    if magique != MAGIC_INDEX or format_index != FORMAT_INDEX:
+        return None
+    return {"k": k, "canonical": bool(canonical),
+            "min_abundance": min_abundance, "size": taille,
+            "checksum": checksum,
+            "version": version.rstrip(b"\0").decode("ascii"),
+            "reads": nb_reads, "kmers": nb_kmers,
+            "trimming": {"reads": nb_reads, "bases": nb_bases,
+                         "fragments": nb_fragments,
+                         "kept_bases": bases_gardees}}
+
+
+class KmerIndex(Mapping):
+    """
+    Index de k-mers relu depuis un fichier écrit par save_kmer_index :
+    les clés triées et les occurences sont projetées en mémoire
+    (np.memmap) sans être lues, la recherche se faisant par dichotomie.
+    S'utilise comme un KmerCounter (dictionnaire k-mer (str) ->
+    occurence (int), packed, get_counts, nb_reads et nb_kmers du
+    comptage d'origine ; trimming donne le bilan de son prétraitement),
+    notamment par build_graph et
+    build_compacted_graph.
+    """
+    def __init__(self, fichier):
+        entete = read_index_header(fichier)
+        if entete is None:
+            raise ValueError("{0} is not a k-mer index".format(fichier))
+        self.fichier = fichier
+        self.header = entete
+        self.k = entete["k"]
+        self.canonical = entete["canonical"]
+        self.nb_reads = entete["reads"]
+        self.nb_kmers = entete["kmers"]
+        self.trimming = entete["trimming"]
+        taille = entete["size"]
+        if taille:
+            self._cles = np.memmap(fichier, dtype="<u8", mode="r",
+                                   offset=ENTETE_INDEX.size,
+                                   shape=(taille,))
+            self._occurences = np.memmap(
+                fichier, dtype="<u4", mode="r",
+                offset=ENTETE_INDEX.size + 8 * taille, shape=(taille,))
+        else:
+            self._cles = np.zeros(0, dtype=np.uint64)
+            self._occurences = np.zeros(0, dtype=np.uint32)
+
+    def __len__(self):
+        return len(self._cles)
+
+    def __iter__(self):
+        return iter(decode_kmers(np.asarray(self._cles), self.k))
+
+    def __getitem__(self, kmer):
+        if len(kmer) != self.k or kmer.strip("ACGTacgt"):
+            raise KeyError(kmer)
+        if self.canonical:
+            kmer = canonical_kmer(kmer.upper())
+        occurence = self.get_counts(np.array([encode_kmer(kmer)],
+                                             dtype=np.uint64))[0]
+        if occurence == 0:
+            raise KeyError(kmer)
+        return int(occurence)
+
+    def items(self):
+        return _KmerItemsView(self)
+
+    @property
+    def nbytes(self):
+        """Taille des données projetées (octets)"""
+        return self._cles.nbytes + self._occurences.nbytes
+
+    def packed(self):
+        """
+        renvoit les k-mers codés (uint64, triés) et leurs occurences
+        (uint32)
+        """
+        return (np.asarray(self._cles, dtype=np.uint64),
+                np.asarray(self._occurences, dtype=np.uint32))
+
+    def get_counts(self, cles):
+        """
+        renvoit l'occurence de chaque k-mer codé du tableau cles (0 si
+        absent)
+        """
+        cles = np.asarray(cles, dtype=np.uint64)
+        if not len(self._cles):
+            return np.zeros(len(cles), dtype=np.uint32)
+        positions = np.searchsorted(self._cles, cles)
+        positions[positions == len(self._cles)] = 0
+        trouves = self._cles[positions] == cles
+        return np.where(trouves, self._occurences[positions],
+                        0).astype(np.uint32)
+
+
+def default_cache_dir():
+    """
+    renvoit le dossier du cache d'index de k-mers
+    """
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or
+                        os.path.join(os.path.expanduser("~"), ".cache"),
+                        "debruijn")
+
+
+def cached_kmer_dict(nom, k, canonical=False, threads=1, min_abundance=1,
+                     bloom_size=None, bloom_fpr=TAUX_FAUX_POSITIFS,
+                     index=None, dossier=None, filtre=None,
+                     max_memory=None, compteur=None):
+    """
+    La fonction cached_kmer_dict prend en entrée les paramètres de
+    build_kmer_dict, ainsi que
+    index : le fichier index à utiliser (str, par défaut un fichier du
+    dossier de cache nommé d'après le chemin du fichier lu, k,
+    canonical, min_abundance, le filtre de Bloom et le prétraitement)
+    dossier : le dossier de cache (str, par défaut default_cache_dir())
+    renvoit un KmerIndex : l'index existant s'il correspond au contenu
+    du fichier lu et aux paramètres, sinon celui écrit après comptage
+
+    Les paramètres du filtre de Bloom et du prétraitement entrent dans
+    l'empreinte enregistrée : un index compté autrement n'est pas
+    réutilisé. Quand l'index existant est repris, le bilan du
+    prétraitement enregistré est recopié dans filtre.stats.
+    """
+    signature = "" if filtre is None else "." + filtre.signature()
+    if min_abundance > 1 and max_memory is None:
+        # les faux positifs du filtre de Bloom changent les k-mers gardés
+        signature += ".b{0}f{1!r}".format(bloom_size or "auto", bloom_fpr)
+    if index is None:
+        dossier = dossier or default_cache_dir()
+        os.makedirs(dossier, exist_ok=True)
+        chemin = hashlib.sha256(os.path.abspath(nom).encode()).hexdigest()
+        index = os.path.join(dossier, "{0}.{1}.k{2}{3}.m{4}{5}.kidx".format(
+            os.path.basename(nom), chemin[:12], k, "c" if canonical else "",
+            min_abundance, signature))
+    checksum = file_checksum(nom)
+    if signature:
+        checksum = hashlib.sha256(checksum + signature.encode()).digest()
+    if os.path.isfile(index):
+        entete = read_index_header(index)
+        if entete is not None and entete["k"] == k and \
+                entete["canonical"] == bool(canonical) and \
+                entete["min_abundance"] == min_abundance and \
+                entete["checksum"] == checksum and \
+                entete["version"] == __version__:
+            kmer_index = KmerIndex(index)
+            if filtre is not None:
+                filtre.stats.update(kmer_index.trimming)
+            return kmer_index
+    if max_memory is not None:
+        # le comptage sur disque écrit directement l'index
+        return count_kmers_external(nom, k, canonical, max_memory,
+                                    min_abundance, filtre, index, checksum,
+                                    os.path.dirname(os.path.abspath(index)))
+    dico = build_kmer_dict(nom, k, canonical, threads, min_abundance,
+                           bloom_size, bloom_fpr, filtre, compteur=compteur)
+    save_kmer_index(dico, index, checksum, min_abundance,
+                    None if filtre is None else filtre.stats)
+    kmer_index = KmerIndex(index)
+    if hasattr(dico, "stats"):
+        kmer_index.stats = dico.stats
+    return kmer_index
+
+
+def kmer_minimizers(codes, k, canonical=False, m=LONGUEUR_MINIMISEUR):
+    """
+    La fonction kmer_minimizers prend en entrée
+    codes : un lot de reads codés (encode_batches)
+    k : la taille du k-mer (integer)
+    canonical : prendre des m-mers canoniques, pour qu'un k-mer et son
+    reverse complément aient le même minimiseur
+    m : la longueur des minimiseurs (integer, ramenée à k au plus)
+    renvoit, pour chaque fenêtre de k bases, le haché (hash_kmers) du
+    plus petit m-mer qu'elle contient, et le masque des fenêtres valides
+    """
+    m = min(m, k)
+    nb_fenetres = len(codes) - k + 1
+    if nb_fenetres <= 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=bool)
+    mmers, mmers_valides = window_kmers(codes, m, canonical)
+    hachages = hash_kmers(mmers)
+    hachages[~mmers_valides] = np.iinfo(np.uint64).max
+    minimiseurs = np.lib.stride_tricks.sliding_window_view(
+        hachages, k - m + 1).min(axis=1)
+    invalides = np.concatenate(([0], np.cumsum(codes == CODE_INVALIDE)))
+    return minimiseurs, invalides[k:] == invalides[:-k]
+
+
+def split_superkmers(codes, k, nb_partitions, canonical=False):
+    """
+    La fonction split_superkmers prend en entrée
+    codes : un lot de reads codés (encode_batches)
+    k : la taille du k-mer (integer)
+    nb_partitions : le nombre de partitions (integer)
+    canonical : partitionner d'après les minimiseurs canoniques
+    renvoit les super-k-mers du lot, suites maximales de k-mers valides
+    consécutifs dont le minimiseur tombe dans la même partition, sous
+    forme de trois tableaux : partition, position de départ et longueur
+    (en bases)
+    """
+    minimiseurs, valides = kmer_minimizers(codes, k, canonical)
+    if not len(minimiseurs):
+        vide = np.empty(0, dtype=np.int64)
+        return vide, vide, vide
+    partitions = (minimiseurs % np.uint64(nb_partitions)).astype(np.int64)
+    partitions[~valides] = -1
+    ruptures = np.flatnonzero(np.diff(partitions)) + 1
+    debuts = np.concatenate(([0], ruptures))
+    fins = np.concatenate((ruptures, [len(partitions)]))
+    gardes = partitions[debuts] >= 0
+    debuts = debuts[gardes]
+    return partitions[debuts], debuts, fins[gardes] - debuts + k - 1
+
+
+def _spill_superkmers(codes, superkmers, fichiers):
+    """
+    Ajoute les super-k-mers (split_superkmers) du lot codes à la fin du
+    fichier de leur partition, chacun suivi d'une base invalide ;
+    renvoit le nombre d'octets écrits
+    """
+    partitions, debuts, longueurs = superkmers
+    if not len(partitions):
+        return 0
+    ordre = np.argsort(partitions, kind="stable")
+    partitions = partitions[ordre]
+    tailles = longueurs[ordre] + 1
+    fins = np.cumsum(tailles)
+    # positions des bases de chaque super-k-mer, la dernière pointant
+    # sur la base invalide ajoutée en fin de lot
+    positions = np.arange(fins[-1]) - np.repeat(
+        fins - tailles - debuts[ordre], tailles)
+    positions[fins - 1] = len(codes)
+    octets = np.append(codes, np.uint8(CODE_INVALIDE))[positions]
+    valeurs, premiers = np.unique(partitions, return_index=True)
+    bornes = np.append(fins[premiers] - tailles[premiers], len(octets))
+    for i, partition in enumerate(valeurs):
+        octets[bornes[i]:bornes[i+1]].tofile(fichiers[partition])
+    return len(octets)
+
+
+def _pack_partition(chemin, k, canonical, taille_morceau):
+    """
+    Renvoit les k-mers codés (pack_kmers) d'un fichier de partition, lu
+    par morceaux d'environ taille_morceau octets coupés après une base
+    invalide pour borner la mémoire de travail de pack_kmers
+    """
+    donnees = np.fromfile(chemin, dtype=np.uint8)
+    separateurs = np.flatnonzero(donnees == CODE_INVALIDE)
+    if not len(separateurs):
+        return pack_kmers(donnees, k, canonical)
+    coupures = separateurs[np.minimum(
+        np.searchsorted(separateurs, np.arange(taille_morceau, len(donnees),
+                                               taille_morceau)),
+        len(separateurs) - 1)] + 1
+    bornes = np.unique(np.concatenate(([0], coupures, [len(donnees)])))
+    return np.concatenate([pack_kmers(donnees[debut:fin], k, canonical)
+                           for debut, fin in zip(bornes[:-1], bornes[1:])])
+
+
+def _open_files_budget():
+    """
+    Renvoit le nombre de fichiers que le comptage externe peut ouvrir
+    ensemble : PARTITIONS_MAX, ramené sous la limite de descripteurs du
+    processus (RLIMIT_NOFILE) moins FICHIERS_RESERVES
+    """
+    limite = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if limite == resource.RLIM_INFINITY:
+        return PARTITIONS_MAX
+    return max(2, min(PARTITIONS_MAX, limite - FICHIERS_RESERVES))
+
+
+def count_kmers_external(nom, k, canonical=False, max_memory=1 << 30,
+                         min_abundance=1, filtre=None, fichier=None,
+                         checksum=b"", dossier=None):
+    """
+    La fonction count_kmers_external prend en entrée
+    nom : un fichier fastq (str)
+    k : la taille du k-mer (integer)
+    canonical : compter chaque k-mer avec son reverse complément
+    max_memory : le budget mémoire du comptage (octets)
+    min_abundance : occurence minimale des k-mers gardés (integer)
+    filtre : prétraitement des reads (ReadFilter, optionnel)
+    fichier : l'index à écrire (str, par défaut un fichier temporaire
+    supprimé une fois projeté en mémoire)
+    checksum : l'empreinte enregistrée dans l'index (bytes)
+    dossier : le dossier des fichiers temporaires (str)
+    renvoit un KmerIndex des k-mers comptés
+
+    Les reads sont découpés en super-k-mers répartis selon leur
+    minimiseur dans des fichiers de partition : tous les exemplaires
+    d'un k-mer tombant dans la même partition, chacune est comptée
+    seule et exactement, puis ses k-mers sont redistribués par tranche
+    de valeur pour écrire l'index trié. La mémoire utilisée dépend de la
+    taille d'une partition et non de celle du fichier lu. L'attribut
+    stats décrit les partitions.
+    """
+    bases = os.path.getsize(nom) * (2 if is_gzip(nom) else 1) // 2
+    nb_partitions = max(1, min(_open_files_budget(),
+                               -(-bases * OCTETS_PAR_BASE // max_memory)))
+    # lots de reads d'autant plus petits que le budget est serré
+    taille_lot = max(100, min(READS_PAR_LOT, max_memory >> 16))
+    taille_morceau = max(1 << 16, max_memory >> 8)
+    # les tranches, ouvertes ensemble elles aussi, sont une puissance de
+    # 2 qui ne dépasse pas le nombre de partitions
+    bits = max(1, nb_partitions.bit_length() - 1)
+    decalage = np.uint64(max(0, 2 * k - bits))
+    nb_tranches = 1 << min(bits, 2 * k)
+    nb_reads = nb_kmers = 0
+
+    def lues():
+        nonlocal nb_reads
+        for read in filtered_sequences(nom, filtre):
+            nb_reads += 1
+            yield read
+
+    stats = {"partitions": nb_partitions, "spilled_bytes": 0,
+             "largest_partition_bytes": 0, "kmers_counted": 0,
+             "kmers_solid": 0}
+    with tempfile.TemporaryDirectory(prefix="debruijn_",
+                                     dir=dossier) as temporaire:
+        partitions = [os.path.join(temporaire, "partition{0}".format(i))
+                      for i in range(nb_partitions)]
+        with contextlib.ExitStack() as pile:
+            fichiers = [pile.enter_context(open(chemin, "wb"))
+                        for chemin in partitions]
+            for lot in encode_batches(lues(), taille_lot):
+                superkmers = split_superkmers(lot, k, nb_partitions,
+                                              canonical)
+                nb_kmers += int(np.sum(superkmers[2] - k + 1))
+                stats["spilled_bytes"] += _spill_superkmers(
+                    lot, superkmers, fichiers)
+        if filtre is not None:
+            nb_reads = filtre.stats["reads"]
+        tranches = [os.path.join(temporaire, "tranche{0}".format(i))
+                    for i in range(nb_tranches)]
+        with contextlib.ExitStack() as pile:
+            fichiers = [pile.enter_context(open(chemin, "wb"))
+                        for chemin in tranches]
+            for chemin in partitions:
+                stats["largest_partition_bytes"] = max(
+                    stats["largest_partition_bytes"],
+                    os.path.getsize(chemin))
+                cles, occurences = np.unique(
+                    _pack_partition(chemin, k, canonical, taille_morceau),
+                    return_counts=True)
+                os.remove(chemin)
+                stats["kmers_counted"] += len(cles)
+                if min_abundance > 1:
+                    solides = occurences >= min_abundance
+                    cles, occurences = cles[solides], occurences[solides]
+                enregistrements = np.empty(len(cles),
+                                           dtype=ENREGISTREMENT_KMER)
+                enregistrements["cle"] = cles
+                enregistrements["occurence"] = occurences
+                bornes = np.searchsorted(cles >> decalage,
+                                         np.arange(nb_tranches + 1))
+                for i in np.flatnonzero(np.diff(bornes)):
+                    enregistrements[bornes[i]:bornes[i+1]].tofile(
+                        fichiers[i])
+        index = fichier or os.path.join(temporaire, "kmers.kidx")
+        ecriture = index + ".tmp"
+        comptes = os.path.join(temporaire, "occurences")
+        with open(ecriture, "wb") as filout, open(comptes, "wb+") as suite:
+            filout.write(b"\0" * ENTETE_INDEX.size)
+            for chemin in tranches:
+                enregistrements = np.fromfile(chemin,
+                                              dtype=ENREGISTREMENT_KMER)
+                os.remove(chemin)
+                ordre = np.argsort(enregistrements["cle"])
+                enregistrements["cle"][ordre].tofile(filout)
+                enregistrements["occurence"][ordre].tofile(suite)
+                stats["kmers_solid"] += len(enregistrements)
+            suite.seek(0)
+            shutil.copyfileobj(suite, filout, TAMPON_ECRITURE)
+            filout.seek(0)
+            filout.write(_index_header(
+                k, canonical, min_abundance, stats["kmers_solid"],
+                checksum, nb_reads, nb_kmers,
+                None if filtre is None else filtre.stats))
+        os.replace(ecriture, index)
+        # la projection en mémoire survit à la suppression du dossier
+        kmer_index = KmerIndex(index)
+    kmer_index.stats = stats
+    return kmer_index
+
+
+def build_graph(dico, canonical=None):
+    """
+    La fonction build_graph prend en entrée
+    dico : dictionnaire de k-mers (str) et leur nombre d'occurence (int)
+    canonical : les k-mers sont canoniques (par défaut l'attribut
+    canonical du dictionnaire)
+    renvoit un arbre orienté et pondéré
+
+    Un k-mer canonique représente les deux brins : le graphe est alors
+    bidirigé, chaque k-mer donnant un arc sur chaque brin.
+    """
+    if canonical is None:
+        canonical = getattr(dico, "canonical", False)
+    arbre_kmer = nx.DiGraph(canonical=canonical)
+    for mot, poids in dico.items():
+        arbre_kmer.add_edge(mot[0:len(mot)-1],
+            mot[1:],weight = poids)
+        if canonical:
+            inverse = reverse_complement(mot)
+            arbre_kmer.add_edge(inverse[:-1], inverse[1:], weight=poids)
+    return arbre_kmer
+
+
+def _kmer_arrays(dico, canonical):
+    """
+    Renvoit les k-mers codés (uint64), leurs occurences et k pour un
+    KmerCounter ou un dictionnaire de k-mers (str), les deux brins
+    étant présents si canonical
+    """
+    if hasattr(dico, "packed"):
+        cles, occurences = dico.packed()
+        k = dico.k
+    else:
+        mots = list(dico)
+        k = len(mots[0]) if mots else 1
+        cles = np.array([encode_kmer(mot) for mot in mots], dtype=np.uint64)
+        occurences = np.array([dico[mot] for mot in mots], dtype=np.uint32)
+    if canonical:
+        cles = np.concatenate((cles, reverse_complement_kmers(cles, k)))
+        occurences = np.concatenate((occurences, occurences))
+        # un k-mer palindrome ne donne qu'un arc
+        cles, uniques = np.unique(cles, return_index=True)
+        occurences = occurences[uniques]
+    return cles, occurences, k
+
+
+def _node_arrays(cles, k):
+    """
+    Renvoit les (k-1)-mers codés distincts (noeuds) et, pour chaque
+    k-mer, l'indice de son préfixe (origine) et de son suffixe
+    (extrémité) dans ce tableau
+    """
+    masque = np.uint64((1 << (2 * (k - 1))) - 1)
+    noeuds, indices = np.unique(np.concatenate((cles >> np.uint64(2),
+                                                cles & masque)),
+                                return_inverse=True)
+    origines, extremites = np.split(indices.ravel(), 2)
+    return noeuds, origines, extremites
+
+
+def build_compacted_graph(dico, canonical=None):
+    """
+    La fonction build_compacted_graph prend en entrée
+    dico : dictionnaire de k-mers (str) et leur nombre d'occurence (int)
+    ou KmerCounter
+    canonical : les k-mers sont canoniques (comme pour build_graph)
+    renvoit le graphe de de Bruijn compacté : chaque chaîne de noeuds
+    sans embranchement est fusionnée en un unitig.
+
+    Les noeuds sont les séquences des unitigs, avec pour attributs
+    length (taille), kmers (nombre de k-mers internes) et coverage
+    (occurence moyenne de ces k-mers) ; deux unitigs successifs se
+    chevauchent de k-2 bases et l'arc qui les relie porte l'occurence
+    du k-mer correspondant.
+    """
+    if canonical is None:
+        canonical = getattr(dico, "canonical", False)
+    cles, occurences, k = _kmer_arrays(dico, canonical)
+    noeuds, origines, extremites = _node_arrays(cles, k)
+    degre_sortant = np.bincount(origines, minlength=len(noeuds))
+    degre_entrant = np.bincount(extremites, minlength=len(noeuds))
+    # un arc est interne à un unitig s'il est le seul à quitter son
+    # origine et le seul à entrer dans son extrémité
+    internes = (degre_sortant[origines] == 1) & \
+        (degre_entrant[extremites] == 1) & (origines != extremites)
+    suivant = np.full(len(noeuds), -1, dtype=np.int64)
+    suivant[origines[internes]] = extremites[internes]
+    poids_suivant = np.zeros(len(noeuds), dtype=np.int64)
+    poids_suivant[origines[internes]] = occurences[internes]
+    debuts = np.ones(len(noeuds), dtype=bool)
+    debuts[extremites[internes]] = False
+
+    unitig = np.full(len(noeuds), -1, dtype=np.int64)
+    sequences = []
+    arbre = nx.DiGraph(canonical=canonical, compacted=True, k=k,
+                       overlap=k - 2)
+    premiers = decode_kmers(noeuds, k - 1)
+    # les débuts d'unitig d'abord, puis les cycles isolés restants
+    for depart in np.concatenate((np.flatnonzero(debuts),
+                                  np.flatnonzero(~debuts))).tolist():
+        if unitig[depart] >= 0:
+            continue
+        bases = [premiers[depart]]
+        total = 0
+        nb_kmers = 0
+        noeud = depart
+        unitig[noeud] = len(sequences)
+        while suivant[noeud] >= 0 and unitig[suivant[noeud]] < 0:
+            total += int(poids_suivant[noeud])
+            nb_kmers += 1
+            noeud = int(suivant[noeud])
+            unitig[noeud] = len(sequences)
+            bases.append(NUCLEOTIDES[int(noeuds[noeud] & np.uint64(3))])
+        sequence = "".join(bases)
+        arbre.add_node(sequence, length=len(sequence), kmers=nb_kmers,
+                       coverage=total / nb_kmers if nb_kmers else 0.0)
+        if suivant[noeud] == depart:
+            # cycle isolé : l'arc refermant le cycle devient une boucle
+            arbre.add_edge(sequence, sequence,
+                           weight=int(poids_suivant[noeud]))
+        sequences.append(sequence)
+    for origine, extremite, poids in zip(unitig[origines[~internes]].tolist(),
+                                         unitig[extremites[~internes]].tolist(),
+                                         occurences[~internes].tolist()):
+        arbre.add_edge(sequences[origine], sequences[extremite],
+                       weight=poids)
+    return arbre
+
+
+def compact_graph(arbre):
+    """
+    La fonction compact_graph prend en entrée
+    arbre: object networkx DiGraph() de de Bruijn, compacté ou non
+    renvoit un nouveau graphe compacté où les chaînes sans embranchement
+    (par exemple après simplification) sont fusionnées en unitigs
+    """
+    compacte = nx.DiGraph(**arbre.graph)
+    compacte.graph.update(compacted=True, overlap=_overlap(arbre))
+
+    def successeur_unique(noeud):
+        if arbre.out_degree(noeud) != 1:
+            return None
+        suivant = next(iter(arbre.successors(noeud)))
+        if suivant == noeud or arbre.in_degree(suivant) != 1:
+            return None
+        return suivant
+
+    def debut_de_chaine(noeud):
+        if arbre.in_degree(noeud) != 1:
+            return True
+        return successeur_unique(next(iter(arbre.predecessors(noeud)))) \
+            is None
+
+    unitig = {}
+    liens = {}
+    departs = [noeud for noeud in arbre if debut_de_chaine(noeud)]
+    # les débuts de chaîne d'abord, puis les cycles isolés restants
+    for depart in departs + list(arbre):
+        if depart in unitig:
+            continue
+        chaine = [depart]
+        unitig[depart] = None
+        total = arbre.nodes[depart].get("coverage", 0) * \
+            arbre.nodes[depart].get("kmers", 0)
+        nb_kmers = arbre.nodes[depart].get("kmers", 0)
+        suivant = successeur_unique(depart)
+        while suivant is not None and suivant not in unitig:
+            liens[chaine[-1]] = suivant
+            total += arbre[chaine[-1]][suivant]["weight"] + \
+                arbre.nodes[suivant].get("coverage", 0) * \
+                arbre.nodes[suivant].get("kmers", 0)
+            nb_kmers += 1 + arbre.nodes[suivant].get("kmers", 0)
+            chaine.append(suivant)
+            unitig[suivant] = None
+            suivant = successeur_unique(suivant)
+        sequence = path_sequence(arbre, chaine)
+        for membre in chaine:
+            unitig[membre] = sequence
+        compacte.add_node(sequence, length=len(sequence), kmers=nb_kmers,
+                          coverage=total / nb_kmers if nb_kmers else 0.0)
+    for origine, extremite, poids in arbre.edges(data="weight"):
+        if liens.get(origine) != extremite:
+            compacte.add_edge(unitig[origine], unitig[extremite],
+                              weight=poids)
+    return compacte
+
+
+class _CsrNodeView:
+    """
+    Vue des noeuds d'un CsrGraph imitant graph.nodes de networkx
+    """
+    def __init__(self, graphe):
+        self._graphe = graphe
+
+    def __call__(self):
+        return self
+
+    def __iter__(self):
+        return iter(self._graphe.labels)
+
+    def __len__(self):
+        return len(self._graphe.labels)
+
+    def __contains__(self, noeud):
+        return noeud in self._graphe.index
+
+    def __getitem__(self, noeud):
+        return self._graphe.attributes[self._graphe.index[noeud]]
+
+
+class CsrGraph:
+    """
+    Graphe orienté pondéré en lecture seule stocké dans des tableaux
+    numpy : les noeuds sont des entiers (labels donne leur étiquette),
+    les arcs sortants sont au format CSR (indptr, indices, weights), les
+    arcs entrants au format CSC (rindptr, rindices, rweights) et les
+    degrés sont précalculés.
+    Il reproduit la partie de l'interface de nx.DiGraph utilisée par
+    les fonctions de parcours ; to_networkx() en fait un graphe
+    modifiable.
+    """
+    def __init__(self, labels, origines, extremites, poids, attributs=None,
+                 **graph):
+        nb_noeuds = len(labels)
+        self.labels = list(labels)
+        self.index = {label: i for i, label in enumerate(self.labels)}
+        self.attributes = attributs or [{} for _ in range(nb_noeuds)]
+        self.graph = graph
+        self.nodes = _CsrNodeView(self)
+        origines = np.asarray(origines, dtype=np.int64)
+        extremites = np.asarray(extremites, dtype=np.int64)
+        poids = np.asarray(poids, dtype=np.int64)
+        self.out_degrees = np.bincount(origines, minlength=nb_noeuds)
+        self.in_degrees = np.bincount(extremites, minlength=nb_noeuds)
+        ordre = np.argsort(origines, kind="stable")
+        self.indptr = np.concatenate(([0], np.cumsum(self.out_degrees)))
+        self.indices = extremites[ordre]
+        self.weights = poids[ordre]
+        ordre = np.argsort(extremites, kind="stable")
+        self.rindptr = np.concatenate(([0], np.cumsum(self.in_degrees)))
+        self.rindices = origines[ordre]
+        self.rweights = poids[ordre]
+
+    @classmethod
+    def from_networkx(cls, arbre):
+        """
+        Construit un CsrGraph à partir d'un nx.DiGraph
+        """
+        labels = list(arbre)
+        index = {label: i for i, label in enumerate(labels)}
+        arcs = [(index[origine], index[extremite], poids or 0)
+                for origine, extremite, poids in arbre.edges(data="weight")]
+        origines, extremites, poids = (np.array(colonne, dtype=np.int64)
+                                       for colonne in zip(*arcs)) \
+            if arcs else ([], [], [])
+        return cls(labels, origines, extremites, poids,
+                   [dict(arbre.nodes[label]) for label in labels],
+                   **arbre.graph)
+
+    def to_networkx(self):
+        """
+        renvoit le nx.DiGraph équivalent
+        """
+        arbre = nx.DiGraph(**self.graph)
+        for label, attributs in zip(self.labels, self.attributes):
+            arbre.add_node(label, **attributs)
+        origines = np.repeat(np.arange(len(self.labels)), self.out_degrees)
+        arbre.add_weighted_edges_from(
+            (self.labels[origine], self.labels[extremite], poids)
+            for origine, extremite, poids in zip(origines.tolist(),
+                                                 self.indices.tolist(),
+                                                 self.weights.tolist()))
+        return arbre
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, noeud):
+        return noeud in self.index
+
+    def __getitem__(self, noeud):
+        i = self.index[noeud]
+        debut, fin = self.indptr[i], self.indptr[i + 1]
+        return {self.labels[j]: {"weight": poids} for j, poids
+                in zip(self.indices[debut:fin].tolist(),
+                       self.weights[debut:fin].tolist())}
+
+    def number_of_nodes(self):
+        """Nombre de noeuds"""
+        return len(self.labels)
+
+    def number_of_edges(self):
+        """Nombre d'arcs"""
+        return len(self.indices)
+
+    def successors(self, noeud):
+        """Successeurs d'un noeud"""
+        i = self.index[noeud]
+        return (self.labels[j] for j
+                in self.indices[self.indptr[i]:self.indptr[i + 1]].tolist())
+
+    def predecessors(self, noeud):
+        """Prédécesseurs d'un noeud"""
+        i = self.index[noeud]
+        return (self.labels[j] for j
+                in self.rindices[self.rindptr[i]:self.rindptr[i + 1]]
+                .tolist())
+
+    def in_degree(self, noeud):
+        """Degré entrant d'un noeud"""
+        return int(self.in_degrees[self.index[noeud]])
+
+    def out_degree(self, noeud):
+        """Degré sortant d'un noeud"""
+        return int(self.out_degrees[self.index[noeud]])
+
+    def has_edge(self, origine, extremite):
+        """Vrai si l'arc origine -> extremite existe"""
+        return origine in self.index and extremite in self[origine]
+
+    def edges(self, data=False):
+        """
+        Arcs (origine, extremite), avec leur poids si data="weight"
+        """
+        origines = np.repeat(np.arange(len(self.labels)), self.out_degrees)
+        for origine, extremite, poids in zip(origines.tolist(),
+                                             self.indices.tolist(),
+                                             self.weights.tolist()):
+            if data:
+                yield self.labels[origine], self.labels[extremite], poids
+            else:
+                yield self.labels[origine], self.labels[extremite]
+
+    def starting_nodes(self):
+        """Noeuds sans prédécesseur, en une passe vectorisée"""
+        return [self.labels[i]
+                for i in np.flatnonzero(self.in_degrees == 0).tolist()]
+
+    def sink_nodes(self):
+        """Noeuds sans successeur, en une passe vectorisée"""
+        return [self.labels[i]
+                for i in np.flatnonzero(self.out_degrees == 0).tolist()]
+
+
+##########################################################
+########### 2. Parcours du graphe de de Bruijn ###########
+##########################################################
+
+
+def get_starting_nodes(arbre):
+    """
+    La fonction get_starting_nodes prend en entrée
+    arbre: object networkx DiGraph() ou CsrGraph
+    renvoit une liste de noeuds d'entrée (str ou int)
+    """
+    if isinstance(arbre, CsrGraph):
+        return arbre.starting_nodes()
+    return [node for node, degre in arbre.in_degree() if degre == 0]
+
+
+def get_sink_nodes(arbre):
+    """
+    La fonction get_sink_nodes prend en entrée
+    arbre: object networkx DiGraph() ou CsrGraph
+    renvoit une liste de noeuds de sortie (str ou int)
+    """
+    if isinstance(arbre, CsrGraph):
+        return arbre.sink_nodes()
+    return [node for node, degre in arbre.out_degree() if degre == 0]
+
+
+def _overlap(arbre):
+    """
+    Renvoit le chevauchement (en bases) entre deux noeuds successifs :
+    k-2 pour un graphe de de Bruijn, compacté ou non
+    """
+    if "overlap" in arbre.graph:
+        return arbre.graph["overlap"]
+    for noeud in arbre:
+        if isinstance(noeud, str):
+            return len(noeud) - 1
+        break
+    return 0
+
+
+def path_sequence(arbre, chemin):
+    """
+    La fonction path_sequence prend en entrée
+    arbre: object networkx DiGraph() ou CsrGraph
+    chemin: liste de noeuds (str)
+    renvoit la séquence (str) épelée par le chemin, chaque noeud
+    n'apportant que les bases qui suivent son chevauchement avec le
+    précédent
+    """
+    chevauchement = _overlap(arbre)
+    return chemin[0] + "".join(noeud[chevauchement:] for noeud in chemin[1:])
+
+
+def path_length(arbre, chemin):
+    """
+    La fonction path_length prend en entrée
+    arbre: object networkx DiGraph() ou CsrGraph
+    chemin: liste de noeuds
+    renvoit la taille du chemin : nombre de noeuds, ou taille de la
+    séquence épelée pour un graphe compacté
+    """
+    if not arbre.graph.get("compacted"):
+        return len(chemin)
+    return sum(arbre.nodes[noeud]["length"] for noeud in chemin) - \
+        _overlap(arbre) * (len(chemin) - 1)
+
+
+def fill(text, width=80):
+    """
+    Split text with a line return to respect fasta format
+    """
+    return os.linesep.join(text[i:i+width] for i in range(0, len(text), width))
+
+
+def _strand_filter(arbre, contigs):
+    """
+    Sur un graphe canonique, chaque contig est lu sur les deux brins :
+    ne laisse passer que le premier des deux
+    """
+    if not arbre.graph.get("canonical"):
+        yield from contigs
+        return
+    vus = set()
+    for seq, taille in contigs:
+        forme = canonical_kmer(seq)
+        if forme not in vus:
+            vus.add(forme)
+            yield seq, taille
+
+
+def _bfs_parents(arbre, debut):
+    """
+    Parcours en largeur depuis debut : renvoit le parent de chaque noeud
+    atteint sur un plus court chemin
+    """
+    parents = {debut: None}
+    file_attente = deque([debut])
+    while file_attente:
+        noeud = file_attente.popleft()
+        for suivant in arbre.successors(noeud):
+            if suivant not in parents:
+                parents[suivant] = noeud
+                file_attente.append(suivant)
+    return parents
+
+
+def iter_contigs(arbre, entree, sortie):
+    """
+    La fonction iter_contigs prend en entrée
+    arbre: object networkx DiGraph() ou CsrGraph
+    entree: une liste de noeuds d'entree (str)
+    sortie: une liste de noeuds de sortie (str)
+    renvoit au fur et à mesure un tuple (contig (str), taille (int))
+    par couple entrée/sortie relié, le contig suivant le plus court
+    chemin ; un seul parcours en largeur est fait par entrée
+    """
+    def contigs():
+        for debut in entree:
+            parents = _bfs_parents(arbre, debut)
+            for fin in sortie:
+                if fin not in parents:
+                    continue
+                chemin = [fin]
+                while parents[chemin[-1]] is not None:
+                    chemin.append(parents[chemin[-1]])
+                chemin.reverse()
+                seq = path_sequence(arbre, chemin)
+                yield seq, len(seq)
+    return _strand_filter(arbre, contigs())
+
+
+def get_contigs(arbre, entree, sortie):
+    """
+    La fonction get_sink_nodes prend en entrée
+    arbre: object networkx DiGraph() ou CsrGraph
+    entree: une liste de noeurds d'entree (str)
+    sortie: une liste de noeurds de sortie (str)
+    renvoit une liste de tuple avec le contig (str) et sa taille (int)
+    (voir iter_contigs)
+    """
+    return list(iter_contigs(arbre, entree, sortie))
+
+
+def iter_unitigs(arbre):
+    """
+    La fonction iter_unitigs prend en entrée
+    arbre: object networkx DiGraph() ou CsrGraph
+    renvoit au fur et à mesure un tuple (contig (str), taille (int))
+    pour chaque chemin maximal sans embranchement, chaque arc étant
+    parcouru une seule fois (temps linéaire)
+    """
+    def simple(noeud):
+        return arbre.in_degree(noeud) == 1 and arbre.out_degree(noeud) == 1
+
+    def contigs():
+        vus = set()
+        for debut in arbre:
+            if simple(debut):
+                continue
+            # noeud isolé : un unitig à lui seul (graphe compacté)
+            if arbre.in_degree(debut) == 0 and arbre.out_degree(debut) == 0:
+                seq = path_sequence(arbre, [debut])
+                yield seq, len(seq)
+            for suivant in arbre.successors(debut):
+                chemin = [debut, suivant]
+                while simple(chemin[-1]) and chemin[-1] != debut:
+                    vus.add(chemin[-1])
+                    chemin.append(next(iter(arbre.successors(chemin[-1]))))
+                seq = path_sequence(arbre, chemin)
+                yield seq, len(seq)
+        # cycles isolés dont tous les noeuds sont simples
+        for debut in arbre:
+            if debut in vus or not simple(debut):
+                continue
+            chemin = [debut]
+            vus.add(debut)
+            suivant = next(iter(arbre.successors(debut)))
+            while suivant not in vus:
+                vus.add(suivant)
+                chemin.append(suivant)
+                suivant = next(iter(arbre.successors(suivant)))
+            chemin.append(suivant)
+            seq = path_sequence(arbre, chemin)
+            yield seq, len(seq)
+    return _strand_filter(arbre, contigs())
+
+
+def contig_summary(longueurs):
+    """
+    La fonction contig_summary prend en entrée
+    longueurs : un dictionnaire longueur (int) -> nombre de contigs (int)
+    renvoit le nombre de contigs, leur longueur totale, maximale, le N50
+    et l'histogramme des longueurs par puissance de deux (dict)
+    """
+    total = sum(longueur * nombre for longueur, nombre in longueurs.items())
+    n50 = 0
+    cumul = 0
+    for longueur in sorted(longueurs, reverse=True):
+        cumul += longueur * longueurs[longueur]
+        if 2 * cumul >= total:
+            n50 = longueur
+            break
+    histogramme = {}
+    for longueur, nombre in longueurs.items():
+        borne = 1 << max(0, longueur - 1).bit_length()
+        histogramme[borne] = histogramme.get(borne, 0) + nombre
+    return {"contigs": sum(longueurs.values()), "total_length": total,
+            "max_length": max(longueurs, default=0), "n50": n50,
+            "histogram": dict(sorted(histogramme.items()))}
+
+
+def save_contigs(contig, fichier, taille_tampon=TAMPON_ECRITURE):
+    """
+    La fonction save_contigs prend en entrée
+    contig: un itérable (liste, générateur) de tuple (séquence, longueur)
+    fichier: nom de fichier de sortie, compressé en gzip s'il finit
+    par .gz
+    taille_tampon : taille (octets) des écritures groupées
+    renvoit le résumé des contigs écrits (contig_summary)
+
+    Les contigs sont écrits au fil de l'itération sans être conservés :
+    seul l'histogramme des longueurs est gardé pour le N50.
+    """
+    if fichier.endswith(".gz"):
+        filout = gzip.open(fichier, "wb")
+    else:
+        filout = open(fichier, "wb", buffering=0)
+    longueurs = {}
+    tampon = bytearray()
+    with filout:
+        for i, (seq, longueur) in enumerate(contig):
+            if isinstance(seq, str):
+                seq = seq.encode("ascii")
+            tampon += b">contig_%d len=%d\n" % (i, longueur)
+            for debut in range(0, len(seq), LARGEUR_FASTA):
+                tampon += seq[debut:debut + LARGEUR_FASTA]
+                tampon += b"\n"
+            longueurs[longueur] = longueurs.get(longueur, 0) + 1
+            if len(tampon) >= taille_tampon:
+                filout.write(tampon)
+                del tampon[:]
+        filout.write(tampon)
+    return contig_summary(longueurs)
+
+
+##########################################################
+###### 3. Simplification du graphe de de Bruijn ##########
+##########################################################
+
+def std(liste):
+    """
+    calcule de lecart type de la liste
+    """
+    return statistics.stdev(liste)
+
+
+def path_average_weight(arbre,chemin):
+    """
+    prend un graphe (arbre): object networkx DiGraph()
+    un chemin: liste de chaine de caractères (str)
+    renvoit le poids moyen du chemin (float)
+    """
+    # poids lus directement sur les arcs du chemin
+    liste_weights = [arbre[origine][extremite]["weight"]
+                     for origine, extremite in zip(chemin, chemin[1:])]
+    if arbre.graph.get("compacted"):
+        # les k-mers internes des unitigs comptent aussi
+        total = sum(liste_weights)
+        nb_kmers = len(liste_weights)
+        for noeud in chemin:
+            total += arbre.nodes[noeud]["coverage"] * \
+                arbre.nodes[noeud]["kmers"]
+            nb_kmers += arbre.nodes[noeud]["kmers"]
+        return total / nb_kmers
+    return statistics.mean(liste_weights)
+
+
+
+def remove_paths(arbre,liste_chemin, delete_entry_node, delete_sink_node,
+                 garder=()):
+    """
+    prend un graphe (arbre): object networkx DiGraph()
+    liste_chemin: liste de chaine de caractères (str)
+    delete_entry_node: variable booléenne (True/False)
+    delete_sink_node: variable booléenne (True/False)
+    garder: noeuds à ne jamais retirer (ceux du chemin conservé)
+    retourne l'arbre nettoyé des chemins indésirables
+    """
+    garder = set(garder)
+    for chemin in liste_chemin:
+        debut = 0 if delete_entry_node else 1
+        fin = len(chemin) if delete_sink_node else len(chemin) - 1
+        # les noeuds partagés entre chemins ne sont retirés qu'une fois
+        arbre.remove_nodes_from(noeud for noeud in chemin[debut:fin]
+                                if noeud not in garder)
+    return arbre
+
+
+def _best_path_index(liste_taille, liste_weights):
+    """
+    Renvoit l'indice du meilleur chemin : le meilleur poids, puis le
+    plus long, puis un tirage aléatoire
+    """
+    # on garde les chemins de meilleur poids
+    poids_max = max(liste_weights)
+    candidats = [i for i in range(len(liste_weights))
+                 if liste_weights[i] == poids_max]
+    # si même poids, les plus longs
+    taille_max = max(liste_taille[i] for i in candidats)
+    candidats = [i for i in candidats if liste_taille[i] == taille_max]
+    # si même taille, tirage aléatoire
+    return random.choice(candidats)
+
+
+def select_best_path(arbre, liste_chemin, liste_taille,liste_weights,
+    delete_entry_node = False, delete_sink_node =False):
+    """
+    prend un graphe (arbre): object networkx DiGraph()
+    liste_chemin: liste de chaine de caractères (str)
+    liste_taille: liste de la taille de chaque chemin (int)
+    liste_weights: liste de poids moyen de chaque chemin (float)
+    delete_entry_node: variable booléenne (False)
+    delete_sink_node: variable booléenne (False)
+    retourne l'arbre nettoyé des chemins indésirables
+
+    Meilleur chemin: celui qui a le meilleur poids
+    si 2 chemins avec même poids => on prend celui le plus long
+    si même taille => on prend random
+    """
+    path_max_indice = _best_path_index(liste_taille, liste_weights)
+    arbre = remove_paths(arbre, liste_chemin[:path_max_indice]+
+        liste_chemin[path_max_indice+1:], delete_entry_node,
+        delete_sink_node, garder=liste_chemin[path_max_indice])
+    return arbre
+
+
+
+def _node_bases(arbre, noeud, chevauchement):
+    """
+    Renvoit le nombre de bases qu'un noeud ajoute à un chemin (1 pour
+    un noeud qui n'est pas une séquence)
+    """
+    if isinstance(noeud, str):
+        return len(noeud) - chevauchement
+    return 1
+
+
+def bounded_paths(arbre, ancetre, descendant, longueur_max=None,
+                  nb_chemins_max=None):
+    """
+    La fonction bounded_paths prend en entrée
+    arbre: object networkx DiGraph()
+    ancetre, descendant: les extrémités des chemins
+    longueur_max: taille maximale d'un chemin en bases (None : pas de
+    limite)
+    nb_chemins_max: nombre maximal de chemins (None : pas de limite)
+    renvoit la liste des chemins simples reliant ancetre à descendant
+    dont la partie interne fait au plus longueur_max bases (l'arc
+    rejoignant descendant comptant pour une base), ou None si leur
+    énumération dépasse nb_chemins_max (chemins trouvés et chemins
+    partiels en attente)
+    """
+    chevauchement = _overlap(arbre)
+    chemins = []
+    pile = [([ancetre], 0)]
+    while pile:
+        chemin, longueur = pile.pop()
+        for suivant in arbre.successors(chemin[-1]):
+            if suivant in chemin:
+                continue
+            taille = longueur + (1 if suivant == descendant else
+                                 _node_bases(arbre, suivant, chevauchement))
+            if longueur_max is not None and taille > longueur_max:
+                continue
+            if suivant == descendant:
+                chemins.append(chemin + [suivant])
+            else:
+                pile.append((chemin + [suivant], taille))
+            if nb_chemins_max is not None and \
+                    len(chemins) + len(pile) > nb_chemins_max:
+                return None
+    return chemins
+
+
+def _solve_paths(arbre, chemins, **options):
+    """
+    Garde le meilleur des chemins (voir select_best_path)
+    """
+    return select_best_path(arbre, chemins,
+                            [path_length(arbre, chemin) for chemin in chemins],
+                            [path_average_weight(arbre, chemin)
+                             for chemin in chemins], **options)
+
+
+def solve_bubble(arbre, ancetre, descendant, longueur_max=None,
+                 nb_chemins_max=None):
+    """
+    prend un graphe (arbre): object networkx DiGraph()
+    ancetre: noeud ancêtre, chaine de caractères (str)
+    descendant: noeud descendant, chaine de caractères (str)
+    longueur_max, nb_chemins_max: limites de la bulle (voir
+    bounded_paths) ; une bulle qui les dépasse est laissée telle quelle
+    renvoit un graphe (arbre) nettoyé de la bulle
+    """
+    chemins = bounded_paths(arbre, ancetre, descendant, longueur_max,
+                            nb_chemins_max)
+    if chemins is None or len(chemins) < 2:
+        return arbre
+    return _solve_paths(arbre, chemins)
+
+
+def find_bubble_start(arbre, noeud, profondeur_max=PROFONDEUR_BULLE):
+    """
+    La fonction find_bubble_start prend en entrée
+    arbre: object networkx DiGraph()
+    noeud: un noeud ayant plusieurs prédécesseurs
+    profondeur_max: profondeur maximale de la recherche (integer)
+    renvoit l'ancêtre le plus proche commun à au moins deux branches
+    entrant dans noeud, ou None s'il n'y en a pas à moins de
+    profondeur_max arcs
+
+    Un parcours en largeur remonte depuis chaque prédécesseur en
+    marquant chaque noeud par la branche qui l'atteint ; le premier
+    noeud atteint par deux branches ferme la bulle.
+    """
+    branches = {}
+    niveau = []
+    for branche, predecesseur in enumerate(arbre.predecessors(noeud)):
+        if predecesseur in branches:
+            continue
+        branches[predecesseur] = {branche}
+        niveau.append(predecesseur)
+    for _ in range(profondeur_max):
+        suivant = []
+        for courant in niveau:
+            for predecesseur in arbre.predecessors(courant):
+                if predecesseur == noeud:
+                    continue
+                if predecesseur not in branches:
+                    branches[predecesseur] = set()
+                    suivant.append(predecesseur)
+                branches[predecesseur] |= branches[courant]
+                if len(branches[predecesseur]) > 1:
+                    return predecesseur
+        niveau = suivant
+        if not niveau:
+            break
+    return None
+
+
+def simplify_bubbles(arbre, rapport=None, longueur_max=None,
+                     nb_chemins_max=CHEMINS_BULLE):
+    """
+    La fonction simplify_bubbles prend en entrée
+    arbre: object networkx DiGraph()
+    rapport: dictionnaire recevant le nombre de bulles résolues et
+    ignorées et la durée de la passe (optionnel)
+    longueur_max: taille maximale (en bases) d'un chemin de la bulle
+    nb_chemins_max: nombre maximal de chemins d'une bulle
+    renvoit l'arbre sans bulles
+
+    Une liste de travail contient les noeuds à plusieurs prédécesseurs :
+    après la résolution d'une bulle, seul son noeud de sortie est
+    réexaminé, au lieu de reparcourir tout le graphe. Les bulles qui
+    dépassent les limites sont ignorées.
+    """
+    debut = time.perf_counter()
+    nb_bulles = 0
+    nb_ignorees = 0
+    profondeur_max = longueur_max or PROFONDEUR_BULLE
+    a_traiter = deque(noeud for noeud, degre in arbre.in_degree()
+                      if degre > 1)
+    while a_traiter:
+        noeud = a_traiter.popleft()
+        if noeud not in arbre or arbre.in_degree(noeud) < 2:
+            continue
+        ancetre = find_bubble_start(arbre, noeud, profondeur_max)
+        if ancetre is None:
+            continue
+        chemins = bounded_paths(arbre, ancetre, noeud, longueur_max,
+                                nb_chemins_max)
+        if chemins is None or len(chemins) < 2:
+            nb_ignorees += 1
+            continue
+        nb_noeuds = arbre.number_of_nodes()
+        arbre = _solve_paths(arbre, chemins)
+        nb_bulles += 1
+        if arbre.number_of_nodes() < nb_noeuds:
+            a_traiter.append(noeud)
+    if rapport is not None:
+        rapport["bubbles"] = {"removed": nb_bulles, "skipped": nb_ignorees,
+                              "seconds": time.perf_counter() - debut}
+    return arbre
+
+
+class _Tip:
+    """
+    Pointe en cours de parcours : noeuds parcourus, somme et nombre des
+    occurences de k-mers rencontrées et taille (voir path_length). Les
+    noeuds de chemin à partir de l'indice propre sont à elle seule :
+    ce sont eux que retire sa défaite.
+    """
+    __slots__ = ("chemin", "propre", "total", "nb_kmers", "taille")
+
+    def __init__(self, arbre, noeud):
+        self.chemin = [noeud]
+        self.propre = 0
+        attributs = arbre.nodes[noeud]
+        self.total = attributs.get("coverage", 0) * attributs.get("kmers", 0)
+        self.nb_kmers = attributs.get("kmers", 0)
+        self.taille = attributs["length"] if arbre.graph.get("compacted") \
+            else 1
+
+    def fork(self):
+        """
+        Copie de la pointe pour l'une des branches qui partent de son
+        dernier noeud, qu'elle partage avec les autres copies
+        """
+        copie = _Tip.__new__(_Tip)
+        copie.chemin = [self.chemin[-1]]
+        copie.propre = 1
+        copie.total = self.total
+        copie.nb_kmers = self.nb_kmers
+        copie.taille = self.taille
+        return copie
+
+    def extend(self, arbre, noeud, poids, interne=True):
+        """
+        Ajoute noeud, atteint par un arc de poids donné ; ses k-mers
+        internes ne comptent que si interne (voir absorb)
+        """
+        self.chemin.append(noeud)
+        self.total += poids
+        self.nb_kmers += 1
+        self.taille += arbre.nodes[noeud]["length"] - _overlap(arbre) \
+            if arbre.graph.get("compacted") else 1
+        if interne:
+            self.absorb(arbre, noeud)
+
+    def absorb(self, arbre, noeud):
+        """Ajoute les k-mers internes du noeud (graphe compacté)"""
+        attributs = arbre.nodes[noeud]
+        self.total += attributs.get("coverage", 0) * attributs.get("kmers", 0)
+        self.nb_kmers += attributs.get("kmers", 0)
+
+    @property
+    def weight(self):
+        """Occurence moyenne (voir path_average_weight)"""
+        return self.total / self.nb_kmers
+
+
+def _sweep_tips(arbre, pointes, avant):
+    """
+    Parcourt ensemble toutes les pointes, vers l'aval depuis les entrées
+    (avant) ou vers l'amont depuis les sorties, chacune jusqu'au premier
+    noeud où elle rejoint d'autres chemins ; là où son chemin se divise,
+    une copie de la pointe suit chaque branche. À chaque tour, les
+    pointes arrêtées sur un même noeud sont départagées comme dans
+    select_best_path, les perdantes retirées en un lot (pour une copie,
+    sa seule branche), et la gagnante repart si le noeud n'a plus
+    d'autre branche. Une pointe n'est jamais comparée qu'à d'autres
+    pointes : celle qui rejoint un chemin venu d'ailleurs (une
+    répétition) reste en place. Chaque noeud n'est parcouru qu'une fois.
+    renvoit l'arbre et le nombre de pointes retirées
+    """
+    if avant:
+        voisins, degre_retour = arbre.successors, arbre.in_degree
+    else:
+        voisins, degre_retour = arbre.predecessors, arbre.out_degree
+    actives = [_Tip(arbre, pointe) for pointe in dict.fromkeys(pointes)
+               if pointe in arbre]
+    parcourus = {pointe.chemin[0] for pointe in actives}
+    en_attente = {}
+    nb_retirees = 0
+    while actives:
+        arrivees = {}
+        while actives:
+            pointe = actives.pop()
+            noeud = pointe.chemin[-1]
+            suivants = list(voisins(noeud))
+            for suivant in suivants:
+                if suivant in parcourus:
+                    # cycle, ou noeud de convergence déjà franchi
+                    continue
+                branche = pointe if len(suivants) == 1 else pointe.fork()
+                # le noeud de convergence, commun à toutes les pointes
+                # qui l'atteignent, ne doit pas peser dans leur choix
+                convergence = degre_retour(suivant) > 1
+                branche.extend(arbre, suivant, arbre[noeud][suivant]["weight"]
+                               if avant else arbre[suivant][noeud]["weight"],
+                               not convergence)
+                if convergence:
+                    arrivees.setdefault(suivant, []).append(branche)
+                else:
+                    parcourus.add(suivant)
+                    actives.append(branche)
+        a_retirer = []
+        arcs = []
+        for convergence, groupe in arrivees.items():
+            groupe = en_attente.pop(convergence, []) + groupe
+            if len(groupe) > 1:
+                meilleure = groupe[_best_path_index(
+                    [pointe.taille for pointe in groupe],
+                    [pointe.weight for pointe in groupe])]
+                for pointe in groupe:
+                    if pointe is meilleure:
+                        continue
+                    a_retirer.extend(pointe.chemin[pointe.propre:-1])
+                    # une copie sans noeud à elle n'est qu'un arc
+                    if pointe.propre == len(pointe.chemin) - 1:
+                        arcs.append(tuple(pointe.chemin) if avant
+                                    else tuple(reversed(pointe.chemin)))
+                nb_retirees += len(groupe) - 1
+                groupe = [meilleure]
+            en_attente[convergence] = groupe
+        arbre.remove_nodes_from(a_retirer)
+        arbre.remove_edges_from(arcs)
+        for convergence in arrivees:
+            if degre_retour(convergence) == 1:
+                parcourus.add(convergence)
+                for pointe in en_attente.pop(convergence):
+                    pointe.absorb(arbre, convergence)
+                    actives.append(pointe)
+    return arbre, nb_retirees
+
+
+def solve_entry_tips(arbre, starting_nodes, rapport=None):
+    """
+    La fonction solve_entry_tips prend en entrée
+    arbre: object networkx DiGraph()
+    starting_nodes: liste des noeuds d'entrée
+    rapport: dictionnaire recevant le nombre de pointes retirées et la
+    durée de la passe (optionnel)
+    renvoit l'arbre où, parmi les chemins d'entrée rejoignant un même
+    noeud, seul le meilleur (voir select_best_path) est conservé
+    """
+    debut = time.perf_counter()
+    arbre, nb_pointes = _sweep_tips(arbre, starting_nodes, True)
+    if rapport is not None:
+        rapport["entry_tips"] = {"removed": nb_pointes,
+                                 "seconds": time.perf_counter() - debut}
+    return arbre
+
+
+def solve_out_tips(arbre, sink_nodes, rapport=None):
+    """
+    La fonction solve_out_tips prend en entrée
+    arbre: object networkx DiGraph()
+    sink_nodes: liste des noeuds de sortie
+    rapport: dictionnaire recevant le nombre de pointes retirées et la
+    durée de la passe (optionnel)
+    renvoit l'arbre où, parmi les chemins de sortie partant d'un même
+    noeud, seul le meilleur (voir select_best_path) est conservé
+    """
+    debut = time.perf_counter()
+    arbre, nb_pointes = _sweep_tips(arbre, sink_nodes, False)
+    if rapport is not None:
+        rapport["out_tips"] = {"removed": nb_pointes,
+                               "seconds": time.perf_counter() - debut}
+    return arbre
+
+
+def print_report(rapport):
+    """
+    Affiche sur la sortie d'erreur le nombre d'éléments retirés et la
+    durée de chaque passe de simplification
+    """
+    for passe, mesures in rapport.items():
+        print("{0}: {1} removed in {2:.3f} s".format(
+            passe, mesures["removed"], mesures["seconds"]), file=sys.stderr)
+
+
+def pack_component(arbre, noeuds):
+    """
+    La fonction pack_component prend en entrée
+    arbre: object networkx DiGraph()
+    noeuds: les noeuds d'une composante (liste)
+    renvoit la composante sous forme compacte à transmettre entre
+    processus : étiquettes concaténées en un bloc d'octets (si ce sont
+    des str), tableaux numpy des arcs et des attributs des noeuds et
+    attributs du graphe
+    """
+    index = {noeud: i for i, noeud in enumerate(noeuds)}
+    arcs = [(index[origine], index[extremite], attributs.get("weight") or 0)
+            for origine in noeuds
+            for extremite, attributs in arbre[origine].items()]
+    origines, extremites, poids = (np.array(colonne, dtype=np.int64)
+                                   for colonne in zip(*arcs)) \
+        if arcs else (np.zeros(0, dtype=np.int64),) * 3
+    if all(isinstance(noeud, str) for noeud in noeuds):
+        etiquettes = "".join(noeuds).encode("ascii")
+        fins = np.cumsum([len(noeud) for noeud in noeuds], dtype=np.int64)
+    else:
+        etiquettes, fins = list(noeuds), None
+    attributs = {nom: np.array([arbre.nodes[noeud][nom]
+                                for noeud in noeuds])
+                 for nom in ("length", "kmers", "coverage")
+                 if noeuds and nom in arbre.nodes[noeuds[0]]}
+    return (etiquettes, fins, origines.astype(np.int32),
+            extremites.astype(np.int32), poids.astype(np.uint32),
+            attributs, dict(arbre.graph))
+
+
+def unpack_component(paquet):
+    """
+    La fonction unpack_component prend en entrée
+    paquet : une composante issue de pack_component
+    renvoit l'object networkx DiGraph() correspondant, noeuds et arcs
+    dans l'ordre d'origine
+    """
+    etiquettes, fins, origines, extremites, poids, attributs, graphe = \
+        paquet
+    if fins is not None:
+        debuts = np.concatenate(([0], fins[:-1])).tolist()
+        texte = etiquettes.decode("ascii")
+        etiquettes = [texte[debut:fin]
+                      for debut, fin in zip(debuts, fins.tolist())]
+    arbre = nx.DiGraph(**graphe)
+    colonnes = {nom: valeurs.tolist() for nom, valeurs in attributs.items()}
+    for i, noeud in enumerate(etiquettes):
+        arbre.add_node(noeud, **{nom: valeurs[i]
+                                 for nom, valeurs in colonnes.items()})
+    arbre.add_weighted_edges_from(
+        (etiquettes[origine], etiquettes[extremite], valeur)
+        for origine, extremite, valeur in zip(origines.tolist(),
+                                              extremites.tolist(),
+                                              poids.tolist()))
+    return arbre
+
+
+def split_components(arbre):
+    """
+    La fonction split_components prend en entrée
+    arbre: object networkx DiGraph()
+    renvoit les noeuds de chaque composante faiblement connexe (liste de
+    listes), les composantes rangées selon leur premier noeud et les
+    noeuds dans l'ordre du graphe
+    """
+    numeros = {}
+    for numero, composante in enumerate(nx.weakly_connected_components(
+            arbre)):
+        for noeud in composante:
+            numeros[noeud] = numero
+    ordre = {}
+    composantes = []
+    for noeud in arbre:
+        numero = numeros[noeud]
+        if numero not in ordre:
+            ordre[numero] = len(composantes)
+            composantes.append([])
+        composantes[ordre[numero]].append(noeud)
+    return composantes
+
+
+def _process_component(parametres):
+    """
+    Simplifie une composante puis en extrait les contigs ; renvoit la
+    composante simplifiée (pack_component), ses contigs et le rapport
+    des passes
+    """
+    paquet, graine, options = parametres
+    random.seed(graine)
+    arbre = unpack_component(paquet)
+    rapport = {}
+    if options["simplify"]:
+        arbre = simplify_bubbles(arbre, rapport, options["longueur_max"],
+                                 options["nb_chemins_max"])
+        arbre = solve_entry_tips(arbre, get_starting_nodes(arbre), rapport)
+        arbre = solve_out_tips(arbre, get_sink_nodes(arbre), rapport)
+        if arbre.graph.get("compacted"):
+            arbre = compact_graph(arbre)
+    if options["unitigs"]:
+        contigs = list(iter_unitigs(arbre))
+    else:
+        contigs = list(iter_contigs(arbre, get_starting_nodes(arbre),
+                                    get_sink_nodes(arbre)))
+    return pack_component(arbre, list(arbre)), contigs, rapport
+
+
+def _process_bundle(taches):
+    """
+    Traite un lot de composantes (voir _process_component)
+    """
+    return [_process_component(tache) for tache in taches]
+
+
+def simplify_components(arbre, threads=1, rapport=None, simplify=True,
+                        unitigs=False, longueur_max=None,
+                        nb_chemins_max=CHEMINS_BULLE):
+    """
+    La fonction simplify_components prend en entrée
+    arbre: object networkx DiGraph()
+    threads: le nombre de processus (integer)
+    rapport: dictionnaire recevant, pour chaque passe, la somme sur les
+    composantes (optionnel)
+    simplify: simplifier les composantes (bulles puis pointes)
+    unitigs: extraire les unitigs plutôt que les contigs
+    longueur_max, nb_chemins_max : voir simplify_bubbles
+    renvoit le graphe simplifié et la liste de ses contigs
+
+    Chaque composante faiblement connexe est traitée séparément, avec
+    la graine GRAINE + son rang pour les tirages de select_best_path :
+    le résultat ne dépend pas du nombre de processus.
+    """
+    options = {"simplify": simplify, "unitigs": unitigs,
+               "longueur_max": longueur_max,
+               "nb_chemins_max": nb_chemins_max}
+    composantes = split_components(arbre)
+    taches = [(pack_component(arbre, noeuds), GRAINE + rang, options)
+              for rang, noeuds in enumerate(composantes)]
+    if threads > 1 and len(taches) > 1:
+        # petites composantes groupées en lots d'au moins budget noeuds,
+        # les plus gros lots distribués en premier ; les résultats sont
+        # remis dans l'ordre des composantes
+        budget = arbre.number_of_nodes() // (LOTS_PAR_PROCESSUS * threads)
+        lots, tailles = [[]], [0]
+        for tache, noeuds in zip(taches, composantes):
+            if tailles[-1] >= budget:
+                lots.append([])
+                tailles.append(0)
+            lots[-1].append(tache)
+            tailles[-1] += len(noeuds)
+        ordre = sorted(range(len(lots)), key=lambda i: -tailles[i])
+        with multiprocessing.Pool(threads) as pool:
+            traites = pool.map(_process_bundle, [lots[i] for i in ordre],
+                               chunksize=1)
+        par_lot = dict(zip(ordre, traites))
+        resultats = [resultat for i in range(len(lots))
+                     for resultat in par_lot[i]]
+    else:
+        resultats = map(_process_component, taches)
+    simplifie = nx.DiGraph(**arbre.graph)
+    contigs = []
+    for paquet, contigs_composante, rapport_composante in resultats:
+        composante = unpack_component(paquet)
+        simplifie.add_nodes_from(composante.nodes(data=True))
+        simplifie.add_edges_from(composante.edges(data=True))
+        contigs.extend(contigs_composante)
+        if rapport is not None:
+            for passe, mesures in rapport_composante.items():
+                total = rapport.setdefault(passe, dict.fromkeys(mesures, 0))
+                for mesure, valeur in mesures.items():
+                    total[mesure] += valeur
+    # un contig et son reverse complément peuvent venir de deux
+    # composantes miroir d'un graphe canonique
+    return simplifie, list(_strand_filter(simplifie, contigs))
+
+
+def affected_nodes(arbre, noeuds):
+    """
+    La fonction affected_nodes prend en entrée
+    arbre: object networkx DiGraph()
+    noeuds: des noeuds de arbre (itérable)
+    renvoit l'ensemble des noeuds des composantes faiblement connexes
+    contenant au moins un de ces noeuds
+    """
+    non_oriente = arbre.to_undirected(as_view=True)
+    affectes = set()
+    for noeud in noeuds:
+        if noeud not in affectes:
+            affectes |= nx.node_connected_component(non_oriente, noeud)
+    return affectes
+
+
+def update_components(brut, simplifie, contigs, touches, threads=1,
+                      rapport=None, simplify=True, unitigs=False,
+                      longueur_max=None, nb_chemins_max=CHEMINS_BULLE):
+    """
+    La fonction update_components prend en entrée
+    brut: object networkx DiGraph() non simplifié, où des arcs viennent
+    d'être ajoutés ou repondérés (graphe de build_graph)
+    simplifie: le graphe simplifié avant cette mise à jour (modifié)
+    contigs: ses contigs (liste de (séquence, longueur))
+    touches: les noeuds de brut dont un arc a changé
+    les autres paramètres étant ceux de simplify_components
+    renvoit le graphe simplifié et les contigs mis à jour : seules les
+    composantes de brut contenant un noeud touché sont simplifiées à
+    nouveau, les contigs des autres composantes étant gardés
+    """
+    affectes = affected_nodes(brut, touches)
+    if not affectes:
+        return simplifie, contigs
+    partiel, nouveaux = simplify_components(
+        brut.subgraph(affectes).copy(), threads, rapport, simplify,
+        unitigs, longueur_max, nb_chemins_max)
+    simplifie.remove_nodes_from([noeud for noeud in simplifie
+                                 if noeud in affectes])
+    simplifie.add_nodes_from(partiel.nodes(data=True))
+    simplifie.add_edges_from(partiel.edges(data=True))
+    # un contig commence par un noeud (k-1-mer) de sa composante
+    taille = len(next(iter(affectes)))
+    gardes = [(seq, longueur) for seq, longueur in contigs
+              if seq[:taille] not in affectes]
+    return simplifie, gardes + nouveaux
+
+
+
+##########################################################
+############ 4. Visualisation et export du graphe ########
+##########################################################
+
+def sample_graph(arbre, max_noeuds):
+    """
+    La fonction sample_graph prend en entrée
+    arbre: object networkx DiGraph()
+    max_noeuds: le nombre maximal de noeuds (integer)
+    renvoit un sous-graphe d'au plus max_noeuds noeuds, obtenu par
+    parcours en largeur (sans orientation) depuis le noeud de plus fort
+    degré
+    """
+    if arbre.number_of_nodes() <= max_noeuds:
+        return arbre
+    depart = max(arbre, key=arbre.degree)
+    gardes = {depart}
+    file_attente = deque([depart])
+    while file_attente and len(gardes) < max_noeuds:
+        noeud = file_attente.popleft()
+        for voisin in nx.all_neighbors(arbre, noeud):
+            if voisin not in gardes and len(gardes) < max_noeuds:
+                gardes.add(voisin)
+                file_attente.append(voisin)
+    return arbre.subgraph(gardes)
+
+
+def draw_graph(arbre, fichier, max_noeuds=500):
+    """
+    La fonction draw_graph prend en entrée
+    arbre: object networkx DiGraph() ou CsrGraph
+    fichier: nom de l'image de sortie
+    max_noeuds: le nombre maximal de noeuds dessinés (integer)
+    dessine le graphe sans affichage (backend Agg) ; un graphe trop
+    grand est d'abord compacté en unitigs puis échantillonné
+    """
+    # import tardif : matplotlib n'est chargé que pour dessiner
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    if isinstance(arbre, CsrGraph):
+        arbre = arbre.to_networkx()
+    if arbre.number_of_nodes() > max_noeuds and \
+            not arbre.graph.get("compacted"):
+        arbre = compact_graph(arbre)
+    arbre = sample_graph(arbre, max_noeuds)
+    figure = plt.figure(figsize=(12, 12))
+    options = {'node_color': "red", "node_size":500}
+    nx.draw(arbre, with_labels=arbre.number_of_nodes() <= 50,
+            font_weight='bold', **options)
+    figure.savefig(fichier)
+    plt.close(figure)
+
+
+def save_graphml(arbre, fichier):
+    """
+    La fonction save_graphml prend en entrée
+    arbre: object networkx DiGraph() ou CsrGraph
+    fichier: nom du fichier de sortie
+    enregistre le graphe au format GraphML
+    """
+    if isinstance(arbre, CsrGraph):
+        arbre = arbre.to_networkx()
+    nx.write_graphml(arbre, fichier)
+
+
+def _gfa_segment(arbre, noeud):
+    """
+    Renvoit la séquence du segment GFA d'un noeud et son orientation :
+    sur un graphe canonique, un noeud et son reverse complément sont le
+    même segment lu sur l'un ou l'autre brin
+    """
+    if arbre.graph.get("canonical"):
+        forme = canonical_kmer(noeud)
+        return forme, "+" if forme == noeud else "-"
+    return noeud, "+"
+
+
+def save_gfa(arbre, fichier):
+    """
+    La fonction save_gfa prend en entrée
+    arbre: object networkx DiGraph() de de Bruijn, compacté ou non
+    fichier: nom du fichier de sortie
+    enregistre le graphe au format GFA1 : une ligne S par noeud (un
+    seul segment par paire de brins sur un graphe canonique), une ligne
+    L par arc avec le chevauchement des deux noeuds
+    """
+    chevauchement = _overlap(arbre)
+    identifiants = {}
+    with open(fichier, "w") as filout:
+        filout.write("H\tVN:Z:1.0\n")
+        for noeud in arbre:
+            segment, _ = _gfa_segment(arbre, noeud)
+            if segment in identifiants:
+                continue
+            identifiants[segment] = len(identifiants) + 1
+            filout.write("S\t{0}\t{1}\tLN:i:{2}".format(
+                identifiants[segment], segment, len(segment)))
+            if "kmers" in arbre.nodes[noeud]:
+                filout.write("\tKC:i:{0}".format(
+                    round(arbre.nodes[noeud]["coverage"] *
+                          arbre.nodes[noeud]["kmers"])))
+            filout.write("\n")
+        liens = set()
+        for origine, extremite, poids in arbre.edges(data="weight"):
+            segment_1, sens_1 = _gfa_segment(arbre, origine)
+            segment_2, sens_2 = _gfa_segment(arbre, extremite)
+            lien = (identifiants[segment_1], sens_1,
+                    identifiants[segment_2], sens_2)
+            inverse = (lien[2], "+" if sens_2 == "-" else "-",
+                       lien[0], "+" if sens_1 == "-" else "-")
+            if lien in liens or inverse in liens:
+                continue
+            liens.add(lien)
+            filout.write("L\t{0}\t{1}\t{2}\t{3}\t{4}M\tKC:i:{5}\n"
+                         .format(*lien, chevauchement, poids or 0))
+
+
+def _pack_bases(codes):
+    """
+    Regroupe des codes 2 bits (uint8) par quatre dans un octet, le
+    premier dans les bits de poids fort
+    """
+    codes = np.concatenate((codes, np.zeros(-len(codes) % 4,
+                                            dtype=np.uint8)))
+    return (codes[0::4] << 6) | (codes[1::4] << 4) | (codes[2::4] << 2) | \
+        codes[3::4]
+
+
+def _unpack_bases(octets, nb_bases):
+    """
+    Opération inverse de _pack_bases : renvoit les nb_bases premiers
+    codes 2 bits
+    """
+    codes = np.empty((len(octets), 4), dtype=np.uint8)
+    for i in range(4):
+        codes[:, i] = (octets >> (6 - 2 * i)) & 3
+    return codes.reshape(-1)[:nb_bases]
+
+
+def save_checkpoint(arbre, fichier, k, etape="build_graph"):
+    """
+    La fonction save_checkpoint prend en entrée
+    arbre: object networkx DiGraph() de de Bruijn, compacté ou non
+    fichier: nom du fichier de sortie
+    k: la taille des k-mers (integer)
+    etape: l'étape d'assemblage atteinte (str, voir ETAPES_GRAPHE)
+    enregistre le graphe dans un point de reprise binaire : en-tête,
+    attributs du graphe (json), fins des noeuds (int64), séquences des
+    noeuds codées sur 2 bits, arcs (origines et extrémités int32, poids
+    uint32) puis attributs des noeuds. Le fichier est écrit à côté puis
+    renommé.
+    """
+    if isinstance(arbre, CsrGraph):
+        arbre = arbre.to_networkx()
+    etiquettes, fins, origines, extremites, poids, attributs, graphe = \
+        pack_component(arbre, list(arbre))
+    if fins is None:
+        raise ValueError("checkpoint node labels must be sequences")
+    codes = encode_sequence(etiquettes)
+    if (codes == CODE_INVALIDE).any():
+        raise ValueError("checkpoint node labels must be ACGT sequences")
+    description = json.dumps({
+        "graph": graphe,
+        "attributes": [[nom, valeurs.dtype.str]
+                       for nom, valeurs in attributs.items()]}).encode()
+    temporaire = fichier + ".tmp"
+    with open(temporaire, "wb") as filout:
+        filout.write(ENTETE_GRAPHE.pack(
+            MAGIC_GRAPHE, FORMAT_GRAPHE, k, etape.encode("ascii"),
+            len(fins), len(origines), len(codes), len(description),
+            __version__.encode("ascii")))
+        filout.write(description)
+        fins.astype("<i8").tofile(filout)
+        _pack_bases(codes).tofile(filout)
+        origines.astype("<i4").tofile(filout)
+        extremites.astype("<i4").tofile(filout)
+        poids.astype("<u4").tofile(filout)
+        for valeurs in attributs.values():
+            valeurs.tofile(filout)
+    os.replace(temporaire, fichier)
+
+
+def read_checkpoint_header(fichier):
+    """
+    La fonction read_checkpoint_header prend en entrée
+    fichier : un point de reprise (str)
+    renvoit son en-tête (dict), ou None si ce n'est pas un point de
+    reprise
+    """
+    with open(fichier, "rb") as filin:
+        octets = filin.read(ENTETE_GRAPHE.size)
+    if len(octets) < ENTETE_GRAPHE.size:
+        return None
+    (magique, format_graphe, k, etape, nb_noeuds, nb_arcs, nb_bases,
+     taille_description, version) = ENTETE_GRAPHE.unpack(octets)
+    if magique != MAGIC_GRAPHE or format_graphe != FORMAT_GRAPHE:
+        return None
+    return {"k": k, "stage": etape.rstrip(b"\0").decode("ascii"),
+            "nodes": nb_noeuds, "edges": nb_arcs, "bases": nb_bases,
+            "description_size": taille_description,
+            "version": version.rstrip(b"\0").decode("ascii")}
+
+
+def load_checkpoint(fichier):
+    """
+    La fonction load_checkpoint prend en entrée
+    fichier : un point de reprise écrit par save_checkpoint (str)
+    renvoit l'object networkx DiGraph() enregistré, noeuds et arcs dans
+    l'ordre d'origine, et l'en-tête du fichier (dict)
+    """
+    entete = read_checkpoint_header(fichier)
+    if entete is None:
+        raise ValueError("{0} is not a graph checkpoint".format(fichier))
+    with open(fichier, "rb") as filin:
+        filin.seek(ENTETE_GRAPHE.size)
+        description = json.loads(filin.read(entete["description_size"]))
+        fins = np.fromfile(filin, dtype="<i8", count=entete["nodes"])
+        octets = np.fromfile(filin, dtype=np.uint8,
+                             count=-(-entete["bases"] // 4))
+        origines, extremites = (
+            np.fromfile(filin, dtype="<i4", count=entete["edges"])
+            for _ in range(2))
+        poids = np.fromfile(filin, dtype="<u4", count=entete["edges"])
+        attributs = {nom: np.fromfile(filin, dtype=type_valeurs,
+                                      count=entete["nodes"])
+                     for nom, type_valeurs in description["attributes"]}
+    etiquettes = TABLE_DECODAGE[_unpack_bases(octets, entete["bases"])]
+    arbre = unpack_component((etiquettes.tobytes(), fins, origines,
+                              extremites, poids, attributs,
+                              description["graph"]))
+    return arbre, entete
+
+
+def latest_checkpoint(dossier):
+    """
+    La fonction latest_checkpoint prend en entrée
+    dossier : un dossier de points de reprise (str)
+    renvoit le point de reprise le plus avancé (plus grand k, puis
+    dernière étape de ETAPES_GRAPHE), ou None s'il n'y en a aucun
+    """
+    candidats = []
+    for nom in os.listdir(dossier):
+        chemin = os.path.join(dossier, nom)
+        if not nom.endswith(".dbg") or not os.path.isfile(chemin):
+            continue
+        entete = read_checkpoint_header(chemin)
+        if entete is not None and entete["stage"] in ETAPES_GRAPHE:
+            candidats.append((entete["k"],
+                              ETAPES_GRAPHE.index(entete["stage"]), chemin))
+    return max(candidats)[2] if candidats else None
+
+
+#================================================
+#================ Main program ==================
+#================================================
+def _checkpoint(graphe, args, mesures, k, etape, suffixe):
+    """
+    Enregistre le point de reprise de l'étape dans le dossier
+    --checkpoint-dir s'il est demandé
+    """
+    if not args.checkpoint_dir:
+        return
+    with mesures.stage("checkpoint_" + etape + suffixe) as mesure:
+        os.makedirs(args.checkpoint_dir, exist_ok=True)
+        fichier = os.path.join(args.checkpoint_dir,
+                               etape + suffixe + ".dbg")
+        save_checkpoint(graphe, fichier, k, etape)
+        mesure["bytes"] = os.path.getsize(fichier)
+
+
+def assemble_graph(kmer, args, mesures, k, suffixe="", reprise=None):
+    """
+    La fonction assemble_graph prend en entrée
+    kmer : le dictionnaire des k-mers
+    args : les arguments du programme
+    mesures : les mesures par étape (StageStats)
+    k : la taille des k-mers (integer)
+    suffixe : suffixe des noms d'étape (str)
+    reprise : le graphe et l'étape d'un point de reprise (load_checkpoint),
+    les étapes déjà faites n'étant pas refaites (kmer est alors ignoré)
+    renvoit le graphe construit puis simplifié selon les arguments, et
+    ses contigs s'ils ont été extraits par composante (sinon None)
+    """
+    if reprise is None:
+        with mesures.stage("build_graph" + suffixe) as etape:
+            if args.compact:
+                graphe = build_compacted_graph(kmer)
+            else:
+                graphe = build_graph(kmer)
+            etape["nodes"] = graphe.number_of_nodes()
+            etape["edges"] = graphe.number_of_edges()
+        _checkpoint(graphe, args, mesures, k, "build_graph", suffixe)
+        fait = 0
+    else:
+        graphe, derniere = reprise
+        fait = ETAPES_GRAPHE.index(derniere)
+        # la simplification par composante est la dernière étape
+        if derniere == "components":
+            return graphe, None
+
+    # simplification et extraction par composante
+    if args.components and fait == 0:
+        rapport = {}
+        with mesures.stage("components" + suffixe) as etape:
+            graphe, contigs = simplify_components(
+                graphe, args.threads, rapport, args.simplify, args.unitigs,
+                args.max_bubble_length or 2 * k + MARGE_BULLE,
+                args.max_bubble_paths)
+            etape["nodes"] = graphe.number_of_nodes()
+            etape["contigs"] = len(contigs)
+        print_report(rapport)
+        _checkpoint(graphe, args, mesures, k, "components", suffixe)
+        return graphe, contigs
+    return _resume_simplification(graphe, args, mesures, k, suffixe, fait)
+
+
+def _resume_simplification(graphe, args, mesures, k, suffixe, fait):
+    """
+    Simplifie le graphe (bulles, pointes puis compaction) à partir de
+    l'étape suivant l'étape numéro fait de ETAPES_GRAPHE ; renvoit le
+    graphe et None (pas de contigs)
+    """
+    if not args.simplify:
+        return graphe, None
+    rapport = {}
+    if fait < ETAPES_GRAPHE.index("simplify_bubbles"):
+        with mesures.stage("simplify_bubbles" + suffixe) as etape:
+            graphe = simplify_bubbles(
+                graphe, rapport, args.max_bubble_length or
+                2 * k + MARGE_BULLE, args.max_bubble_paths)
+            etape["bubbles_removed"] = rapport["bubbles"]["removed"]
+        _checkpoint(graphe, args, mesures, k, "simplify_bubbles", suffixe)
+    if fait < ETAPES_GRAPHE.index("solve_tips"):
+        with mesures.stage("solve_tips" + suffixe) as etape:
+            graphe = solve_entry_tips(graphe, get_starting_nodes(graphe),
+                                      rapport)
+            graphe = solve_out_tips(graphe, get_sink_nodes(graphe), rapport)
+            etape["tips_removed"] = rapport["entry_tips"]["removed"] + \
+                rapport["out_tips"]["removed"]
+        _checkpoint(graphe, args, mesures, k, "solve_tips", suffixe)
+    print_report(rapport)
+    if args.compact and fait < ETAPES_GRAPHE.index("compact_graph"):
+        with mesures.stage("compact_graph" + suffixe) as etape:
+            graphe = compact_graph(graphe)
+            etape["nodes"] = graphe.number_of_nodes()
+            etape["edges"] = graphe.number_of_edges()
+        _checkpoint(graphe, args, mesures, k, "compact_graph", suffixe)
+    return graphe, None
+
+
+def read_update_state(dossier):
+    """
+    La fonction read_update_state prend en entrée
+    dossier : le dossier d'un assemblage incrémental (str)
+    renvoit les paramètres enregistrés de l'assemblage (dict), ou None
+    si le dossier n'en contient pas encore
+    """
+    fichier = os.path.join(dossier, FICHIERS_MISE_A_JOUR["state"])
+    if not os.path.isfile(fichier):
+        return None
+    with open(fichier) as filin:
+        return json.load(filin)
+
+
+def update_assembly(args, mesures, filtre=None):
+    """
+    La fonction update_assembly prend en entrée
+    args : les arguments du programme
+    mesures : les mesures par étape (StageStats)
+    filtre : prétraitement des reads (ReadFilter, optionnel)
+    renvoit le graphe simplifié et les contigs de l'assemblage du
+    dossier --update, mis à jour avec les reads de -i
+
+    Le dossier garde l'état de l'assemblage : paramètres (json),
+    occurences de tous les k-mers lus (index), graphe non simplifié et
+    graphe simplifié (points de reprise) et contigs. Absent, il est créé
+    par un assemblage complet ; sinon seuls les nouveaux reads sont
+    comptés, leurs k-mers ajoutés ou repondérés dans le graphe et les
+    composantes touchées simplifiées à nouveau.
+    """
+    dossier = args.update
+    chemins = {nom: os.path.join(dossier, fichier)
+               for nom, fichier in FICHIERS_MISE_A_JOUR.items()}
+    etat = read_update_state(dossier)
+    if etat is not None:
+        print("updating {0} (k={1})".format(dossier, etat["k"]),
+              file=sys.stderr)
+    else:
+        os.makedirs(dossier, exist_ok=True)
+        etat = {"k": args.kmer_size, "canonical": args.canonical,
+                "min_abundance": args.min_abundance, "reads": 0}
+    k, canonical = etat["k"], etat["canonical"]
+    args.kmer_size = k
+    with mesures.stage("count_kmers") as etape:
+        # toutes les occurences sont gardées : un k-mer rare peut
+        # atteindre min_abundance avec les reads suivants
+        nouveau = build_kmer_dict(args.fastq_file, k, canonical,
+                                  args.threads, filtre=filtre)
+        etape["reads"] = nouveau.nb_reads
+        etape["kmers"] = nouveau.nb_kmers
+        etape["distinct_kmers"] = len(nouveau)
+    print_trimming(filtre)
+    rapport = {}
+    options = (args.threads, rapport, args.simplify, args.unitigs,
+               args.max_bubble_length or 2 * k + MARGE_BULLE,
+               args.max_bubble_paths)
+    if not etat["reads"]:
+        cles, occurences = nouveau.packed()
+        with mesures.stage("build_graph") as etape:
+            brut = build_graph(nouveau.filtered(etat["min_abundance"]),
+                               canonical)
+            etape["nodes"] = brut.number_of_nodes()
+            etape["edges"] = brut.number_of_edges()
+        with mesures.stage("components") as etape:
+            graphe, contigs = simplify_components(brut, *options)
+            etape["nodes"] = graphe.number_of_nodes()
+            etape["contigs"] = len(contigs)
+    else:
+        with mesures.stage("load_state") as etape:
+            ancien = KmerIndex(chemins["index"])
+            brut = load_checkpoint(chemins["graph"])[0]
+            graphe = load_checkpoint(chemins["simplified"])[0]
+            contigs = [(seq, len(seq)) for seq in (
+                bytes(sequence).replace(b"\n", b"").replace(b"\r", b"")
+                .decode("ascii")
+                for sequence in read_sequences(chemins["contigs"]))]
+            etape["nodes"] = brut.number_of_nodes()
+            etape["contigs"] = len(contigs)
+        with mesures.stage("update_graph") as etape:
+            cles, occurences = merge_kmer_counts(ancien, nouveau)
+            touches = nouveau.packed()[0]
+            totaux = ancien.get_counts(touches) + nouveau.get_counts(touches)
+            solides = totaux >= etat["min_abundance"]
+            delta = KmerCounter(k, canonical=canonical)
+            delta.add_counts(touches[solides], totaux[solides])
+            modifications = build_graph(delta, canonical)
+            brut.add_weighted_edges_from(
+                modifications.edges(data="weight"))
+            etape["edges"] = modifications.number_of_edges()
+        with mesures.stage("components") as etape:
+            graphe, contigs = update_components(brut, graphe, contigs,
+                                                modifications, *options)
+            etape["nodes"] = graphe.number_of_nodes()
+            etape["contigs"] = len(contigs)
+    print_report(rapport)
+    with mesures.stage("save_state"):
+        write_kmer_index(cles, occurences, chemins["index"], k, canonical,
+                         nb_reads=etat["reads"] + nouveau.nb_reads,
+                         nb_kmers=nouveau.nb_kmers + (
+                             ancien.nb_kmers if etat["reads"] else 0))
+        save_checkpoint(brut, chemins["graph"], k, "build_graph")
+        save_checkpoint(graphe, chemins["simplified"], k, "components")
+        save_contigs(contigs, chemins["contigs"])
+        etat["reads"] += nouveau.nb_reads
+        with open(chemins["state"] + ".tmp", "w") as filout:
+            json.dump(etat, filout)
+        os.replace(chemins["state"] + ".tmp", chemins["state"])
+    return graphe, contigs
+
+
+def run_assembly(args, tables=None):
+    """
+    La fonction run_assembly prend en entrée
+    args : les arguments du programme
+    tables : les tables de comptage réutilisables d'un assemblage à
+    l'autre, par (k, canonical) (dict de KmerCounter, optionnel)
+    assemble les reads de args.fastq_file dans args.output_file et
+    renvoit le résumé des contigs (contig_summary) et les mesures par
+    étape (StageStats)
+    """
+    mesures = StageStats(args.profile)
+
+    # mise à jour d'un assemblage existant : k est celui de l'état
+    # enregistré, connu avant le prétraitement des reads ; les options
+    # de comptage doivent être celles de l'état
+    if args.update:
+        etat = read_update_state(args.update)
+        if etat is not None:
+            ecarts = [option for option, demande in (
+                ("-k {0}".format(etat["k"]),
+                 args.kmer_size in ("auto", etat["k"])),
+                ("--canonical" if etat["canonical"] else "no --canonical",
+                 args.canonical == etat["canonical"]),
+                ("--min-abundance {0}".format(etat["min_abundance"]),
+                 args.min_abundance == etat["min_abundance"]))
+                      if not demande]
+            if ecarts:
+                sys.exit("{0} was assembled with {1}: use the same options "
+                         "to update it".format(args.update,
+                                               ", ".join(ecarts)))
+            args.kmer_size = etat["k"]
+
+    # choix de k sur un échantillon des reads
+    if args.kmer_size == "auto" and not args.resume_from:
+        with mesures.stage("choose_k") as etape:
+            args.kmer_size, estimations = choose_kmer_size(
+                args.fastq_file, args.canonical, args.auto_k_reads)
+            etape["candidates"] = len(estimations)
+            etape["k"] = args.kmer_size
+        for estimation in estimations:
+            print("k={k}: {distinct_kmers} distinct, {genomic_kmers} "
+                  "genomic (abundance >= {threshold}), error rate "
+                  "{error_rate:.4f}".format(**estimation), file=sys.stderr)
+        print("selected k={0}".format(args.kmer_size), file=sys.stderr)
+
+    # prétraitement des reads
+    filtre = None
+    if args.trim and not args.resume_from:
+        tailles = args.kmer_size if isinstance(args.kmer_size, tuple) \
+            else (args.kmer_size,)
+        filtre = ReadFilter(args.min_quality,
+                            args.min_length or min(tailles))
+
+    # assemblage incrémental
+    if args.update:
+        graphe, contigs = update_assembly(args, mesures, filtre)
+    # reprise depuis un point de reprise : k est celui du graphe relu
+    elif args.resume_from:
+        with mesures.stage("load_checkpoint") as etape:
+            fichier = args.resume_from
+            if os.path.isdir(fichier):
+                fichier = latest_checkpoint(fichier)
+                if fichier is None:
+                    sys.exit("no checkpoint in {0}".format(
+                        args.resume_from))
+            graphe, entete = load_checkpoint(fichier)
+            etape["nodes"] = entete["nodes"]
+            etape["edges"] = entete["edges"]
+        print("resuming after {0} (k={1}) from {2}".format(
+            entete["stage"], entete["k"], fichier), file=sys.stderr)
+        args.kmer_size = entete["k"]
+        graphe, contigs = assemble_graph(None, args, mesures, entete["k"],
+                                         reprise=(graphe, entete["stage"]))
+    # assemblage itératif : les unitigs d'un k servent de pseudo-reads
+    # au k suivant, les reads n'étant lus et codés qu'une fois
+    elif isinstance(args.kmer_size, tuple):
+        with mesures.stage("encode_reads") as etape:
+            lots, etape["reads"] = encode_reads(args.fastq_file, filtre)
+            if filtre is not None:
+                etape["fragments"] = filtre.stats["fragments"]
+        print_trimming(filtre)
+        pseudo_reads = []
+        for k in args.kmer_size:
+            suffixe = "_k{0}".format(k)
+            with mesures.stage("count_kmers" + suffixe) as etape:
+                kmer = count_batches(lots, k, args.canonical,
+                                     args.min_abundance)
+                etape["kmers"] = kmer.nb_kmers
+                etape["pseudo_kmers"] = add_pseudo_reads(
+                    kmer, pseudo_reads, max(1, args.min_abundance))
+                etape["distinct_kmers"] = len(kmer)
+            graphe, contigs = assemble_graph(kmer, args, mesures, k,
+                                             suffixe)
+            if k != args.kmer_size[-1]:
+                pseudo_reads = [seq for seq, _ in iter_unitigs(graphe)]
+        del lots
+    else:
+        # construction du graphe grace au dictionnaire kmer
+        with mesures.stage("count_kmers") as etape:
+            compteur = None
+            if tables is not None:
+                cle = (args.kmer_size, args.canonical)
+                if cle not in tables:
+                    tables[cle] = KmerCounter(args.kmer_size,
+                                              canonical=args.canonical)
+                compteur = tables[cle]
+            if args.cache or args.index_file:
+                kmer = cached_kmer_dict(args.fastq_file, args.kmer_size,
+                                        args.canonical, args.threads,
+                                        args.min_abundance, args.bloom_size,
+                                        args.bloom_fpr, args.index_file,
+                                        args.cache_dir, filtre,
+                                        args.max_memory, compteur)
+            else:
+                kmer = build_kmer_dict(args.fastq_file, args.kmer_size,
+                                       args.canonical, args.threads,
+                                       args.min_abundance, args.bloom_size,
+                                       args.bloom_fpr, filtre,
+                                       args.max_memory, compteur)
+            # un index relu du cache donne les nombres de son comptage
+            etape["reads"] = kmer.nb_reads
+            etape["kmers"] = kmer.nb_kmers
+            etape["distinct_kmers"] = len(kmer)
+            if filtre is not None:
+                etape["fragments"] = filtre.stats["fragments"]
+        print_trimming(filtre)
+        for mesure, valeur in getattr(kmer, "stats", {}).items():
+            print("{0}: {1}".format(mesure, valeur), file=sys.stderr)
+        graphe, contigs = assemble_graph(kmer, args, mesures,
+                                         args.kmer_size)
+    if args.plot_file or args.graphml_file or args.gfa_file:
+        with mesures.stage("export_graph"):
+            if args.plot_file:
+                draw_graph(graphe, args.plot_file, args.max_plot_nodes)
+            if args.graphml_file:
+                save_graphml(graphe, args.graphml_file)
+            if args.gfa_file:
+                save_gfa(graphe, args.gfa_file)
 
     # ecriture du/des contigs
-    entry = get_starting_nodes(graphe)
-    ending = get_sink_nodes(graphe)
-    sequences = get_contigs(graphe,entry,ending)
-    save_contigs(sequences, "path_contig.txt")
+    if contigs is not None:
+        sequences = iter(contigs)
+    elif args.unitigs:
+        sequences = iter_unitigs(graphe)
+    else:
+        with mesures.stage("find_ends") as etape:
+            entry = get_starting_nodes(graphe)
+            ending = get_sink_nodes(graphe)
+            etape["starting_nodes"] = len(entry)
+            etape["sink_nodes"] = len(ending)
+        sequences = iter_contigs(graphe,entry,ending)
+    # l'extraction est paresseuse : elle est mesurée avec l'écriture
+    with mesures.stage("write_contigs") as etape:
+        resume = save_contigs(sequences, args.output_file)
+        etape["contigs"] = resume["contigs"]
+        etape["total_length"] = resume["total_length"]
+        etape["n50"] = resume["n50"]
+    print("contigs: {0} total: {1} max: {2} N50: {3}".format(
+        resume["contigs"], resume["total_length"], resume["max_length"],
+        resume["n50"]), file=sys.stderr)
+    if args.reference:
+        with mesures.stage("evaluate") as etape:
+            evaluation = evaluate_contigs(args.output_file, args.reference)
+            etape.update(evaluation)
+        print_evaluation(evaluation, args.eval_file)
+    return resume, mesures
+
+
+def read_manifest(fichier):
+    """
+    La fonction read_manifest prend en entrée
+    fichier : un manifeste (str), une ligne par échantillon avec, séparés
+    par des tabulations, le fichier de reads, le fichier de contigs et
+    éventuellement le nom de l'échantillon (par défaut le nom du fichier
+    de reads) ; les lignes vides ou commençant par # sont ignorées et
+    les chemins relatifs le sont au dossier du manifeste
+    renvoit la liste des échantillons (dict name, input, output)
+    """
+    dossier = os.path.dirname(os.path.abspath(fichier))
+    echantillons = []
+    with open(fichier) as filin:
+        for numero, ligne in enumerate(filin, 1):
+            if not ligne.strip() or ligne.startswith("#"):
+                continue
+            colonnes = ligne.rstrip("\r\n").split("\t")
+            if len(colonnes) not in (2, 3):
+                raise ValueError("{0} line {1}: expected reads file, "
+                                 "contigs file and optional sample name"
+                                 .format(fichier, numero))
+            entree, sortie = (os.path.join(dossier, chemin)
+                              for chemin in colonnes[:2])
+            nom = colonnes[2] if len(colonnes) == 3 else \
+                os.path.basename(colonnes[0])
+            echantillons.append({"name": nom, "input": entree,
+                                 "output": sortie})
+    return echantillons
+
+
+# tables de comptage d'un processus du pool, gardées d'un échantillon à
+# l'autre
+_TABLES_COMPTAGE = {}
+
+
+def _assemble_sample(parametres):
+    """
+    Assemble un échantillon du manifeste (run_assembly) en gardant ses
+    messages ; écrit ses mesures dans le fichier <contigs>.stats.json et
+    renvoit son rang et ces mesures
+    """
+    rang, echantillon, args = parametres
+    args = argparse.Namespace(**vars(args))
+    args.fastq_file = echantillon["input"]
+    args.output_file = echantillon["output"]
+    args.threads = 1
+    journal = io.StringIO()
+    debut = time.perf_counter()
+    try:
+        with contextlib.redirect_stderr(journal):
+            resume, mesures = run_assembly(args, _TABLES_COMPTAGE)
+        resultat = {"summary": resume, "stages": mesures.report()}
+    except Exception as erreur:
+        resultat = {"error": "{0}: {1}".format(type(erreur).__name__,
+                                               erreur)}
+    resultat.update(echantillon, seconds=time.perf_counter() - debut,
+                    log=journal.getvalue().splitlines())
+    with open(echantillon["output"] + ".stats.json", "w") as filout:
+        json.dump(resultat, filout, indent=2)
+    return rang, resultat
+
+
+def run_batch(args):
+    """
+    La fonction run_batch prend en entrée
+    args : les arguments du programme
+    assemble chaque échantillon du manifeste args.manifest, les plus gros
+    en premier, sur un pool de args.threads processus gardé tout le lot
+    (chaque processus réutilise sa table de comptage) ; renvoit le bilan
+    du lot (dict), écrit avec les mesures de chaque échantillon dans
+    args.stats_file s'il est donné
+    """
+    echantillons = read_manifest(args.manifest)
+    ordre = sorted(range(len(echantillons)), key=lambda i: -(
+        os.path.getsize(echantillons[i]["input"])
+        if os.path.isfile(echantillons[i]["input"]) else 0))
+    taches = [(i, echantillons[i], args) for i in ordre]
+    resultats = [None] * len(echantillons)
+    debut = time.perf_counter()
+    with contextlib.ExitStack() as pile:
+        if args.threads > 1 and len(taches) > 1:
+            pool = pile.enter_context(multiprocessing.Pool(
+                min(args.threads, len(taches))))
+            traites = pool.imap_unordered(_assemble_sample, taches,
+                                          chunksize=1)
+        else:
+            traites = map(_assemble_sample, taches)
+        for rang, resultat in traites:
+            resultats[rang] = resultat
+            if "error" in resultat:
+                print("{name}: failed, {error}".format(**resultat),
+                      file=sys.stderr)
+            else:
+                print("{0}: {contigs} contigs, N50 {n50}, {1:.2f} s".format(
+                    resultat["name"], resultat["seconds"],
+                    **resultat["summary"]), file=sys.stderr)
+    duree = time.perf_counter() - debut
+    bilan = {"samples": len(resultats),
+             "failed": sum("error" in resultat for resultat in resultats),
+             "seconds": duree,
+             "samples_per_minute": 60 * len(resultats) / duree
+             if duree else 0.0}
+    print("{samples} samples ({failed} failed) in {seconds:.2f} s: "
+          "{samples_per_minute:.1f} samples/min".format(**bilan),
+          file=sys.stderr)
+    if args.stats_file:
+        with open(args.stats_file, "w") as filout:
+            json.dump({"batch": bilan, "samples": resultats}, filout,
+                      indent=2)
+    return bilan
+
+
+def main():
+    """
+    Main program function
+    """
+    # Get arguments
+    args = get_arguments()
+    if args.evaluate:
+        print_evaluation(evaluate_contigs(args.evaluate, args.reference),
+                         args.eval_file)
+        return
+    if args.manifest:
+        if run_batch(args)["failed"]:
+            sys.exit(1)
+        return
+    _, mesures = run_assembly(args)
+    if args.stats or args.profile:
+        print_stats(mesures.report(), args.stats or "text", args.stats_file)
+
+
+##########################################################
+############ 5. Mesures et profilage #####################
+##########################################################
+
+def _peak_rss_kb():
+    """
+    renvoit le pic de mémoire résidente (ko) du programme et de ses
+    processus fils
+    """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+class StageStats:
+    """
+    Mesures par étape du pipeline : durée, temps CPU, mémoire résidente
+    et compteurs d'éléments renseignés par l'appelant. ru_maxrss étant le
+    pic sur toute la vie du processus, peak_rss_kb est le pic atteint
+    depuis le lancement à la fin de l'étape et rss_increase_kb la hausse
+    de ce pic pendant l'étape (nulle si l'étape n'a pas dépassé les
+    précédentes) ; avec
+    profil, chaque étape est aussi profilée (cProfile) et son pic
+    d'allocation Python mesuré (tracemalloc).
+    """
+    NB_FONCTIONS = 10
+
+    def __init__(self, profil=False):
+        self.profil = profil
+        self.etapes = {}
+        self._debut = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, nom):
+        """
+        Mesure le bloc with ; le dictionnaire renvoyé reçoit les
+        compteurs d'éléments de l'étape
+        """
+        mesures = {}
+        if self.profil:
+            tracemalloc.start()
+            profileur = cProfile.Profile()
+            profileur.enable()
+        pic = _peak_rss_kb()
+        cpu = time.process_time()
+        debut = time.perf_counter()
+        try:
+            yield mesures
+        finally:
+            mesures["seconds"] = time.perf_counter() - debut
+            mesures["cpu_seconds"] = time.process_time() - cpu
+            mesures["peak_rss_kb"] = _peak_rss_kb()
+            mesures["rss_increase_kb"] = mesures["peak_rss_kb"] - pic
+            if self.profil:
+                profileur.disable()
+                mesures["peak_traced_bytes"] = \
+                    tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                mesures["profile"] = self._top_functions(profileur)
+            self.etapes[nom] = mesures
+
+    def _top_functions(self, profileur):
+        """
+        renvoit les fonctions les plus coûteuses (temps cumulé) du profil
+        """
+        fonctions = sorted(pstats.Stats(profileur).stats.items(),
+                           key=lambda element: element[1][3], reverse=True)
+        return [{"function": "{0}:{1}({2})".format(*fonction),
+                 "calls": appels, "own_seconds": propre,
+                 "cumulative_seconds": cumul}
+                for fonction, (_, appels, propre, cumul, _)
+                in fonctions[:self.NB_FONCTIONS]]
+
+    def report(self):
+        """
+        renvoit le rapport de toutes les étapes (dict)
+        """
+        return {"total_seconds": time.perf_counter() - self._debut,
+                "peak_rss_kb": _peak_rss_kb(), "stages": self.etapes}
+
+
+def print_stats(rapport, format_sortie="text", fichier=None):
+    """
+    La fonction print_stats prend en entrée
+    rapport : le rapport de StageStats.report (dict)
+    format_sortie : "text" ou "json"
+    fichier : le fichier de sortie (str, par défaut la sortie d'erreur)
+    """
+    if format_sortie == "json":
+        texte = json.dumps(rapport, indent=2)
+    else:
+        lignes = []
+        for etape, mesures in rapport["stages"].items():
+            compteurs = " ".join(
+                "{0}={1}".format(cle, valeur)
+                for cle, valeur in mesures.items()
+                if cle not in ("seconds", "cpu_seconds", "peak_rss_kb",
+                               "rss_increase_kb", "peak_traced_bytes",
+                               "profile"))
+            lignes.append("{0}: {1:.3f} s (cpu {2:.3f} s) rss +{3} kB "
+                          "(process peak {4} kB) {5}"
+                          .format(etape, mesures["seconds"],
+                                  mesures["cpu_seconds"],
+                                  mesures["rss_increase_kb"],
+                                  mesures["peak_rss_kb"], compteurs)
+                          .rstrip())
+            for fonction in mesures.get("profile", []):
+                lignes.append("    {0:8.3f} s {1:>8} {2}".format(
+                    fonction["cumulative_seconds"], fonction["calls"],
+                    fonction["function"]))
+        lignes.append("total: {0:.3f} s process peak rss {1} kB".format(
+            rapport["total_seconds"], rapport["peak_rss_kb"]))
+        texte = "\n".join(lignes)
+    if fichier:
+        with open(fichier, "w") as filout:
+            filout.write(texte + "\n")
+    else:
+        print(texte, file=sys.stderr)
+
+
+##########################################################
+########## 6. Evaluation des contigs #####################
+##########################################################
+
+def _fasta_codes(sequence):
+    """
+    Code une séquence fasta éventuellement écrite sur plusieurs lignes
+    (voir encode_sequence), fins de ligne retirées
+    """
+    octets = np.frombuffer(sequence, dtype=np.uint8)
+    return TABLE_CODAGE[octets[(octets != 10) & (octets != 13)]]
+
+
+def _join_codes(sequences):
+    """
+    Concatène des séquences codées en les séparant par une base
+    invalide ; renvoit le tableau obtenu et la position de départ de
+    chaque séquence
+    """
+    longueurs = np.array([len(sequence) for sequence in sequences],
+                         dtype=np.int64)
+    debuts = np.concatenate(([0], np.cumsum(longueurs + 1)[:-1]))
+    codes = np.full(int(longueurs.sum()) + len(sequences), CODE_INVALIDE,
+                    dtype=np.uint8)
+    for debut, sequence in zip(debuts.tolist(), sequences):
+        codes[debut:debut + len(sequence)] = sequence
+    return codes, debuts
+
+
+def _strand_kmers(codes, k):
+    """
+    renvoit les k-mers codés de toutes les fenêtres de codes, leur forme
+    canonique et le masque des fenêtres valides (voir window_kmers)
+    """
+    directs, valides = window_kmers(codes, k)
+    canoniques = np.minimum(directs, reverse_complement_kmers(directs, k))
+    return directs, canoniques, valides
+
+
+def _covered_bases(debuts, k, taille):
+    """
+    renvoit le nombre de positions de [0, taille) couvertes par les
+    k-mers commençant aux positions debuts
+    """
+    if not len(debuts):
+        return 0
+    profondeur = np.cumsum(np.bincount(debuts, minlength=taille + 1) -
+                           np.bincount(debuts + k, minlength=taille + 1))
+    return int(np.count_nonzero(profondeur[:taille]))
+
+
+class ReferenceIndex:
+    """
+    Index des k-mers canoniques d'une référence : k-mers distincts triés
+    (recherche par dichotomie) avec leur multiplicité, et pour chaque
+    occurence sa position dans les séquences concaténées (séparées par
+    une base invalide) et son brin. Un k-mer présent une seule fois
+    sert d'ancre pour situer un contig sur la référence.
+    """
+    def __init__(self, fichier, k=K_EVALUATION):
+        sequences = [_fasta_codes(sequence)
+                     for sequence in read_sequences(fichier)]
+        self.k = k
+        self.longueur = sum(len(sequence) for sequence in sequences)
+        codes, self.debuts = _join_codes(sequences)
+        self.taille = len(codes)
+        directs, canoniques, valides = _strand_kmers(codes, k)
+        positions = np.flatnonzero(valides)
+        cles = canoniques[positions]
+        ordre = np.argsort(cles, kind="stable")
+        self.positions = positions[ordre]
+        self.brins = (directs[positions] == cles)[ordre]
+        self.kmers, self.premieres, self.multiplicites = np.unique(
+            cles[ordre], return_index=True, return_counts=True)
+
+    def __len__(self):
+        return len(self.kmers)
+
+    def lookup(self, cles):
+        """
+        renvoit le rang de chaque k-mer canonique de cles parmi les
+        k-mers distincts de la référence (-1 si absent)
+        """
+        cles = np.asarray(cles, dtype=np.uint64)
+        if not len(self.kmers):
+            return np.full(len(cles), -1, dtype=np.int64)
+        # des clés triées parcourent l'index dans l'ordre, bien plus vite
+        # que des recherches dispersées
+        ordre = np.argsort(cles)
+        rangs = np.empty(len(cles), dtype=np.int64)
+        rangs[ordre] = np.searchsorted(self.kmers, cles[ordre])
+        rangs[rangs == len(self.kmers)] = 0
+        return np.where(self.kmers[rangs] == cles, rangs, -1)
+
+    def covered_bases(self, presents):
+        """
+        renvoit le nombre de bases de la référence couvertes par les
+        occurences des k-mers distincts marqués dans presents (masque)
+        """
+        occurences = np.repeat(presents, self.multiplicites)
+        return _covered_bases(self.positions[occurences], self.k,
+                              self.taille)
+
+
+def _contig_batches(fichier, taille=READS_PAR_LOT):
+    """
+    Lit les contigs d'un fichier fasta par lots ; renvoit (générateur)
+    les contigs codés de chaque lot
+    """
+    lot = []
+    for sequence in read_sequences(fichier):
+        lot.append(_fasta_codes(sequence))
+        if len(lot) == taille:
+            yield lot
+            lot = []
+    if lot:
+        yield lot
+
+
+def evaluate_contigs(fichier, reference, k=K_EVALUATION,
+                     ecart_max=ECART_MAUVAIS_ASSEMBLAGE):
+    """
+    La fonction evaluate_contigs prend en entrée
+    fichier : un fichier de contigs (fasta, éventuellement compressé)
+    reference : le génome de référence (fichier fasta ou ReferenceIndex)
+    k : la taille des k-mers comparés (integer, au plus KMER_MAX)
+    ecart_max : décalage (pb) au-delà duquel deux ancres consécutives
+    d'un contig marquent une cassure
+    renvoit un dictionnaire de mesures : part des k-mers des contigs
+    présents dans la référence (containment), part de la référence
+    couverte par ces k-mers (genome_fraction), bases alignées des
+    contigs rapportées aux bases couvertes de la référence
+    (duplication_ratio), cassures (misassemblies : deux ancres
+    consécutives d'un contig sur des brins ou séquences différents, ou
+    décalées de plus de ecart_max) et contigs cassés, N50 et NG50
+    """
+    if not isinstance(reference, ReferenceIndex):
+        reference = ReferenceIndex(reference, k)
+    k = reference.k
+    presents_reference = np.zeros(len(reference), dtype=bool)
+    longueurs = []
+    nb_kmers = nb_trouves = bases_alignees = cassures = contigs_casses = 0
+    for lot in _contig_batches(fichier):
+        longueurs.extend(len(contig) for contig in lot)
+        codes, debuts = _join_codes(lot)
+        directs, canoniques, valides = _strand_kmers(codes, k)
+        fenetres = np.flatnonzero(valides)
+        rangs = reference.lookup(canoniques[fenetres])
+        trouves = rangs >= 0
+        nb_kmers += len(fenetres)
+        nb_trouves += int(np.count_nonzero(trouves))
+        presents_reference[rangs[trouves]] = True
+        bases_alignees += _covered_bases(fenetres[trouves], k, len(codes))
+        # ancres : k-mers uniques de la référence, dans l'ordre des contigs
+        ancres = trouves.copy()
+        ancres[trouves] = reference.multiplicites[rangs[trouves]] == 1
+        fenetres, rangs = fenetres[ancres], rangs[ancres]
+        occurences = reference.premieres[rangs]
+        positions = reference.positions[occurences]
+        meme_brin = reference.brins[occurences] == \
+            (directs[fenetres] == canoniques[fenetres])
+        contigs = np.searchsorted(debuts, fenetres, side="right") - 1
+        decalages = fenetres - debuts[contigs]
+        diagonales = np.where(meme_brin, positions - decalages,
+                              positions + decalages)
+        sequences = np.searchsorted(reference.debuts, positions,
+                                    side="right") - 1
+        ruptures = (contigs[1:] == contigs[:-1]) & (
+            (meme_brin[1:] != meme_brin[:-1]) |
+            (sequences[1:] != sequences[:-1]) |
+            (np.abs(diagonales[1:] - diagonales[:-1]) > ecart_max))
+        cassures += int(np.count_nonzero(ruptures))
+        contigs_casses += len(np.unique(contigs[1:][ruptures]))
+    couvertes = reference.covered_bases(presents_reference)
+    total = sum(longueurs)
+    ng50 = 0
+    cumul = 0
+    for longueur in sorted(longueurs, reverse=True):
+        cumul += longueur
+        if 2 * cumul >= reference.longueur:
+            ng50 = longueur
+            break
+    return {"reference_length": reference.longueur, "kmer_size": k,
+            "contigs": len(longueurs), "total_length": total,
+            "containment": nb_trouves / nb_kmers if nb_kmers else 0.0,
+            "genome_fraction": couvertes / reference.longueur
+            if reference.longueur else 0.0,
+            "duplication_ratio": bases_alignees / couvertes
+            if couvertes else 0.0,
+            "misassemblies": cassures,
+            "misassembled_contigs": contigs_casses,
+            "n50": contig_summary(Counter(longueurs))["n50"],
+            "ng50": ng50}
+
+
+def print_evaluation(evaluation, fichier=None):
+    """
+    Affiche les mesures de evaluate_contigs, une par ligne, sur la sortie
+    d'erreur ou dans fichier (json si son nom finit par .json)
+    """
+    if fichier is not None and fichier.endswith(".json"):
+        with open(fichier, "w") as filout:
+            json.dump(evaluation, filout, indent=2)
+        return
+    lignes = ["{0}: {1:.4f}".format(mesure, valeur)
+              if isinstance(valeur, float) else
+              "{0}: {1}".format(mesure, valeur)
+              for mesure, valeur in evaluation.items()]
+    if fichier is None:
+        print("\n".join(lignes), file=sys.stderr)
+    else:
+        with open(fichier, "w") as filout:
+            filout.write("\n".join(lignes) + "\n")
 
 
 if __name__ == '__main__':
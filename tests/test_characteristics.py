@@ -3,12 +3,28 @@ import pytest
 import os
 import networkx as nx
 import hashlib
+import gzip
 from .context import debruijn
 #from .context import debruijn_comp
 from debruijn import get_starting_nodes
 from debruijn import get_sink_nodes
 from debruijn import get_contigs
 from debruijn import save_contigs
+from debruijn import path_sequence
+from debruijn import iter_unitigs
+from debruijn import save_gfa
+from debruijn import CsrGraph
+from debruijn import StageStats
+from debruijn import pack_component
+from debruijn import unpack_component
+from debruijn import split_components
+from debruijn import simplify_components
+from debruijn import save_checkpoint
+from debruijn import load_checkpoint
+from debruijn import latest_checkpoint
+from debruijn import update_components
+from debruijn import evaluate_contigs
+from debruijn import reverse_complement
 
 
 def test_get_starting_nodes():
@@ -38,6 +54,58 @@ def test_get_contigs():
         assert contig[1] == 8
 
 
+def test_csr_graph():
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(1, 2, 5), (3, 2, 10), (2, 4, 10), (4, 5, 3), (5, 6, 10), (5, 7, 10)])
+    csr_graph = CsrGraph.from_networkx(graph)
+    assert sorted(get_starting_nodes(csr_graph)) == [1, 3]
+    assert sorted(get_sink_nodes(csr_graph)) == [6, 7]
+    assert csr_graph.in_degree(2) == 2
+    assert sorted(csr_graph.successors(5)) == [6, 7]
+    assert csr_graph[4][5]["weight"] == 3
+    assert set(csr_graph.to_networkx().edges(data="weight")) == set(graph.edges(data="weight"))
+    graph = nx.DiGraph()
+    graph.add_edges_from([("TC", "CA"), ("AC", "CA"), ("CA", "AG"), ("AG", "GC"), ("GC", "CG"), ("CG", "GA"), ("GA", "AT"), ("GA", "AA")])
+    contig_list = get_contigs(CsrGraph.from_networkx(graph), ["TC", "AC"], ["AT" , "AA"])
+    assert sorted(contig_list) == sorted(get_contigs(graph, ["TC", "AC"], ["AT" , "AA"]))
+
+
+def test_iter_unitigs_isolated():
+    graph = nx.DiGraph(compacted=True, overlap=1)
+    graph.add_node("TCAGA", length=5, kmers=3, coverage=1.0)
+    assert list(iter_unitigs(graph)) == [("TCAGA", 5)]
+
+
+def test_iter_unitigs():
+    graph = nx.DiGraph()
+    graph.add_edges_from([("TC", "CA"), ("AC", "CA"), ("CA", "AG"), ("AG", "GC"), ("GC", "CG"), ("CG", "GA"), ("GA", "AT"), ("GA", "AA")])
+    contigs = iter_unitigs(graph)
+    assert not isinstance(contigs, list)
+    assert sorted(contigs) == [("ACA", 3), ("CAGCGA", 6), ("GAA", 3),
+                               ("GAT", 3), ("TCA", 3)]
+
+
+def test_save_gfa(tmp_path):
+    graph = nx.DiGraph(canonical=True)
+    # AGA et son reverse complément TCT
+    graph.add_weighted_edges_from([("AG", "GA", 2), ("TC", "CT", 2)])
+    gfa_file = str(tmp_path / "graph.gfa")
+    save_gfa(graph, gfa_file)
+    with open(gfa_file) as gfa:
+        lines = gfa.read().splitlines()
+    assert lines[0] == "H\tVN:Z:1.0"
+    assert [line for line in lines if line.startswith("S")] == [
+        "S\t1\tAG\tLN:i:2", "S\t2\tGA\tLN:i:2"]
+    assert [line for line in lines if line.startswith("L")] == [
+        "L\t1\t+\t2\t+\t1M\tKC:i:2"]
+
+
+def test_path_sequence():
+    graph = nx.DiGraph(compacted=True, overlap=1)
+    graph.add_edges_from([("TCAG", "GCGA"), ("GCGA", "AT")])
+    assert path_sequence(graph, ["TCAG", "GCGA", "AT"]) == "TCAGCGAT"
+
+
 # def test_get_contigs_comp():
 #     graph = nx.DiGraph()
 #     graph.add_edges_from([(("AG", "TC"), ("CA", "GT")), (("AC", "TG"), ("CA", "GT")), (("CA", "GT"), ("AG", "TC")), 
@@ -56,4 +124,102 @@ def test_save_contigs():
     contig = [("TCAGCGAT", 8), ("TCAGCGAA",8), ("ACAGCGAT", 8), ("ACAGCGAA", 8)]
     save_contigs(contig, test_file)
     with open(test_file, 'rb') as contig_test:
-        assert hashlib.md5(contig_test.read()).hexdigest() == "ca84dfeb5d58eca107e34de09b3cc997"
\ No newline at end of file
+        assert hashlib.md5(contig_test.read()).hexdigest() == "ca84dfeb5d58eca107e34de09b3cc997"
+
+
+def test_save_contigs_gzip(tmp_path):
+    test_file = str(tmp_path / "contigs.fna.gz")
+    contig = (("A" * longueur, longueur) for longueur in (100, 30, 50))
+    resume = save_contigs(contig, test_file, taille_tampon=16)
+    assert resume["contigs"] == 3
+    assert resume["total_length"] == 180
+    assert resume["n50"] == 100
+    assert resume["histogram"] == {32: 1, 64: 1, 128: 1}
+    with gzip.open(test_file, "rt") as contig_test:
+        lignes = contig_test.read().split("\n")
+    assert lignes[0] == ">contig_0 len=100"
+    assert lignes[1] == "A" * 80
+    assert lignes[2] == "A" * 20
+
+
+def test_evaluate_contigs(tmp_path):
+    reference = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71.fna"))
+    with open(reference) as filin:
+        genome = "".join(ligne.strip() for ligne in filin if not ligne.startswith(">"))
+    contigs = [genome[:3000], reverse_complement(genome[3000:6000]),
+               genome[100:1100] + genome[5000:6000]]
+    fichier = str(tmp_path / "contigs.fasta")
+    save_contigs([(contig, len(contig)) for contig in contigs], fichier)
+    evaluation = evaluate_contigs(fichier, reference)
+    assert evaluation["contigs"] == 3
+    assert evaluation["containment"] > 0.99
+    assert evaluation["genome_fraction"] == pytest.approx(6000 / len(genome))
+    assert evaluation["duplication_ratio"] == pytest.approx(8000 / 6000)
+    # seul le contig chimérique est cassé
+    assert evaluation["misassemblies"] == 1
+    assert evaluation["misassembled_contigs"] == 1
+    assert evaluation["ng50"] == 3000
+
+
+def test_stage_stats():
+    mesures = StageStats(profil=True)
+    with mesures.stage("contigs") as etape:
+        etape["contigs"] = len(get_contigs(nx.DiGraph([("TC", "CA")]), ["TC"], ["CA"]))
+    rapport = mesures.report()
+    assert rapport["stages"]["contigs"]["contigs"] == 1
+    assert rapport["stages"]["contigs"]["seconds"] >= 0
+    assert rapport["stages"]["contigs"]["profile"]
+    assert "peak_traced_bytes" in rapport["stages"]["contigs"]
+    assert rapport["stages"]["contigs"]["rss_increase_kb"] >= 0
+    assert rapport["stages"]["contigs"]["peak_rss_kb"] <= rapport["peak_rss_kb"]
+
+
+def test_pack_component():
+    graph = nx.DiGraph(compacted=True, overlap=1)
+    graph.add_node("TCA", length=3, kmers=1, coverage=2.0)
+    graph.add_node("AGA", length=3, kmers=1, coverage=1.0)
+    graph.add_edge("TCA", "AGA", weight=3)
+    copie = unpack_component(pack_component(graph, list(graph)))
+    assert list(copie.nodes(data=True)) == list(graph.nodes(data=True))
+    assert list(copie.edges(data=True)) == list(graph.edges(data=True))
+    assert copie.graph == graph.graph
+
+
+def test_checkpoint(tmp_path):
+    graph = nx.DiGraph(compacted=True, overlap=2, k=3)
+    graph.add_node("TCAGA", length=5, kmers=3, coverage=2.5)
+    graph.add_node("AGAT", length=4, kmers=2, coverage=1.0)
+    graph.add_edge("TCAGA", "AGAT", weight=3)
+    save_checkpoint(graph, str(tmp_path / "build_graph.dbg"), 3)
+    copie, entete = load_checkpoint(str(tmp_path / "build_graph.dbg"))
+    assert list(copie.nodes(data=True)) == list(graph.nodes(data=True))
+    assert list(copie.edges(data=True)) == list(graph.edges(data=True))
+    assert copie.graph == graph.graph
+    assert entete["k"] == 3 and entete["stage"] == "build_graph"
+    save_checkpoint(nx.DiGraph([("TC", "CA")]), str(tmp_path / "solve_tips.dbg"),
+                    3, "solve_tips")
+    assert latest_checkpoint(str(tmp_path)) == str(tmp_path / "solve_tips.dbg")
+    assert list(load_checkpoint(latest_checkpoint(str(tmp_path)))[0].edges()) == \
+        [("TC", "CA")]
+
+
+def test_update_components():
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([("TC", "CA", 2), ("CA", "AG", 2), ("GG", "GT", 1),
+                                   ("GT", "TT", 1)])
+    simplifie, contigs = simplify_components(graph)
+    graph.add_weighted_edges_from([("AG", "GA", 3)])
+    simplifie, contigs = update_components(graph, simplifie, contigs, ["AG", "GA"])
+    assert contigs == [("GGTT", 4), ("TCAGA", 5)]
+    assert set(simplifie.edges()) == set(graph.edges())
+
+
+def test_simplify_components():
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([("TC", "CA", 2), ("CA", "AG", 2), ("GG", "GT", 1),
+                                   ("GT", "TT", 1), ("TA", "AC", 5)])
+    simplifie, contigs = simplify_components(graph, threads=2)
+    assert contigs == [("TCAG", 4), ("GGTT", 4), ("TAC", 3)]
+    assert simplify_components(graph)[1] == contigs
+    assert set(simplifie.edges()) == set(graph.edges())
+    assert split_components(graph) == [["TC", "CA", "AG"], ["GG", "GT", "TT"], ["TA", "AC"]]
@@ -3,12 +3,40 @@ import pytest
 import os
 import networkx as nx
 import pickle
+import numpy as np
+import gzip
+import resource
 from .context import debruijn
 #from .context import debruijn_comp
 from debruijn import read_fastq
+from debruijn import read_sequences
 from debruijn import cut_kmer
 from debruijn import build_kmer_dict
 from debruijn import build_graph
+from debruijn import build_compacted_graph
+from debruijn import encode_sequence
+from debruijn import encode_kmer
+from debruijn import pack_kmers
+from debruijn import KmerCounter
+from debruijn import reverse_complement
+from debruijn import BloomFilter
+from debruijn import ReadFilter
+from debruijn import encode_reads
+from debruijn import count_batches
+from debruijn import add_pseudo_reads
+from debruijn import kmer_spectra
+from debruijn import estimate_spectrum
+from debruijn import choose_kmer_size
+from debruijn import KmerIndex
+from debruijn import cached_kmer_dict
+from debruijn import save_kmer_index
+from debruijn import count_kmers_external
+from debruijn import split_superkmers
+from debruijn import merge_kmer_counts
+from debruijn import read_manifest
+from debruijn import read_update_state
+from debruijn import get_arguments
+from debruijn import run_assembly
 
 
 def test_read_fastq():
@@ -18,6 +46,17 @@ def test_read_fastq():
     assert next(fastq_reader) == "TTTGAATTACAACATCCATATGTTCTTGATGCTGGAATTCCAATATCTCAGTTGACAGTGTGCCCTCACCAGTGGATCAATTTACGAACCAACAATTGTG"
 
 
+def test_read_sequences(tmp_path):
+    """Test gzip, Windows line endings and multi-line fasta"""
+    fastq_gz = str(tmp_path / "reads.fq.gz")
+    with gzip.open(fastq_gz, "wb") as filout:
+        filout.write(b"@r1\r\nTCAG\r\n+\r\nJJJJ\r\n@r2\r\nAGA\r\n+\r\n@JJ\r\n")
+    assert list(read_sequences(fastq_gz)) == [b"TCAG", b"AGA"]
+    fasta = tmp_path / "genome.fna"
+    fasta.write_bytes(b">g1\nTCA\nGAG\n>g2\nAGA\n")
+    assert [bytes(seq) for seq in read_sequences(str(fasta))] == [b"TCAGAG", b"AGA"]
+
+
 def test_cut_kmer():
     """test Kmer cut"""
     kmer_reader = cut_kmer("TCAGA", 3)
@@ -35,6 +74,270 @@ def test_build_kmer_dict():
     assert "GAG" in kmer_dict
     assert kmer_dict["AGA"] == 2
 
+def test_pack_kmers():
+    kmers = pack_kmers(encode_sequence("TCAGNAGA"), 3)
+    assert list(kmers) == [encode_kmer("TCA"), encode_kmer("CAG"),
+                           encode_kmer("AGA")]
+    assert encode_kmer("TCA") == 0b110100
+
+
+def test_kmer_counter():
+    kmer_dict = KmerCounter(3, capacite=16)
+    kmer_dict.add_kmers(pack_kmers(encode_sequence("TCAGAGA"), 3))
+    assert len(kmer_dict) == 4
+    assert kmer_dict["AGA"] == 2
+    assert "TTT" not in kmer_dict
+    assert dict(kmer_dict.items()) == {"TCA": 1, "CAG": 1, "AGA": 2, "GAG": 1}
+
+
+def test_build_kmer_dict_canonical():
+    kmer_dict = build_kmer_dict(os.path.abspath(os.path.join(os.path.dirname(__file__), "test_build.fq")), 3, canonical=True)
+    # TCA/TGA, CAG/CTG, AGA/TCT, GAG/CTC
+    assert len(kmer_dict) == 4
+    assert "TGA" in kmer_dict
+    assert kmer_dict["TCT"] == kmer_dict["AGA"] == 2
+    assert reverse_complement("TCAG") == "CTGA"
+
+
+def test_build_kmer_dict_threads():
+    fastq = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    kmer_dict = build_kmer_dict(fastq, 21)
+    kmer_dict_threads = build_kmer_dict(fastq, 21, threads=2)
+    assert dict(kmer_dict_threads.items()) == dict(kmer_dict.items())
+    assert kmer_dict_threads.nb_reads == kmer_dict.nb_reads == 2
+    assert kmer_dict_threads.nb_kmers == kmer_dict.nb_kmers
+
+
+def test_build_kmer_dict_min_abundance():
+    fastq = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    kmer_dict = build_kmer_dict(fastq, 21)
+    solides = {kmer: nb for kmer, nb in kmer_dict.items() if nb >= 2}
+    kmer_dict_bloom = build_kmer_dict(fastq, 21, min_abundance=2)
+    assert dict(kmer_dict_bloom.items()) == solides
+    assert kmer_dict_bloom.stats["kmers_solid"] == len(solides)
+    kmer_dict_threads = build_kmer_dict(fastq, 21, threads=2, min_abundance=2)
+    assert dict(kmer_dict_threads.items()) == solides
+
+
+def test_build_kmer_dict_reuse():
+    fastq = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    compteur = KmerCounter(21)
+    compteur.add_kmers(pack_kmers(encode_sequence("A" * 40), 21))
+    capacite = compteur.nbytes
+    kmer_dict = build_kmer_dict(fastq, 21, compteur=compteur)
+    assert kmer_dict is compteur and compteur.nbytes >= capacite
+    assert dict(kmer_dict.items()) == dict(build_kmer_dict(fastq, 21).items())
+    assert kmer_dict.nb_reads == 2
+
+
+def test_read_manifest(tmp_path):
+    manifeste = tmp_path / "samples.tsv"
+    manifeste.write_text("# reads\tcontigs\n\na.fq\tout/a.fa\n"
+                         "/data/b.fq\tb.fa\tsample_b\n")
+    assert read_manifest(str(manifeste)) == [
+        {"name": "a.fq", "input": str(tmp_path / "a.fq"),
+         "output": str(tmp_path / "out" / "a.fa")},
+        {"name": "sample_b", "input": "/data/b.fq",
+         "output": str(tmp_path / "b.fa")}]
+    manifeste.write_text("a.fq\n")
+    with pytest.raises(ValueError):
+        read_manifest(str(manifeste))
+
+
+def test_kmer_index(tmp_path):
+    fastq = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    kmer_dict = build_kmer_dict(fastq, 21, canonical=True)
+    save_kmer_index(kmer_dict, str(tmp_path / "index.kidx"))
+    kmer_index = KmerIndex(str(tmp_path / "index.kidx"))
+    assert kmer_index.k == 21 and kmer_index.canonical
+    assert kmer_index.nb_reads == 2
+    assert kmer_index.nb_kmers == kmer_dict.nb_kmers
+    assert dict(kmer_index.items()) == dict(kmer_dict.items())
+    kmer = next(iter(kmer_dict))
+    assert kmer_index[reverse_complement(kmer)] == kmer_dict[kmer]
+    assert "A" * 21 not in kmer_index
+    assert nx.utils.graphs_equal(build_graph(kmer_index), build_graph(kmer_dict))
+
+
+def test_cached_kmer_dict(tmp_path):
+    fastq = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    kmer_index = cached_kmer_dict(fastq, 21, dossier=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+    index = os.path.join(tmp_path, os.listdir(tmp_path)[0])
+    date = os.path.getmtime(index)
+    relu = cached_kmer_dict(fastq, 21, dossier=str(tmp_path))
+    assert dict(relu.items()) == dict(kmer_index.items())
+    assert (relu.nb_reads, relu.nb_kmers) == (2, kmer_index.nb_kmers)
+    assert os.path.getmtime(index) == date
+    cached_kmer_dict(fastq, 15, dossier=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 2
+    # autres paramètres du filtre de Bloom, même nom dans un autre dossier
+    cached_kmer_dict(fastq, 21, min_abundance=2, bloom_fpr=0.01, dossier=str(tmp_path))
+    cached_kmer_dict(fastq, 21, min_abundance=2, bloom_fpr=0.05, dossier=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 4
+    copie = tmp_path / "copie"
+    copie.mkdir()
+    with open(fastq, "rb") as filin:
+        (copie / os.path.basename(fastq)).write_bytes(filin.read())
+    cached_kmer_dict(str(copie / os.path.basename(fastq)), 21, dossier=str(tmp_path))
+    assert len([nom for nom in os.listdir(tmp_path) if nom.endswith(".kidx")]) == 5
+    # le bilan du prétraitement est rejoué quand l'index est repris
+    filtre = ReadFilter(qualite_min=30)
+    cached_kmer_dict(fastq, 21, dossier=str(tmp_path), filtre=filtre)
+    rejoue = ReadFilter(qualite_min=30)
+    cached_kmer_dict(fastq, 21, dossier=str(tmp_path), filtre=rejoue)
+    assert rejoue.stats == filtre.stats and rejoue.stats["fragments"] > 0
+
+
+def test_split_superkmers():
+    codes = encode_sequence("TCAGAGAATCTGNCAGAGAATCTG")
+    partitions, debuts, longueurs = split_superkmers(codes, 5, 4)
+    # chaque k-mer valide appartient à un seul super-k-mer
+    assert (longueurs - 4).sum() == len(pack_kmers(codes, 5))
+    assert (partitions >= 0).all() and (partitions < 4).all()
+    # un read et son reverse complément ont les mêmes partitions
+    brin = encode_sequence("TCAGAGAATCTG")
+    inverse = encode_sequence(reverse_complement("TCAGAGAATCTG"))
+    assert sorted(split_superkmers(brin, 5, 4, True)[0]) == \
+        sorted(split_superkmers(inverse, 5, 4, True)[0])
+
+
+def test_count_kmers_external(tmp_path):
+    fastq = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    for canonical in (False, True):
+        for min_abundance in (1, 2):
+            attendu = build_kmer_dict(fastq, 15, canonical,
+                                      min_abundance=min_abundance)
+            kmer_index = count_kmers_external(fastq, 15, canonical, 1 << 20,
+                                              min_abundance,
+                                              dossier=str(tmp_path))
+            cles, occurences = kmer_index.packed()
+            assert np.array_equal(cles, attendu.packed()[0])
+            assert np.array_equal(occurences, attendu.packed()[1])
+            assert kmer_index.nb_kmers == attendu.nb_kmers
+    assert os.listdir(tmp_path) == []
+
+
+def test_count_kmers_external_open_files(tmp_path):
+    fastq = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    attendu = build_kmer_dict(fastq, 15)
+    limite = resource.getrlimit(resource.RLIMIT_NOFILE)
+    # budget minuscule : autant de partitions et de tranches que permis
+    resource.setrlimit(resource.RLIMIT_NOFILE, (128, limite[1]))
+    try:
+        kmer_index = count_kmers_external(fastq, 15, max_memory=1,
+                                          dossier=str(tmp_path))
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, limite)
+    assert kmer_index.stats["partitions"] == 128 - 64
+    assert np.array_equal(kmer_index.packed()[0], attendu.packed()[0])
+    assert np.array_equal(kmer_index.packed()[1], attendu.packed()[1])
+
+
+def test_merge_kmer_counts():
+    ancien = KmerCounter(3)
+    ancien.add_kmers(pack_kmers(encode_sequence("TCAGA"), 3))
+    nouveau = KmerCounter(3)
+    nouveau.add_kmers(pack_kmers(encode_sequence("CAGAT"), 3))
+    cles, occurences = merge_kmer_counts(ancien, nouveau)
+    assert list(cles) == sorted(cles)
+    assert dict(zip(cles.tolist(), occurences.tolist())) == {
+        encode_kmer("TCA"): 1, encode_kmer("CAG"): 2, encode_kmer("AGA"): 2,
+        encode_kmer("GAT"): 1}
+
+
+def test_update_options(tmp_path, monkeypatch):
+    fastq = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    etat = str(tmp_path / "etat")
+    monkeypatch.setattr("sys.argv", ["debruijn.py", "-i", fastq, "-k", "21",
+                                     "-o", str(tmp_path / "a.fa"), "--update", etat])
+    run_assembly(get_arguments())
+    # -k auto et --trim : k est relu dans l'état avant le prétraitement
+    monkeypatch.setattr("sys.argv", ["debruijn.py", "-i", fastq, "-k", "auto", "--trim", "-o", str(tmp_path / "b.fa"),
+                                     "--update", etat])
+    args = get_arguments()
+    run_assembly(args)
+    assert args.kmer_size == 21
+    assert read_update_state(etat)["k"] == 21
+    assert read_update_state(str(tmp_path)) is None
+    # options de comptage différentes de celles de l'état
+    for options in (["-k", "15"], ["--canonical"], ["--min-abundance", "2"]):
+        monkeypatch.setattr("sys.argv", ["debruijn.py", "-i", fastq, "-o", str(tmp_path / "c.fa"),
+                                         "--update", etat] + options)
+        with pytest.raises(SystemExit, match=options[0]):
+            run_assembly(get_arguments())
+    assert read_update_state(etat)["reads"] == 4
+
+
+def test_kmer_spectra():
+    reads = ["TCAGAGAT", "TCAGAGCT", "AGAG"]
+    spectres = kmer_spectra(reads, [3, 5])
+    # k=3 : TCA CAG 2 fois, GAG 3 fois, AGA 4 fois, GAT AGC GCT 1 fois
+    assert list(spectres[3]) == [0, 3, 2, 1, 1]
+    assert list(spectres[5]) == [0, 4, 2]
+    estimation = estimate_spectrum(spectres[3], 3)
+    assert estimation["distinct_kmers"] == 7
+    assert estimation["genomic_kmers"] == 7
+
+
+def test_choose_kmer_size():
+    fastq = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    k, estimations = choose_kmer_size(fastq, candidats=[15, 21, 27])
+    assert k in (15, 21, 27)
+    assert [estimation["k"] for estimation in estimations] == [15, 21, 27]
+
+
+def test_count_batches():
+    fastq = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    lots, nb_reads = encode_reads(fastq)
+    assert nb_reads == 2
+    for k in (15, 21):
+        assert dict(count_batches(lots, k).items()) == \
+            dict(build_kmer_dict(fastq, k).items())
+    kmer_dict = count_batches(lots, 21, canonical=True)
+    assert dict(kmer_dict.items()) == \
+        dict(build_kmer_dict(fastq, 21, canonical=True).items())
+
+
+def test_add_pseudo_reads():
+    kmer_dict = KmerCounter(3)
+    kmer_dict.add_kmers(pack_kmers(encode_sequence("TCAGA"), 3))
+    # TCA CAG AGA déjà comptés, GAT ajouté
+    assert add_pseudo_reads(kmer_dict, ["CAGAT"], 2) == 1
+    assert kmer_dict["CAG"] == 1
+    assert kmer_dict["GAT"] == 2
+
+
+def test_read_filter():
+    # qualités : I = 40, # = 2 ; la queue de mauvaise qualité est coupée
+    # et le read découpé au N
+    records = [(b"ACGTACNGTACGTT", b"IIIIIIIIIIII##"), (b"ACG", b"III")]
+    filtre = ReadFilter(qualite_min=20, longueur_min=4)
+    fragments = [bytes(fragment) for fragment in filtre(records)]
+    assert fragments == [b"ACGTAC", b"GTACG"]
+    assert filtre.stats == {"reads": 2, "bases": 17, "fragments": 2, "kept_bases": 11}
+    # fasta : pas de qualité, seul le découpage aux N s'applique
+    assert [bytes(fragment) for fragment in filtre([(b"ACGTNACGTT", None)])] == \
+        [b"ACGT", b"ACGTT"]
+
+
+def test_build_kmer_dict_trim(tmp_path):
+    fastq = str(tmp_path / "reads.fq")
+    with open(fastq, "w") as filout:
+        filout.write("@r1\nTCAGAGAT\n+\nIIIII###\n@r2\nTCANAGAT\n+\nIIIIIIII\n")
+    kmer_dict = build_kmer_dict(fastq, 3, filtre=ReadFilter(20, 3))
+    # TCAGA (queue coupée), TCA et AGAT (coupés au N)
+    assert dict(kmer_dict.items()) == {"TCA": 2, "CAG": 1, "AGA": 2, "GAT": 1}
+    assert kmer_dict.nb_reads == 2
+
+
+def test_bloom_filter():
+    bloom = BloomFilter.for_capacity(100)
+    cles = np.arange(100, dtype=np.uint64)
+    assert not bloom.add(cles).any()
+    assert bloom.add(cles).all()
+
+
 def test_build_graph():
     file = open(os.path.abspath(os.path.join(os.path.dirname(__file__), "kmer.pck")),'rb')
     kmer_dict = pickle.load(file)
@@ -52,6 +355,25 @@ def test_build_graph():
     assert graph.edges["AG", "GA"]['weight'] == 2
     file.close()
 
+def test_build_graph_canonical():
+    graph = build_graph({"AGA": 2, "CAG": 1}, canonical=True)
+    assert graph.edges["AG", "GA"]['weight'] == 2
+    assert graph.edges["TC", "CT"]['weight'] == 2
+    assert graph.edges["CT", "TG"]['weight'] == 1
+    assert graph.number_of_edges() == 4
+
+def test_build_compacted_graph():
+    file = open(os.path.abspath(os.path.join(os.path.dirname(__file__), "kmer.pck")),'rb')
+    kmer_dict = pickle.load(file)
+    graph = build_compacted_graph(kmer_dict)
+    # TC CA | AG GA -> unitigs TCA et AGA, GAG boucle sur AGA
+    assert set(graph.nodes) == {"TCA", "AGA"}
+    assert graph.edges["TCA", "AGA"]['weight'] == 1
+    assert graph.edges["AGA", "AGA"]['weight'] == 1
+    assert graph.nodes["AGA"]["coverage"] == 2
+    assert graph.nodes["TCA"]["length"] == 3
+    file.close()
+
 # def test_build_graph_comp():
 #     file = open(os.path.abspath(os.path.join(os.path.dirname(__file__), "kmer_comp.pck")),'rb')
 #     kmer_dict = pickle.load(file)
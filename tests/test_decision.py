@@ -13,6 +13,10 @@ from debruijn import solve_bubble
 from debruijn import simplify_bubbles
 from debruijn import solve_entry_tips
 from debruijn import solve_out_tips
+from debruijn import find_bubble_start
+from debruijn import bounded_paths
+from debruijn import build_compacted_graph
+from debruijn import get_sink_nodes
 
 def test_std():
     assert round(std([9, 5, 15, 20]), 1) == 6.6
@@ -143,6 +147,40 @@ def test_simplify_bubbles():
     assert (2,10) not in graph_1.edges()
     assert (10, 5) not in graph_1.edges()
 
+def test_find_bubble_start():
+    graph = nx.DiGraph()
+    graph.add_edges_from([(1, 2), (2, 3), (3, 4), (2, 5), (5, 6), (6, 4), (4, 7)])
+    assert find_bubble_start(graph, 4) == 2
+    assert find_bubble_start(graph, 4, profondeur_max=1) is None
+    assert find_bubble_start(graph, 7) is None
+
+
+def test_bounded_paths():
+    graph = nx.DiGraph()
+    graph.add_edges_from([(2, 4), (4, 5), (2, 10), (10, 5), (2, 8), (8, 9), (9, 5)])
+    assert sorted(bounded_paths(graph, 2, 5)) == [[2, 4, 5], [2, 8, 9, 5], [2, 10, 5]]
+    assert sorted(bounded_paths(graph, 2, 5, longueur_max=2)) == [[2, 4, 5], [2, 10, 5]]
+    assert bounded_paths(graph, 2, 5, nb_chemins_max=2) is None
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(1, 2, 10), (2, 4, 15), (4, 5, 15), (2, 8, 3),
+                                   (8, 9, 3), (9, 5, 3)])
+    graph = solve_bubble(graph, 2, 5, nb_chemins_max=1)
+    assert 8 in graph.nodes()
+
+
+def test_simplify_bubbles_report():
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(1, 2, 5), (2, 3, 5), (3, 4, 5), (2, 5, 1),
+                                   (5, 4, 1), (4, 6, 5), (6, 7, 5), (6, 8, 1),
+                                   (8, 9, 1), (7, 10, 5), (9, 10, 1)])
+    report = {}
+    graph = simplify_bubbles(graph, report)
+    assert report["bubbles"]["removed"] == 2
+    assert 5 not in graph.nodes()
+    assert 8 not in graph.nodes()
+    assert 9 not in graph.nodes()
+
+
 def test_solve_entry_tips():
     graph_1 = nx.DiGraph()
     graph_1.add_weighted_edges_from([(1, 2, 10), (3, 2, 2), (2, 4, 15), (4, 5, 15)])
@@ -157,6 +195,51 @@ def test_solve_entry_tips():
     assert (6, 3) in graph_2.edges()
     assert (3, 2) in graph_2.edges()
 
+def test_solve_entry_tips_sweep():
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(1, 2, 10), (2, 3, 10), (4, 3, 1), (3, 5, 10),
+                                   (5, 6, 10), (7, 6, 1), (6, 8, 10)])
+    report = {}
+    graph = solve_entry_tips(graph, [1, 4, 7], report)
+    assert report["entry_tips"]["removed"] == 2
+    assert 4 not in graph.nodes()
+    assert 7 not in graph.nodes()
+    assert (6, 8) in graph.edges()
+
+
+def test_solve_tips_upstream_branch():
+    # le tronc se divise en 3 avant que la pointe ne le rejoigne en 5
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(1, 2, 10), (2, 3, 10), (3, 4, 10), (4, 5, 10),
+                                   (5, 6, 10), (3, 7, 1), (8, 5, 1)])
+    report = {}
+    graph = solve_entry_tips(graph, [1, 8], report)
+    assert report["entry_tips"]["removed"] == 1
+    assert 8 not in graph.nodes()
+    assert (4, 5) in graph.edges()
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(1, 2, 10), (2, 3, 10), (3, 4, 10), (4, 5, 10),
+                                   (5, 6, 10), (7, 4, 1), (3, 8, 1)])
+    graph = solve_out_tips(graph, [6, 8], report)
+    assert report["out_tips"]["removed"] == 1
+    assert 8 not in graph.nodes()
+    assert (2, 3) in graph.edges()
+
+
+def test_solve_tips_repeat_end():
+    # génome A R B R C : ses extrémités peu couvertes A et C rejoignent
+    # la répétition R, qui n'est pas une pointe, et doivent rester
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(1, 2, 1), (2, 3, 2), (3, 4, 20), (4, 5, 10),
+                                   (5, 6, 10), (6, 3, 10), (4, 7, 10), (7, 8, 2)])
+    report = {}
+    graph = solve_entry_tips(graph, [1], report)
+    graph = solve_out_tips(graph, [8], report)
+    assert report["entry_tips"]["removed"] == 0
+    assert report["out_tips"]["removed"] == 0
+    assert graph.number_of_nodes() == 8
+
+
 def test_solve_out_tips():
     graph_1 = nx.DiGraph()
     graph_1.add_weighted_edges_from([(1, 2, 15), (2, 3, 15), (3, 4, 15), (4, 5, 15), (4, 6, 2)])
@@ -168,3 +251,20 @@ def test_solve_out_tips():
     graph_2 = solve_out_tips(graph_2, [5, 7])  
     assert (4, 5) not in graph_2.edges()
     assert (6, 7) in graph_2.edges() 
+
+
+def test_solve_out_tips_compacted():
+    # tronc commun très couvert puis deux sorties : une longue branche
+    # (occurence 5) et une pointe courte (occurence 4)
+    tronc = "ACGTTGCATGCCGATAGGCT"
+    branche = "TACCGGAATTCCTGAGCAGTTCAAGCGTA"
+    pointe = "GGTCCA"
+    dico = {}
+    for sequence, occurence in ((tronc, 40), (tronc[-4:] + branche, 5), (tronc[-4:] + pointe, 4)):
+        for i in range(len(sequence) - 4):
+            dico[sequence[i:i + 5]] = occurence
+    graph = build_compacted_graph(dico)
+    graph = solve_out_tips(graph, get_sink_nodes(graph))
+    sorties = [noeud for noeud in graph if graph.out_degree(noeud) == 0]
+    assert len(sorties) == 1
+    assert sorties[0].endswith(branche)